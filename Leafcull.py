@@ -4,111 +4,642 @@ Created on 28 Mar 2011
 @author: Simon Bull
 '''
 
+import array
 import collections
+import concurrent.futures
+import heapq
+import os
+import time
 
-def main(adjList):
+# The types of removal recorded when culling connected components separately.
+_CLIQUE = 0
+_NEIGHBOURCULL = 1
+# The simplicial status of a node during the clique phase.
+_UNCHECKED = 0
+_SIMPLICIAL = 1
+_NOT_SIMPLICIAL = 2
+# Bitsets of neighbours are used for graphs with at most this many nodes and at least this proportion of possible edges.
+_MAX_BITSET_NODES = 8192
+_MIN_BITSET_DENSITY = 0.05
+# Connected components with fewer edges than this are batched together when culling components in parallel.
+_MIN_BATCH_EDGES = 10000
+# The number of bits set in an integer.
+_popcount = getattr(int, 'bit_count', None) or (lambda x: bin(x).count('1'))
+
+def main(adjList, stats=None):
     """The method by which the Leaf algorithm determines which nodes to remove from the dataset.
 
+    Whenever a choice has to be made between nodes (which clique to remove first, or which of several nodes with the
+    maximum number of neighbours to remove), the node with the smallest identifier is chosen. This makes the culling
+    independent of the iteration order of the sets in adjList.
+
+    The graph is converted to the compact integer form used by cull_csr before the culling is performed, and adjList is
+    not modified.
+
+    If stats is supplied, then counters describing the work done during the culling are added to it (see cull_csr).
+
     :param adjList: An adjacency list representation of the protein similarity graph.
     :type adjList:  dictionary
+    :param stats:   A dictionary to record the culling statistics in (not used if None).
+    :type stats:    dictionary
     :returns :      The proteins that should be removed from the dataset.
     :type :         list
 
     """
 
-    removeList = []
-    if not adjList:
-        # If the graph supplied is empty (i.e. no redundancy is present)
-        return removeList
+    offsets, neighbours, nodeIDs = build_csr(adjList)
+    return cull_csr(offsets, neighbours, nodeIDs, stats=stats)
+
+
+def create_adjacency(similarities):
+    """Create the adjacency list of the protein similarity graph from the pairs of proteins that are too similar.
+
+    :param similarities:    The similarities between pairs of proteins as (similarity, proteinA, proteinB) tuples.
+    :type similarities:     iterable
+    :returns :              An adjacency list representation of the protein similarity graph.
+    :type :                 dictionary
+
+    """
+
+    adjList = {}
+    for _, proteinA, proteinB in similarities:
+        if proteinA in adjList:
+            adjList[proteinA].add(proteinB)
+        else:
+            adjList[proteinA] = set([proteinB])
+        if proteinB in adjList:
+            adjList[proteinB].add(proteinA)
+        else:
+            adjList[proteinB] = set([proteinA])
+    return adjList
+
+
+def build_csr(adjList):
+    """Convert an adjacency list into the compressed sparse row (CSR) form used by cull_csr.
+
+    The nodes are numbered in sorted order of their identifiers, which means that the integer based culling makes
+    exactly the same choices as main. Self-similarities are not recorded.
+
+    :param adjList: An adjacency list representation of the protein similarity graph.
+    :type adjList:  dictionary
+    :returns :      The offsets into the neighbour array (node i's neighbours are neighbours[offsets[i]:offsets[i + 1]]),
+                    the neighbour array and the identifier of each node.
+    :type :         array, array and list
+
+    """
+
+    nodes = set(adjList)
+    for i in adjList.values():
+        nodes.update(i)
+    nodeIDs = sorted(nodes)
+    nodeIndices = dict((j, i) for i, j in enumerate(nodeIDs))
+
+    offsets = array.array('q', [0])
+    neighbours = array.array('q')
+    for i in nodeIDs:
+        neighbours.extend(sorted(nodeIndices[j] for j in adjList.get(i, ()) if j != i))
+        offsets.append(len(neighbours))
+
+    return offsets, neighbours, nodeIDs
+
+
+def cull_csr(offsets, neighbours, nodeIDs, bitsets=None, stats=None):
+    """Run the Leaf algorithm on a similarity graph supplied in compressed sparse row (CSR) form.
+
+    The nodes are the integers 0 to len(nodeIDs) - 1, and the neighbours of node i are neighbours[offsets[i]:offsets[i + 1]].
+    The graph must be undirected (if j is a neighbour of i then i must be a neighbour of j). Both offsets and neighbours
+    can be any integer sequence, e.g. an array.array or a NumPy array.
+
+    Ties are broken in favour of the node with the lowest index, so when the nodes are numbered in sorted order of their
+    identifiers (as build_csr does) the result is the same as that of main.
+
+    If stats is supplied, then the following counters are added to it (counters already in it are added to, and peaks
+    are the maximum of the existing and new values):
+        nodes, edges                    The size of the graph.
+        cliqueIterations                The number of candidates taken from the clique phase worklist.
+        simplicialChecks                The number of checks of whether a node is simplicial.
+        setOperations                   The number of neighbourhood intersections/unions performed (one per neighbour
+                                        list scanned or bitset operation) by the simplicial checks and tie-breaks.
+        cliquesRemoved                  The number of cliques removed.
+        neighbourCullRemovals           The number of nodes removed by NeighbourCull.
+        tieBreaks                       The number of NeighbourCull operations with more than one node with the
+                                        maximum number of neighbours.
+        extendedSizeCacheHits           The number of extended neighbourhood sizes reused from the cache.
+        setupTime, cliquePhaseTime, neighbourCullTime
+                                        The time (in seconds) spent setting up and in each phase.
+        peakBucketSize                  The largest number of nodes with the same (non-zero) number of neighbours.
+        peakTiedNodes                   The largest number of nodes sharing the maximum number of neighbours.
+    Collecting the statistics adds a few checks to the culling, and nothing is collected when stats is None.
+
+    :param offsets:     The offsets of each node's neighbours in the neighbours sequence (one more entry than there are nodes).
+    :type offsets:      sequence of integers
+    :param neighbours:  The concatenated neighbours of every node.
+    :type neighbours:   sequence of integers
+    :param nodeIDs:     The identifier of each node.
+    :type nodeIDs:      list
+    :param bitsets:     Whether to also store each node's neighbours as a bitset. None means bitsets are used only when
+                        the graph is small and dense enough for them to be worthwhile.
+    :type bitsets:      boolean
+    :param stats:       A dictionary to record the culling statistics in (not used if None).
+    :type stats:        dictionary
+    :returns :          The proteins that should be removed from the dataset.
+    :type :             list
+
+    """
+
+    removeList = _cull_indices(_int_view(offsets), _int_view(neighbours), len(nodeIDs), bitsets=bitsets, stats=stats)
+    return [nodeIDs[i] for i in removeList]
+
+
+def parallel_main(adjList, processes=None, stats=None):
+    """Run the Leaf algorithm separately on each connected component of the protein similarity graph.
+
+    The Leaf algorithm never makes a decision that involves nodes from more than one connected component, so the
+    components can be culled independently. Components that are cliques (including pairs of nodes) are culled directly,
+    and the rest are culled in a pool of processes with the largest components submitted first. The removals made in
+    each component are then merged into the order in which main would have made them, and so the list returned is
+    identical to the one returned by main.
+
+    :param adjList:     An adjacency list representation of the protein similarity graph.
+    :type adjList:      dictionary
+    :param processes:   The number of processes to use (defaults to the number of CPUs).
+    :type processes:    integer
+    :param stats:       A dictionary to record the culling statistics in (see cull_csr), along with the number of
+                        components and the number of those that were cliques (not used if None).
+    :type stats:        dictionary
+    :returns :          The proteins that should be removed from the dataset.
+    :type :             list
+
+    """
+
+    componentEvents = []
+    counters = None if stats is None else collections.Counter()
+    batches = []  # The components to cull in the process pool.
+    smallComponents = []  # Small components are batched together to limit the number of tasks sent to the pool.
+    smallSize = 0
+    for component in connected_components(adjList):
+        numEdges = sum(len(adjList[i]) for i in component)
+        if counters is not None:
+            counters['components'] += 1
+        if numEdges == len(component) * (len(component) - 1):
+            # The component is a clique, so all but the node with the smallest identifier are removed.
+            component = sorted(component)
+            componentEvents.append([(_CLIQUE, len(component) - 1, component[0], component[1:])])
+            if counters is not None:
+                counters['cliqueComponents'] += 1
+                counters['nodes'] += len(component)
+                counters['edges'] += numEdges // 2
+                counters['cliquesRemoved'] += 1
+        elif numEdges >= _MIN_BATCH_EDGES:
+            batches.append((numEdges, [component]))
+        else:
+            smallComponents.append(component)
+            smallSize += numEdges
+            if smallSize >= _MIN_BATCH_EDGES:
+                batches.append((smallSize, smallComponents))
+                smallComponents = []
+                smallSize = 0
+    if smallComponents:
+        batches.append((smallSize, smallComponents))
+
+    if batches:
+        batches.sort(key=lambda x: x[0], reverse=True)
+        with concurrent.futures.ProcessPoolExecutor(processes or os.cpu_count()) as executor:
+            futures = []
+            for _, batch in batches:
+                batch = [build_csr(dict((i, adjList[i]) for i in component)) for component in batch]
+                futures.append(executor.submit(_cull_components, batch, counters is not None))
+            for i in futures:
+                events, batchCounters = i.result()
+                componentEvents.extend(events)
+                if counters is not None:
+                    _merge_stats(counters, batchCounters)
+
+    if stats is not None:
+        _merge_stats(stats, counters)
+    return _merge_events(componentEvents)
+
+
+def connected_components(adjList):
+    """Determine the connected components of a graph using union-find.
+
+    :param adjList: An adjacency list representation of the graph.
+    :type adjList:  dictionary
+    :returns :      The nodes in each connected component.
+    :type :         list of lists
+
+    """
+
+    parent = dict((i, i) for i in adjList)
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
 
-    # Determine number of neighbours for each node.
-    neighbours = collections.defaultdict(set)
     for i in adjList:
-        numNeighbours = len(adjList[i])
-        neighbours[numNeighbours].add(i)
-    # Fill in the blank keys.
-    for i in set(range(max(neighbours))) - set(neighbours):
-        neighbours[i]  # Defaultdict automatically creates an empty set here.
+        for j in adjList[i]:
+            if j not in parent:
+                parent[j] = j
+            rootI = find(i)
+            rootJ = find(j)
+            if rootI != rootJ:
+                parent[rootJ] = rootI
 
-    while True:
-        # Determine the maximum number of neighbours.
-        maxNeighbours = max(neighbours)
-        while maxNeighbours > 0 and (not neighbours[maxNeighbours]):
-            del neighbours[maxNeighbours]
-            maxNeighbours -= 1
+    components = collections.defaultdict(list)
+    for i in parent:
+        components[find(i)].append(i)
+    return list(components.values())
 
-        # If there are no nodes with neighbours then exit.
-        if maxNeighbours == 0:
-            return removeList
-
-        nClique = 1
-        while nClique <= maxNeighbours:
-            nodesOfInterest = neighbours[nClique]  # Get the nodes with nClique neighbours.
-            # For every node of interest see if the neighbours of the node are all neighbours of each other (i.e. a clique).
-            for i in nodesOfInterest:
-                neighboursOfInterest = adjList[i]
-                if neighboursOfInterest.intersection(*[adjList[j].union([j]) for j in neighboursOfInterest]) == neighboursOfInterest:
-                    # i's neighbours are all connected to one another, and therefore i participates in a clique with all of its neighbours where
-                    # it is connected only to nodes in the clique.
-                    toRemove = set(adjList[i])  # Make a duplicate to prevent Set changed size during iteration errors.
-                    removeList.extend(toRemove)  # Mark all the removed nodes as removed.
-                    neighbours[nClique].remove(i)  # Node i no longer has nClique neighbours.
-                    neighbours[0].add(i)  # Node i now has no neighbours.
-                    adjList[i] = set([])  # Update the adjacency list to reflect the fact that i has no neighbours.
-                    neighboursOfRemoved = set([k for j in toRemove for k in adjList[j]])
-                    for j in neighboursOfRemoved:
-                        neighboursRemoved = adjList[j].intersection(toRemove)
-                        numNeighbours = len(adjList[j])
-                        neighbours[numNeighbours].remove(j)
-                        neighbours[numNeighbours - len(neighboursRemoved)].add(j)
-                        adjList[j] -= neighboursRemoved
-                    # Update the adjacency list to reflect the removal of the nodes in toRemove.
-                    for j in toRemove:
-                        numNeighbours = len(adjList[j])
-                        neighbours[numNeighbours].remove(j)
-                        neighbours[0].add(j)
-                        adjList[j] = set([])
-                    nClique = 1
-                    break
+
+def _cull_components(batch, collectStats=False):
+    """Cull a batch of connected components, recording the removals made in each one.
+
+    :param batch:           The CSR form (offsets, neighbours and node identifiers) of each component.
+    :type batch:            list
+    :param collectStats:    Whether to collect statistics about the culling.
+    :type collectStats:     boolean
+    :returns :              The removals made in each component, with node indices converted to identifiers, and the
+                            statistics (None if they were not collected).
+    :type :                 list of lists and dictionary
+
+    """
+
+    componentEvents = []
+    stats = {} if collectStats else None
+    for offsets, neighbours, nodeIDs in batch:
+        events = []
+        _cull_indices(_int_view(offsets), _int_view(neighbours), len(nodeIDs), events, stats=stats)
+        componentEvents.append([i[:-2] + (nodeIDs[i[-2]], [nodeIDs[j] for j in i[-1]]) for i in events])
+    return componentEvents, stats
+
+
+def _merge_stats(stats, counters):
+    """Add culling statistics to a record of statistics.
+
+    Counters whose names start with peak are combined by taking the maximum, and all others by summing.
+
+    :param stats:       The record of statistics to add to.
+    :type stats:        dictionary
+    :param counters:    The statistics to add.
+    :type counters:     dictionary
+
+    """
+
+    for i in counters:
+        if i.startswith('peak'):
+            stats[i] = max(stats.get(i, 0), counters[i])
+        else:
+            stats[i] = stats.get(i, 0) + counters[i]
+
+
+def _merge_events(componentEvents):
+    """Merge the removals made in separate connected components into the order a culling of the whole graph makes them.
+
+    Cliques are always removed before any NeighbourCull operation, with the clique of smallest degree (and then smallest
+    node identifier) removed first. When no component has a clique to remove, the NeighbourCull removal with the largest
+    degree, then smallest extended neighbourhood and then smallest node identifier is made. After each removal the next
+    removal of that component becomes eligible.
+
+    :param componentEvents: The removals made in each component, in the order they were made.
+    :type componentEvents:  list of lists
+    :returns :              The nodes removed.
+    :type :                 list
+
+    """
+
+    removeList = []
+    cliques = []  # Heap of the next removal of every component whose next removal is a clique.
+    neighbourCulls = []  # Heap of the next removal of every component whose next removal is a NeighbourCull.
+
+    def push_next(component, position):
+        if position < len(componentEvents[component]):
+            event = componentEvents[component][position]
+            if event[0] == _CLIQUE:
+                heapq.heappush(cliques, (event[1], event[2], component, position))
             else:
-                # No clique found.
-                nClique += 1
+                heapq.heappush(neighbourCulls, (-event[1], event[2], event[3], component, position))
+
+    for i in range(len(componentEvents)):
+        push_next(i, 0)
+    while cliques or neighbourCulls:
+        nextRemoval = heapq.heappop(cliques) if cliques else heapq.heappop(neighbourCulls)
+        component = nextRemoval[-2]
+        position = nextRemoval[-1]
+        removeList.extend(componentEvents[component][position][-1])
+        push_next(component, position + 1)
+    return removeList
+
+
+def _int_view(values):
+    """Get a view of an integer sequence that can be indexed without copying it when possible.
+
+    :param values:  The sequence of integers.
+    :type values:   sequence of integers
+    :returns :      A view of the values.
+    :type :         memoryview
+
+    """
+
+    try:
+        return memoryview(values)
+    except TypeError:
+        # Not a buffer (e.g. a list), so copy into a compact array.
+        return memoryview(array.array('q', values))
+
+
+def _cull_indices(offsets, neighbours, numNodes, events=None, bitsets=None, stats=None):
+    """Run the Leaf algorithm on integer nodes stored in CSR form.
+
+    Removing a node from the graph only clears its entry in alive, and the CSR arrays are never modified. The live
+    neighbours of a node are therefore the alive nodes in its section of the neighbour array.
+
+    The clique phase is driven by a worklist rather than by rescanning every node after each clique is removed. A node
+    that is simplicial (its neighbours are all adjacent to one another) stays simplicial as other nodes are removed, and
+    a node that is not simplicial can only become simplicial when it loses a neighbour. Each node's simplicial status is
+    therefore only recomputed when its neighbourhood has changed since it was last checked. The candidates (nodes that
+    are simplicial or have not been checked since their neighbourhood changed) are kept in a heap ordered by degree and
+    then index, so the clique removed is always the one a scan upwards from degree 1 would find first.
+
+    The nodes are also grouped into buckets by their number of neighbours, with a pointer to the largest non-empty
+    bucket. Moving a node to the next bucket down when it loses a neighbour takes constant time, and as the number of
+    neighbours of a node never increases the pointer to the maximum only ever moves down.
+
+    The size of the extended neighbourhood of a node (the neighbours of the node and of its neighbours), which is used to
+    choose between nodes with the maximum number of neighbours, is cached. The extended neighbourhood of a node can only
+    change when a node within two hops of it is removed, i.e. when the node or one of its neighbours loses a neighbour.
+    Whenever a node loses a neighbour, the cached sizes of the node and its neighbours are therefore marked as out of date,
+    and only those sizes are recomputed when they are next needed. The nodes with the maximum number of neighbours are
+    kept in a heap ordered by (extended size, index), so that each tie-break only recomputes the sizes that have changed
+    rather than rescanning every tied node.
+
+    For dense graphs the neighbours of each node are also stored as a bitset (a Python integer with bit j set if node j
+    is a neighbour). The extended neighbourhood is then the bitwise or of a few bitsets, and checking whether a node is
+    simplicial needs only one bitwise operation per neighbour.
+
+    If events is supplied, then every removal is recorded in it along with the key that was used to choose it. Clique
+    removals are recorded as (_CLIQUE, degree, node, removed nodes) and NeighbourCull removals as
+    (_NEIGHBOURCULL, degree, extended neighbourhood size, node, [node]). This is what allows the removals made in
+    separate connected components to be merged back into the order that a single culling of the whole graph would make.
+
+    :param offsets:     The offsets of each node's neighbours in the neighbours sequence.
+    :type offsets:      memoryview
+    :param neighbours:  The concatenated neighbours of every node.
+    :type neighbours:   memoryview
+    :param numNodes:    The number of nodes in the graph.
+    :type numNodes:     integer
+    :param events:      A list to record the removals in (not used if None).
+    :type events:       list
+    :param bitsets:     Whether to use bitsets of neighbours (None to decide based on the size and density of the graph).
+    :type bitsets:      boolean
+    :param stats:       A dictionary to record the culling statistics in (not used if None).
+    :type stats:        dictionary
+    :returns :          The indices of the nodes that should be removed.
+    :type :             list
+
+    """
+
+    counters = None if stats is None else collections.Counter()  # Only collect statistics if they are wanted.
+    if counters is not None:
+        phaseStart = time.perf_counter()
+    removeList = []
+    alive = bytearray(b'\x01') * numNodes  # alive[i] is 0 once node i has been removed.
+    degree = array.array('q', [offsets[i + 1] - offsets[i] for i in range(numNodes)])
+    marks = array.array('q', [-1]) * numNodes  # Used to mark the nodes in a neighbourhood without allocating a set.
+    currentMark = 0
+    simplicial = bytearray(numNodes)  # The status of each node (_UNCHECKED, _SIMPLICIAL or _NOT_SIMPLICIAL).
+    extendedSizes = array.array('q', [0]) * numNodes  # The cached extended neighbourhood size of each node.
+    extendedSizeValid = bytearray(numNodes)  # Whether the cached extended neighbourhood size of each node is up to date.
+    tied = []  # A heap of (extended size, index) for the nodes with tiedDegree neighbours. May hold outdated entries.
+    tiedDegree = -1  # The number of neighbours of the nodes in tied (-1 until the heap is first built).
+    tiedChanged = []  # The tied nodes whose extended neighbourhood sizes may have changed since they entered tied.
+
+    numEdges = offsets[numNodes] if numNodes else 0
+    if bitsets is None:
+        bitsets = (numNodes <= _MAX_BITSET_NODES) and (numEdges >= _MIN_BITSET_DENSITY * numNodes * (numNodes - 1))
+    if bitsets:
+        # Bit j of neighbourBits[i] is set when j is a neighbour of i.
+        neighbourBits = []
+        for i in range(numNodes):
+            bitmap = bytearray((numNodes + 7) // 8)
+            for j in neighbours[offsets[i]:offsets[i + 1]]:
+                bitmap[j >> 3] |= 1 << (j & 7)
+            neighbourBits.append(int.from_bytes(bitmap, 'little'))
+
+    # Group the nodes by their number of neighbours. Each group (bucket) is a doubly linked list threaded through the
+    # nextInBucket and prevInBucket arrays, with bucketHeads[d] the first node with d neighbours (-1 if there are none).
+    # Nodes with no neighbours are not kept in a bucket.
+    maxNeighbours = max(degree) if numNodes else 0
+    bucketHeads = array.array('q', [-1]) * (maxNeighbours + 1)
+    nextInBucket = array.array('q', [-1]) * numNodes
+    prevInBucket = array.array('q', [-1]) * numNodes
+    bucketSizes = None if counters is None else array.array('q', [0]) * (maxNeighbours + 1)
+
+    def link(i, numNeighbours):
+        # Add node i to the front of the bucket for nodes with numNeighbours neighbours.
+        head = bucketHeads[numNeighbours]
+        nextInBucket[i] = head
+        prevInBucket[i] = -1
+        if head != -1:
+            prevInBucket[head] = i
+        bucketHeads[numNeighbours] = i
+        if bucketSizes is not None:
+            bucketSizes[numNeighbours] += 1
+            counters['peakBucketSize'] = max(counters['peakBucketSize'], bucketSizes[numNeighbours])
+
+    def unlink(i, numNeighbours):
+        # Remove node i from the bucket for nodes with numNeighbours neighbours.
+        previousNode = prevInBucket[i]
+        nextNode = nextInBucket[i]
+        if previousNode == -1:
+            bucketHeads[numNeighbours] = nextNode
+        else:
+            nextInBucket[previousNode] = nextNode
+        if nextNode != -1:
+            prevInBucket[nextNode] = previousNode
+        if bucketSizes is not None:
+            bucketSizes[numNeighbours] -= 1
+
+    # Make every node with neighbours a clique candidate.
+    candidates = []
+    for i in range(numNodes):
+        if degree[i]:
+            link(i, degree[i])
+            candidates.append((degree[i], i))
+    heapq.heapify(candidates)
+
+    def remove_nodes(toRemove):
+        # Take the nodes out of the graph, and then update the number of neighbours of the nodes that were adjacent to them.
+        for j in toRemove:
+            alive[j] = 0
+            if degree[j]:
+                unlink(j, degree[j])
+            degree[j] = 0
+        changed = set()
+        for j in toRemove:
+            for k in neighbours[offsets[j]:offsets[j + 1]]:
+                if alive[k]:
+                    numNeighbours = degree[k]
+                    unlink(k, numNeighbours)
+                    if numNeighbours > 1:
+                        link(k, numNeighbours - 1)
+                    degree[k] = numNeighbours - 1
+                    changed.add(k)
+                    if bitsets:
+                        neighbourBits[k] ^= 1 << j
+        # The nodes that lost neighbours need (re)checking, and simplicial nodes now have a smaller degree.
+        for k in changed:
+            extendedSizeValid[k] = 0
+            if degree[k] == tiedDegree:
+                tiedChanged.append(k)
+            for j in neighbours[offsets[k]:offsets[k + 1]]:
+                extendedSizeValid[j] = 0
+                if degree[j] == tiedDegree:
+                    tiedChanged.append(j)
+            if simplicial[k] == _NOT_SIMPLICIAL:
+                simplicial[k] = _UNCHECKED
+            if degree[k]:
+                heapq.heappush(candidates, (degree[k], k))
+
+    def is_simplicial(i, numNeighbours):
+        # Determine whether the neighbours of i are all neighbours of each other.
+        nonlocal currentMark
+        neighboursOfInterest = [j for j in neighbours[offsets[i]:offsets[i + 1]] if alive[j]]
+        if counters is not None:
+            counters['simplicialChecks'] += 1
+            counters['setOperations'] += numNeighbours
+        if bitsets:
+            # The only neighbour of i that each neighbour j of i is not adjacent to should be j itself.
+            for j in neighboursOfInterest:
+                if degree[j] < numNeighbours or (neighbourBits[i] & ~neighbourBits[j]) != (1 << j):
+                    return False
+            return True
+        currentMark += 1
+        marks[i] = currentMark
+        for j in neighboursOfInterest:
+            marks[j] = currentMark
+        for j in neighboursOfInterest:
+            # j must be adjacent to i and the other numNeighbours - 1 neighbours of i.
+            if degree[j] < numNeighbours:
+                return False
+            if sum(1 for k in neighbours[offsets[j]:offsets[j + 1]] if marks[k] == currentMark) != numNeighbours:
+                return False
+        return True
+
+    def extended_size(i):
+        # Determine the number of nodes that are neighbours of i or of one of i's neighbours.
+        nonlocal currentMark
+        if extendedSizeValid[i]:
+            # Nothing within two hops of i has been removed since the size was computed.
+            if counters is not None:
+                counters['extendedSizeCacheHits'] += 1
+            return extendedSizes[i]
+        closedNeighbourhood = [i] + [j for j in neighbours[offsets[i]:offsets[i + 1]] if alive[j]]
+        if counters is not None:
+            counters['setOperations'] += len(closedNeighbourhood)
+        if bitsets:
+            extendedNeighbourhood = 0
+            for j in closedNeighbourhood:
+                extendedNeighbourhood |= neighbourBits[j]
+            size = _popcount(extendedNeighbourhood)
+        else:
+            currentMark += 1
+            size = 0
+            for j in closedNeighbourhood:
+                for k in neighbours[offsets[j]:offsets[j + 1]]:
+                    if alive[k] and marks[k] != currentMark:
+                        marks[k] = currentMark
+                        size += 1
+        extendedSizes[i] = size
+        extendedSizeValid[i] = 1
+        return size
+
+    if counters is not None:
+        counters['nodes'] += numNodes
+        counters['edges'] += numEdges // 2
+        counters['setupTime'] += time.perf_counter() - phaseStart
+
+    while True:
+        # Remove cliques until there are no simplicial nodes left.
+        if counters is not None:
+            phaseStart = time.perf_counter()
+        while candidates:
+            nClique, i = heapq.heappop(candidates)
+            if counters is not None:
+                counters['cliqueIterations'] += 1
+            if degree[i] != nClique or simplicial[i] == _NOT_SIMPLICIAL:
+                # The entry is out of date (the node has been removed, lost neighbours or been checked since it was added).
+                continue
+            if simplicial[i] == _UNCHECKED:
+                if not is_simplicial(i, nClique):
+                    simplicial[i] = _NOT_SIMPLICIAL
+                    continue
+                simplicial[i] = _SIMPLICIAL
+            # i's neighbours are all connected to one another, so remove them and keep i.
+            toRemove = [j for j in neighbours[offsets[i]:offsets[i + 1]] if alive[j]]
+            removeList.extend(toRemove)
+            if events is not None:
+                events.append((_CLIQUE, nClique, i, toRemove))
+            remove_nodes(toRemove)
+            if counters is not None:
+                counters['cliquesRemoved'] += 1
+        if counters is not None:
+            counters['cliquePhaseTime'] += time.perf_counter() - phaseStart
+            phaseStart = time.perf_counter()
 
         ########################################
         # Perform the NeighbourCull operation. #
         ########################################
-        # Re-calculate this, as it may have changed since it was last calculated.
-        maxNeighbours = max(neighbours)
-        while maxNeighbours > 0 and (not neighbours[maxNeighbours]):
-            del neighbours[maxNeighbours]
+        # The number of neighbours of a node never increases, so the maximum only ever needs to move down.
+        while maxNeighbours > 0 and bucketHeads[maxNeighbours] == -1:
             maxNeighbours -= 1
 
         # If there are no nodes with neighbours then exit.
         if maxNeighbours == 0:
-            return removeList
+            break
 
-        # Get the IDs of the nodes with the max number of neighbours.
-        nodesWithMaxNeighbours = list(neighbours[maxNeighbours])
         # If there is more than one node with the maximum number of neighbours determine which node to remove.
-        if len(nodesWithMaxNeighbours) != 1:
-            # Determine the number of neighbours for each node.
-            extendedNeighbourhood = [adjList[x].union([x]) for x in nodesWithMaxNeighbours]
-            extendedNeighbourhood = [set().union(*[adjList[i] for i in a]) for a in extendedNeighbourhood]
-            # Determine the size of each extended neighbourhood, and which nodes have the min size.
-            sizes = [len(x) for x in extendedNeighbourhood]
-            minSize = min(sizes)
-            toRemove = nodesWithMaxNeighbours[sizes.index(minSize)]
+        numTied = 1 if nextInBucket[bucketHeads[maxNeighbours]] == -1 else 2
+        if counters is not None:
+            numTied = bucketSizes[maxNeighbours]
+        if numTied == 1 and events is None:
+            toRemove = bucketHeads[maxNeighbours]
         else:
-            toRemove = nodesWithMaxNeighbours[0]
+            # Pick the node with the smallest extended neighbourhood (and lowest index). The tied nodes are kept in a
+            # heap keyed by (extended size, index), which is rebuilt when the maximum number of neighbours drops, and
+            # otherwise only refreshed for the tied nodes whose extended neighbourhoods have changed.
+            if tiedDegree != maxNeighbours:
+                tiedDegree = maxNeighbours
+                tied = []
+                i = bucketHeads[maxNeighbours]
+                while i != -1:
+                    tied.append((extended_size(i), i))
+                    i = nextInBucket[i]
+                heapq.heapify(tied)
+            else:
+                for i in tiedChanged:
+                    if not extendedSizeValid[i] and degree[i] == tiedDegree:
+                        heapq.heappush(tied, (extended_size(i), i))
+            del tiedChanged[:]
+            # Discard the entries for nodes that have been removed, lost a neighbour or had their size change.
+            while True:
+                minSize, toRemove = heapq.heappop(tied)
+                if degree[toRemove] == tiedDegree and extendedSizes[toRemove] == minSize:
+                    break
+            if events is not None:
+                events.append((_NEIGHBOURCULL, maxNeighbours, minSize, toRemove, [toRemove]))
 
         removeList.append(toRemove)
-        # Update the list of neighbours for each node that toRemove is adjacent to.
-        for i in adjList[toRemove]:
-            numNeighbours = len(adjList[i])
-            neighbours[numNeighbours].remove(i)
-            neighbours[numNeighbours - 1].add(i)
-            adjList[i].remove(toRemove)
-        # Update the adjacency list to reflect the removal of to remove.
-        adjList[toRemove] = set([])
-        neighbours[maxNeighbours].remove(toRemove)
-        neighbours[0].add(toRemove)
\ No newline at end of file
+        remove_nodes([toRemove])
+        if counters is not None:
+            counters['neighbourCullRemovals'] += 1
+            counters['tieBreaks'] += numTied > 1
+            counters['peakTiedNodes'] = max(counters['peakTiedNodes'], numTied)
+            counters['neighbourCullTime'] += time.perf_counter() - phaseStart
+
+    if counters is not None:
+        _merge_stats(stats, counters)
+    return removeList
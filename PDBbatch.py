@@ -0,0 +1,230 @@
+'''
+Run a batch of PDB culls on one data directory, loading the PDB data only once.
+'''
+
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import shlex
+import sys
+
+import PDBcontroller
+import pdbstore
+
+# The PDB data shared by the jobs of a batch. It is set before the process pool is created, so that when the workers are
+# forked they share the loaded data rather than loading it again.
+_store = None
+
+def main(args):
+    """Runs a batch of PDB culls on one data directory, loading the data once for all of them.
+
+    :param args:    The command line arguments.
+    :type args:     list
+
+    """
+
+    #===========================================================================
+    # Parse the user's input.
+    #===========================================================================
+    parser = argparse.ArgumentParser(description=('Run a batch of PDB culls on the same processed PDB data, loading the data only once. ' +
+                                                  'Please see the README for more information on how to use this program.'),
+                                     epilog=('Each line of the job file holds the arguments that would be passed to PDBcontroller.py for one cull, without the ' +
+                                             'data directory (e.g. -p 20 25 -r 2.5 -l 0.25 -o HighResolution). Blank lines and lines starting with # are ignored.')
+                                     )
+    parser.add_argument('datalocation', help='The location of the directory that contains the processed PDB data.')
+    parser.add_argument('jobFile', help='The location of the file containing the arguments for each cull.')
+    parser.add_argument('-n', '--processes', help='The number of culls to run at once. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="processes", type=int, default=1, required=False)
+    parser.add_argument('-o', '--output', help='The directory in which the output directory of each cull is created. The output directory of a cull is given by its -o argument, ' +
+                                               'and is called JobN for the cull on line N of the job file if it has none. (Required type: %(type)s, default value: a directory called %(default)s in the current working directory).',
+                        metavar="outputFolder", type=str, default='PDBBatchResults', required=False)
+    parser.add_argument('-v', '--verbose', help='Whether status updates should be displayed. (Default value: No status updates).',
+                        action='store_true', default=False, required=False)
+    args = parser.parse_args(args)
+
+    dataDirectory = args.datalocation
+    jobFile = args.jobFile
+    batchProcesses = args.processes
+    outputDirectory = args.output
+    verboseOutput = args.verbose
+
+    #===========================================================================
+    # Validate the user's input.
+    #===========================================================================
+    toExit = False
+    if not os.path.isdir(dataDirectory):
+        print('The data directory supplied is not a valid directory.')
+        toExit = True
+
+    if not os.path.isfile(jobFile):
+        print('The job file is not a valid file location.')
+        toExit = True
+
+    if batchProcesses < 1:
+        print('The number of culls to run at once must be at least 1.')
+        toExit = True
+
+    if toExit:
+        sys.exit()
+
+    # Parse and validate every job before any culling is done.
+    jobs, errors = read_jobs(jobFile, dataDirectory, outputDirectory)
+    for i in errors:
+        print(i)
+    if errors:
+        sys.exit()
+
+    # Create the output directories.
+    if not os.path.isdir(outputDirectory):
+        try:
+            os.makedirs(outputDirectory)
+        except OSError:
+            print('The output directory could not be created. Please check the location specified in the input parameters.')
+            sys.exit()
+    for lineNumber, settings in jobs:
+        errorMessage = PDBcontroller.make_output_directory(settings['outputLocation'])
+        if errorMessage:
+            print('Line {0} of the job file: {1}'.format(lineNumber, errorMessage))
+            sys.exit()
+
+    #===========================================================================
+    # Load the data and run the culls.
+    #===========================================================================
+    if verboseOutput:
+        print('Now loading the PDB data.')
+    store = load_data(dataDirectory)
+    if verboseOutput:
+        print('Now running {0} culls.'.format(len(jobs)))
+    run_jobs(store, jobs, dataDirectory, batchProcesses, verboseOutput)
+
+
+def read_jobs(jobFile, dataDirectory, outputDirectory):
+    """Parse the culls in a job file with the argument parser of PDBcontroller.
+
+    :param jobFile:         The location of the job file.
+    :type jobFile:          string
+    :param dataDirectory:   The location of the directory containing the processed PDB data.
+    :type dataDirectory:    string
+    :param outputDirectory: The directory in which the output directory of each cull is created.
+    :type outputDirectory:  string
+    :returns :              The line number and settings (see PDBcontroller.check_arguments) of each cull, and the
+                            messages describing any invalid lines.
+    :type :                 list and list
+
+    """
+
+    parser = PDBcontroller.create_parser()
+    jobs = []
+    errors = []
+    outputLocations = {}  # The line of the job file that uses each output directory.
+    readJobs = open(jobFile, 'r')
+    for lineNumber, line in enumerate(readJobs, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            args = parser.parse_args([dataDirectory] + shlex.split(line))
+        except (SystemExit, ValueError):
+            # The parser has reported the problem with the arguments (or the quoting on the line is invalid).
+            errors.append('Line {0} of the job file could not be parsed: {1}'.format(lineNumber, line))
+            continue
+        if args.output == parser.get_default('output'):
+            args.output = 'Job{0}'.format(lineNumber)
+        args.output = os.path.join(outputDirectory, args.output)
+        settings, jobErrors = PDBcontroller.check_arguments(args)
+        errors.extend('Line {0} of the job file: {1}'.format(lineNumber, i) for i in jobErrors)
+        outputLocation = os.path.abspath(settings['outputLocation'])
+        if outputLocation in outputLocations:
+            errors.append('Line {0} of the job file uses the same output directory as line {1}.'.format(lineNumber, outputLocations[outputLocation]))
+        outputLocations[outputLocation] = lineNumber
+        jobs.append((lineNumber, settings))
+    readJobs.close()
+    return jobs, errors
+
+
+def load_data(dataDirectory):
+    """Load the PDB data for a batch of culls.
+
+    The binary store is used if it is present and up to date (see pdbstore). Otherwise the TSV files are parsed once into
+    a store held in memory, which gives the same results as parsing the TSV files for each cull.
+
+    :param dataDirectory:   The location of the directory containing the processed PDB data.
+    :type dataDirectory:    string
+    :returns :              The store of the PDB data.
+    :type :                 dictionary
+
+    """
+
+    store = pdbstore.load(dataDirectory)
+    if store is None:
+        store = pdbstore.build(dataDirectory)
+    return store
+
+
+def run_jobs(store, jobs, dataDirectory, batchProcesses=1, verboseOutput=False):
+    """Run a batch of culls on the same PDB data.
+
+    When more than one cull is run at once, the culls are run in a pool of processes. Where the operating system
+    supports it the workers are forked, and so share the loaded data with this process. Otherwise each worker loads
+    the data once when it starts.
+
+    :param store:           The store of the PDB data (see load_data).
+    :type store:            dictionary
+    :param jobs:            The line number and settings of each cull (see read_jobs). The output directories must
+                            already exist.
+    :type jobs:             list
+    :param dataDirectory:   The location of the directory containing the processed PDB data.
+    :type dataDirectory:    string
+    :param batchProcesses:  The number of culls to run at once.
+    :type batchProcesses:   integer
+    :param verboseOutput:   Whether status updates should be displayed.
+    :type verboseOutput:    boolean
+
+    """
+
+    global _store
+    _store = store
+    if batchProcesses == 1:
+        for lineNumber, settings in jobs:
+            PDBcontroller.cull(store, settings)
+            if verboseOutput:
+                print('Finished the cull on line {0} of the job file.'.format(lineNumber))
+        return
+
+    context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+    with concurrent.futures.ProcessPoolExecutor(batchProcesses, mp_context=context, initializer=_initialise_worker,
+                                                initargs=(dataDirectory,)) as executor:
+        futures = [(lineNumber, executor.submit(_run_job, settings)) for lineNumber, settings in jobs]
+        for lineNumber, future in futures:
+            future.result()
+            if verboseOutput:
+                print('Finished the cull on line {0} of the job file.'.format(lineNumber))
+
+
+def _initialise_worker(dataDirectory):
+    """Load the PDB data in a worker process, unless it was inherited when the worker was forked.
+
+    :param dataDirectory:   The location of the directory containing the processed PDB data.
+    :type dataDirectory:    string
+
+    """
+
+    global _store
+    if _store is None:
+        _store = load_data(dataDirectory)
+
+
+def _run_job(settings):
+    """Run one cull of a batch in a worker process.
+
+    :param settings:    The settings for the cull (see PDBcontroller.check_arguments).
+    :type settings:     dictionary
+
+    """
+
+    PDBcontroller.cull(_store, settings)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -5,11 +5,15 @@ Created on 5 Feb 2011
 '''
 
 import argparse
+import bisect
+import json
 import os
 import shutil
 import sys
 
+import commandline
 import Leafcull
+import pdbstore
 
 
 def main(args):
@@ -21,8 +25,43 @@ def main(args):
     """
 
     #===========================================================================
-    # Parse the user's input.
+    # Parse and validate the user's input.
     #===========================================================================
+    parser = create_parser()
+    settings, errors = check_arguments(parser.parse_args(args))
+    for i in errors:
+        print(i)
+    if errors:
+        sys.exit()
+
+    # Create the directory to store the output in.
+    errorMessage = make_output_directory(settings['outputLocation'])
+    if errorMessage:
+        print(errorMessage)
+        sys.exit()
+
+    #===========================================================================
+    # Extract the chains meeting the user's criteria.
+    #===========================================================================
+    if settings['verboseOutput']:
+        print('Now extracting the chains to cull.')
+
+    # Load the data from the binary store if it is present and up to date (see pdbstore), and otherwise from the TSV files.
+    store = pdbstore.load(settings['dataDirectory'])
+    if settings['verboseOutput'] and store is not None:
+        print('Using the binary store of the PDB data.')
+
+    cull(store, settings)
+
+
+def create_parser():
+    """Create the parser for the command line arguments.
+
+    :returns :  The parser.
+    :type :     argparse.ArgumentParser
+
+    """
+
     parser = argparse.ArgumentParser(description=('Generate a non-redundant dataset of chains from the PDB. ' +
                                                   'Please see the README for more information on how to use this program.'),
                                      epilog=('This program is designed to cull a dataset of protein sequences so that no ' +
@@ -34,8 +73,10 @@ def main(args):
     parser.add_argument('datalocation', help='The location of the directory that contains the processed PDB data.')
     parser.add_argument('-i', '--inputFile', help='The location of the file containing the identifiers of the chains to cull. (Required type: %(type)s, default value: Not used).',
                         metavar="inputFile", type=str, default='', required=False)
-    parser.add_argument('-p', '--percent', help='The maximum percent sequence identity between sequences. 5 <= maxPercent < 100 must be true. (Required type: %(type)s, default value: %(default)s).',
-                        metavar="maxPercent", type=float, default=20, required=False)
+    parser.add_argument('-p', '--percent', help='The maximum percent sequence identity between sequences. 5 <= maxPercent < 100 must be true. ' +
+                                                'Multiple values and inclusive ranges of the form start:stop:step (e.g. 20:90:5) can be given, in which case a culling is performed at each value, ' +
+                                                'and the results for each value are saved in a subdirectory of the output directory. (Required type: %(type)s, default value: 20).',
+                        metavar="maxPercent", type=commandline.percent_values, nargs='+', default=[[20.0]], required=False)
     parser.add_argument('-q', '--minRes', help='The minimum resolution a chain/entry can have. 0 <= minResolution <= 100 must be true. Must not be greater than the maximum resolution. (Required type: %(type)s, default value: %(default)s).',
                         metavar="minResolution", type=float, default=0.0, required=False)
     parser.add_argument('-r', '--maxRes', help='The maximum resolution a chain/entry can have. 0 <= maxResolution <= 100 must be true. Must not be less than the minimum resolution. (Required type: %(type)s, default value: %(default)s).',
@@ -50,15 +91,33 @@ def main(args):
                         action='store_true', default=False, required=False)
     parser.add_argument('-u', '--usealpha', help='Whether alpha carbon only chains/entries should be included. (Default value: Not used).',
                         action='store_true', default=False, required=False)
+    parser.add_argument('-n', '--processes', help='The number of processes to use for the culling. When greater than 1 the connected components of the similarity graph are culled in parallel. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="processes", type=int, default=1, required=False)
     parser.add_argument('-o', '--output', help='The name of the output directory to create in the current working directory. (Required type: %(type)s, default value: a directory called %(default)s in the current working directory).',
                         metavar="outputFolder", type=str, default='PDBCullResults', required=False)
+    parser.add_argument('--profile', help='Whether to save statistics about the culling (counts of the operations performed and the time spent in each phase) to Profile.json in the output directory. (Default value: Not used).',
+                        action='store_true', default=False, required=False)
     parser.add_argument('-v', '--verbose', help='Whether status updates should be displayed. (Default value: No status updates).',
                         action='store_true', default=False, required=False)
-    args = parser.parse_args()
+    return parser
+
+
+def check_arguments(args):
+    """Validate the parsed command line arguments, and convert them into the settings for a cull.
+
+    :param args:    The parsed command line arguments (see create_parser).
+    :type args:     argparse.Namespace
+    :returns :      The settings for the cull, indexed by the name of the setting, and the messages describing any
+                    invalid arguments (the settings should not be used if there are any).
+    :type :         dictionary and list
+
+    """
 
     dataDirectory = args.datalocation
     fileUserInputChains = args.inputFile
-    sequenceIdentity = args.percent
+    sequenceIdentities = []
+    for i in args.percent:
+        sequenceIdentities.extend(j for j in i if j not in sequenceIdentities)
     minResolution = args.minRes
     maxResolution = args.maxRes
     maxRValue = args.rval
@@ -67,41 +126,36 @@ def main(args):
     skipNonXray = not args.usenonxray
     skipAlphaCarbon = not args.usealpha
     cullOperationID = args.output
+    cullProcesses = args.processes
+    saveProfile = args.profile
     verboseOutput = args.verbose
 
     #===========================================================================
     # Validate the user's input.
     #===========================================================================
-    toExit = False
+    errors = []
     if not os.path.isdir(dataDirectory):
-        print('The data directory supplied is not a valid directory.')
-        toExit = True
+        errors.append('The data directory supplied is not a valid directory.')
 
     cullSubset = fileUserInputChains != ''  # Whether the user specified a subset of the chains should be culled.
     if cullSubset:
         if not os.path.isfile(fileUserInputChains):
-            print('The file of chains to cull is not a valid file location.')
-            toExit = True
+            errors.append('The file of chains to cull is not a valid file location.')
 
-    if sequenceIdentity < 5 or sequenceIdentity >= 100:
-        print('The maximum allowable percentage sequence similarity must be no less than 5, and less than 100.')
-        toExit = True
+    if any(i < 5 or i >= 100 for i in sequenceIdentities):
+        errors.append('The maximum allowable percentage sequence similarity must be no less than 5, and less than 100.')
 
     if minResolution < 0 or minResolution > 100:
-        print('The valid range for the minimum resolution is 0 - 100.')
-        toExit = True
+        errors.append('The valid range for the minimum resolution is 0 - 100.')
 
     if maxResolution < 0 or maxResolution > 100:
-        print('The valid range for the maximum resolution is 0 - 100.')
-        toExit = True
+        errors.append('The valid range for the maximum resolution is 0 - 100.')
 
     if minResolution > maxResolution:
-        print('The minimum resolution must be less than or equal to the maximum resolution.')
-        toExit = True
+        errors.append('The minimum resolution must be less than or equal to the maximum resolution.')
 
     if maxRValue < 0 or maxRValue > 1:
-        print('The valid range for the maximum R value is 0 - 1.')
-        toExit = True
+        errors.append('The valid range for the maximum R value is 0 - 1.')
 
     if minLength < 0:
         minLength = -1
@@ -109,18 +163,35 @@ def main(args):
         maxLength = -1
 
     if minLength > maxLength:
-        print('The minimum sequence length must be less than the maximum sequence length.')
-        toExit = True
+        errors.append('The minimum sequence length must be less than the maximum sequence length.')
 
-    if toExit:
-        sys.exit()
+    if cullProcesses < 1:
+        errors.append('The number of processes to use for the culling must be at least 1.')
 
-    # Create the directory to store the output in.
-    cwd = os.getcwd()
+    # Resolve the location of the output directory.
     if cullOperationID == 'PDBCullResults':
-        outputLocation = cwd + '/' + cullOperationID
+        outputLocation = os.getcwd() + '/' + cullOperationID
     else:
         outputLocation = cullOperationID
+
+    settings = {'dataDirectory' : dataDirectory, 'inputFile' : fileUserInputChains if cullSubset else None,
+                'sequenceIdentities' : sequenceIdentities, 'minResolution' : minResolution, 'maxResolution' : maxResolution,
+                'maxRValue' : maxRValue, 'minLength' : minLength, 'maxLength' : maxLength, 'skipNonXray' : skipNonXray,
+                'skipAlphaCarbon' : skipAlphaCarbon, 'cullProcesses' : cullProcesses, 'saveProfile' : saveProfile,
+                'verboseOutput' : verboseOutput, 'outputLocation' : outputLocation}
+    return settings, errors
+
+
+def make_output_directory(outputLocation):
+    """Create the directory to store the output of a cull in, replacing anything already at its location.
+
+    :param outputLocation:  The location of the output directory.
+    :type outputLocation:   string
+    :returns :              A message describing why the directory could not be created (None if it was created).
+    :type :                 string
+
+    """
+
     try:
         if os.path.isdir(outputLocation):
             shutil.rmtree(outputLocation)
@@ -128,9 +199,101 @@ def main(args):
             os.remove(outputLocation)
         os.mkdir(outputLocation)
     except:
-        print('The output directory could not be created. Please check the location specified in  the input parameters.')
-        print('If you did not specify a location then consider changing the default output location (the variable cullOperationID)')
-        sys.exit()
+        return ('The output directory could not be created. Please check the location specified in  the input parameters.\n' +
+                'If you did not specify a location then consider changing the default output location (the variable cullOperationID)')
+    return None
+
+
+def cull(store, settings, selection=None):
+    """Cull the PDB chains meeting the criteria in the settings, and save the results in the output directory.
+
+    :param store:       The store of the PDB data (see pdbstore), or None to read the data from the TSV files.
+    :type store:        dictionary
+    :param settings:    The settings for the cull (see check_arguments). The output directory must already exist, and
+                        nothing is saved if its location is None.
+    :type settings:     dictionary
+    :param selection:   The chains and similarities to cull (see prepare_cull), made for the same chain criteria and a
+                        lowest threshold no higher than that of the settings. If None, they are made from the settings.
+    :type selection:    dictionary
+    :returns :          The threshold, kept chains, culled chains and culling statistics (None unless saveProfile is
+                        set) of the culling at each threshold.
+    :type :             list
+
+    """
+
+    sequenceIdentities = settings['sequenceIdentities']
+    cullProcesses = settings['cullProcesses']
+    saveProfile = settings['saveProfile']
+    verboseOutput = settings['verboseOutput']
+    outputLocation = settings['outputLocation']
+
+    if selection is None:
+        selection = prepare_cull(store, settings)
+    vectorised = selection['vectorised']
+    representativeGroupings = selection['representativeGroupings']
+    similarities = selection['similarities']
+    negatedSimilarities = selection['negatedSimilarities']
+
+    #===========================================================================
+    # Perform the culling at each threshold.
+    #===========================================================================
+    results = []
+    for sequenceIdentity in sequenceIdentities:
+        if len(sequenceIdentities) == 1:
+            thresholdOutputLocation = outputLocation
+        else:
+            if verboseOutput:
+                print('Now culling at {0:g}% sequence identity.'.format(sequenceIdentity))
+            thresholdOutputLocation = None
+            if outputLocation is not None:
+                thresholdOutputLocation = outputLocation + '/Percent{0:g}'.format(sequenceIdentity)
+                os.mkdir(thresholdOutputLocation)
+        csrGraph = None
+        if not vectorised:
+            numSimilarities = bisect.bisect_right(negatedSimilarities, -sequenceIdentity)
+            adjList = Leafcull.create_adjacency(similarities[i] for i in range(numSimilarities))
+        elif cullProcesses > 1:
+            numSimilarities = pdbstore.count_similarities(store, similarities, sequenceIdentity)
+            adjList = Leafcull.create_adjacency(pdbstore.similarity_tuples(store, similarities, numSimilarities))
+        else:
+            numSimilarities = pdbstore.count_similarities(store, similarities, sequenceIdentity)
+            adjList = None
+            csrGraph = pdbstore.similarity_csr(store, similarities, numSimilarities)
+        proteinsToKeep, proteinsToCull, cullStats = cull_and_save(adjList, representativeGroupings.values(), thresholdOutputLocation,
+                                                                  cullProcesses, saveProfile, verboseOutput, csrGraph)
+        results.append((sequenceIdentity, proteinsToKeep, proteinsToCull, cullStats))
+    return results
+
+
+def prepare_cull(store, settings):
+    """Select the chains meeting the criteria in the settings, and load the similarities between them.
+
+    The selection depends only on the chain criteria in the settings and on the lowest threshold, and can be used for
+    any cull with the same chain criteria whose thresholds are all at or above that threshold (see cull).
+
+    :param store:       The store of the PDB data (see pdbstore), or None to read the data from the TSV files.
+    :type store:        dictionary
+    :param settings:    The settings for the cull (see check_arguments).
+    :type settings:     dictionary
+    :returns :          Whether the arrays of the store were used, the representative chains (see select_representatives),
+                        the similarities between them at or above the lowest threshold (along with their negated values
+                        when the arrays were not used) and the lowest threshold.
+    :type :             dictionary
+
+    """
+
+    dataDirectory = settings['dataDirectory']
+    fileUserInputChains = settings['inputFile']
+    cullSubset = fileUserInputChains is not None
+    sequenceIdentities = settings['sequenceIdentities']
+    minResolution = settings['minResolution']
+    maxResolution = settings['maxResolution']
+    maxRValue = settings['maxRValue']
+    minLength = settings['minLength']
+    maxLength = settings['maxLength']
+    skipNonXray = settings['skipNonXray']
+    skipAlphaCarbon = settings['skipAlphaCarbon']
+    verboseOutput = settings['verboseOutput']
 
     #===========================================================================
     # PDB data files.
@@ -141,36 +304,106 @@ def main(args):
     #===========================================================================
     # Extract the chains meeting the user's criteria.
     #===========================================================================
+    # When NumPy is available the chains are selected with boolean masks over the columns of the store (see pdbstore),
+    # and the similarity graph at each threshold is built from arrays of chain indices.
+    vectorised = store is not None and pdbstore.vectorised(store)
+    if vectorised:
+        userChains = None
+        if cullSubset:
+            readUserChains = open(fileUserInputChains, 'r')
+            userChains = [line.strip() for line in readUserChains]
+            readUserChains.close()
+        numValidChains, representativeGroupings, representativeOfGroup = pdbstore.select_representatives(
+            store, minResolution, maxResolution, maxRValue, minLength, maxLength, skipNonXray, skipAlphaCarbon, userChains)
+        if verboseOutput:
+            print('Number of chains meeting the specified criteria: {0}.'.format(numValidChains))
+            print('Number of representative chains: {0}.'.format(len(representativeGroupings)))
+    else:
+        representativeGroupings = select_representatives(store, chainData, fileUserInputChains if cullSubset else None,
+                                                         minResolution, maxResolution, maxRValue, minLength, maxLength,
+                                                         skipNonXray, skipAlphaCarbon, verboseOutput)
+
+    #===========================================================================
+    # Load the similarities.
+    #===========================================================================
     if verboseOutput:
-        print('Now extracting the chains to cull.')
+        print('Now loading the similarities.')
+
+    # Record the similarities between representative chains that are at or above the lowest threshold.
+    minSequenceIdentity = min(sequenceIdentities)
+    negatedSimilarities = None
+    if vectorised:
+        similarities = pdbstore.representative_similarities(store, representativeOfGroup, minSequenceIdentity)
+    else:
+        similarities = load_similarities(store, similarityData, representativeGroupings, minSequenceIdentity)
+        negatedSimilarities = [-i[0] for i in similarities]
+
+    return {'vectorised' : vectorised, 'representativeGroupings' : representativeGroupings, 'similarities' : similarities,
+            'negatedSimilarities' : negatedSimilarities, 'minSequenceIdentity' : minSequenceIdentity}
+
+
+def select_representatives(store, chainData, fileUserInputChains, minResolution, maxResolution, maxRValue, minLength,
+                           maxLength, skipNonXray, skipAlphaCarbon, verboseOutput=False):
+    """Determine the representative chains to cull, from the binary store (without NumPy) or from Chains.tsv.
+
+    :param store:               The store of the PDB data (None to use Chains.tsv).
+    :type store:                dictionary
+    :param chainData:           The location of Chains.tsv.
+    :type chainData:            string
+    :param fileUserInputChains: The location of the file of chains to cull (None to cull all the chains).
+    :type fileUserInputChains:  string
+    :param minResolution:       The minimum resolution a chain can have.
+    :type minResolution:        float
+    :param maxResolution:       The maximum resolution a chain can have.
+    :type maxResolution:        float
+    :param maxRValue:           The maximum R value a chain can have.
+    :type maxRValue:            float
+    :param minLength:           The minimum sequence length a chain can have (-1 if there is no minimum).
+    :type minLength:            integer
+    :param maxLength:           The maximum sequence length a chain can have (-1 if there is no maximum).
+    :type maxLength:            integer
+    :param skipNonXray:         Whether to exclude the non-X-ray chains.
+    :type skipNonXray:          boolean
+    :param skipAlphaCarbon:     Whether to exclude the alpha carbon only chains.
+    :type skipAlphaCarbon:      boolean
+    :param verboseOutput:       Whether status updates should be displayed.
+    :type verboseOutput:        boolean
+    :returns :                  The representative chain of each representative group.
+    :type :                     dictionary
+
+    """
 
     chainsOfInterest = {}  # The chains that meet the user specified quality criteria.
-    readChainData = open(chainData, 'r')
-    readChainData.readline()  # Strip the header.
-    for i in readChainData:
-        # Parse the data file containing all the chains in the PDB, and record only those that meet the quality criteria.
-        chunks = (i.strip()).split('\t')
-        chain = chunks[0]
-        resolution = float(chunks[1])
-        rValue = float(chunks[2])
-        sequenceLength = int(chunks[3])
-        xRayNotUsed = chunks[4] == 'yes'
-        alphaCarbonOnly = chunks[5] == 'yes'
-        representativeGroup = chunks[6]
-        invalid = ((xRayNotUsed and skipNonXray) or
-                   (resolution < minResolution) or
-                   (resolution > maxResolution) or
-                   (rValue > maxRValue) or
-                   (alphaCarbonOnly and skipAlphaCarbon) or
-                   (minLength != -1 and sequenceLength < minLength) or
-                   (maxLength != -1 and sequenceLength > maxLength)
-                   )
-        if not invalid:
-            chainsOfInterest[chain] = representativeGroup
-    readChainData.close()
+    if store is not None:
+        chainsOfInterest = pdbstore.chains_of_interest(store, minResolution, maxResolution, maxRValue, minLength, maxLength,
+                                                       skipNonXray, skipAlphaCarbon)
+    else:
+        readChainData = open(chainData, 'r')
+        readChainData.readline()  # Strip the header.
+        for i in readChainData:
+            # Parse the data file containing all the chains in the PDB, and record only those that meet the quality criteria.
+            chunks = (i.strip()).split('\t')
+            chain = chunks[0]
+            resolution = float(chunks[1])
+            rValue = float(chunks[2])
+            sequenceLength = int(chunks[3])
+            xRayNotUsed = chunks[4] == 'yes'
+            alphaCarbonOnly = chunks[5] == 'yes'
+            representativeGroup = chunks[6]
+            invalid = ((xRayNotUsed and skipNonXray) or
+                       (resolution < minResolution) or
+                       (resolution > maxResolution) or
+                       (rValue > maxRValue) or
+                       (alphaCarbonOnly and skipAlphaCarbon) or
+                       (minLength != -1 and sequenceLength < minLength) or
+                       (maxLength != -1 and sequenceLength > maxLength)
+                       )
+            if not invalid:
+                chainsOfInterest[chain] = representativeGroup
+        readChainData.close()
 
     allValidChains = {}  # The chains that will be submitted for culling.
-    if cullSubset:
+    if fileUserInputChains is not None:
         readUserChains = open(fileUserInputChains, 'r')
         for line in readUserChains:
             chain = line.strip()
@@ -193,48 +426,97 @@ def main(args):
     if verboseOutput:
         print('Number of representative chains: {0}.'.format(len(representativeGroupings)))
 
-    #===========================================================================
-    # Create the adjacency matrix.
-    #===========================================================================
-    if verboseOutput:
-        print('Now creating the adjacency matrix')
-
-    readSimilarities = open(similarityData, 'r')
-    readSimilarities.readline()  # Strip the header.
-    adjList = {}
-    for line in readSimilarities:
-        chunks = (line.strip()).split('\t')
-        representativeGroupA = chunks[0]
-        representativeGroupB = chunks[1]
-        similarity = float(chunks[2])
-        addSimilarity = ((representativeGroupA in representativeGroupings) and
-                         (representativeGroupB in representativeGroupings) and
-                         (similarity >= sequenceIdentity)
-                        )
-        if addSimilarity:
-            # The sequences are of interest and too similar.
-            chainA = representativeGroupings[representativeGroupA]
-            chainB = representativeGroupings[representativeGroupB]
-            if chainA in adjList:
-                adjList[chainA].add(chainB)
-            else:
-                adjList[chainA] = set([chainB])
-            if chainB in adjList:
-                adjList[chainB].add(chainA)
-            else:
-                adjList[chainB] = set([chainA])
-    readSimilarities.close()
+    return representativeGroupings
+
+
+def load_similarities(store, similarityData, representativeGroupings, minSequenceIdentity):
+    """Load the similarities between representative chains, from the binary store (without NumPy) or from Similarity.tsv.
+
+    :param store:                   The store of the PDB data (None to use Similarity.tsv).
+    :type store:                    dictionary
+    :param similarityData:          The location of Similarity.tsv.
+    :type similarityData:           string
+    :param representativeGroupings: The representative chain of each representative group.
+    :type representativeGroupings:  dictionary
+    :param minSequenceIdentity:     The lowest similarity to record.
+    :type minSequenceIdentity:      float
+    :returns :                      The (similarity, chainA, chainB) tuples at or above minSequenceIdentity, from most to
+                                    least similar.
+    :type :                         list
+
+    """
+
+    similarities = []
+    if store is not None:
+        similarities = pdbstore.similarities(store, representativeGroupings, minSequenceIdentity)
+    else:
+        readSimilarities = open(similarityData, 'r')
+        readSimilarities.readline()  # Strip the header.
+        for line in readSimilarities:
+            chunks = (line.strip()).split('\t')
+            representativeGroupA = chunks[0]
+            representativeGroupB = chunks[1]
+            similarity = float(chunks[2])
+            addSimilarity = ((representativeGroupA in representativeGroupings) and
+                             (representativeGroupB in representativeGroupings) and
+                             (similarity >= minSequenceIdentity)
+                            )
+            if addSimilarity:
+                # The sequences are of interest and too similar for at least one threshold.
+                similarities.append((similarity, representativeGroupings[representativeGroupA], representativeGroupings[representativeGroupB]))
+        readSimilarities.close()
+
+    # Sort the similarities from most to least similar. The similarities at or above any threshold are then a prefix of the list.
+    similarities.sort(key=lambda x: x[0], reverse=True)
+    return similarities
+
+
+def cull_and_save(adjList, representativeChains, outputLocation, cullProcesses=1, saveProfile=False, verboseOutput=False,
+                  csrGraph=None):
+    """Cull the protein similarity graph and save the kept and culled chains.
+
+    :param adjList:                 An adjacency list representation of the protein similarity graph (not used if
+                                    csrGraph is given).
+    :type adjList:                  dictionary
+    :param representativeChains:    The chains submitted for culling.
+    :type representativeChains:     iterable
+    :param outputLocation:          The directory to save the results in (None to not save them).
+    :type outputLocation:           string
+    :param cullProcesses:           The number of processes to use for the culling.
+    :type cullProcesses:            integer
+    :param saveProfile:             Whether to save the culling statistics to Profile.json in the output directory.
+    :type saveProfile:              boolean
+    :param verboseOutput:           Whether status updates should be displayed.
+    :type verboseOutput:            boolean
+    :param csrGraph:                If not None, the offsets, neighbours and node IDs of the compressed sparse row form
+                                    of the graph (see Leafcull.build_csr), which is culled in one process instead of adjList.
+    :type csrGraph:                 tuple
+    :returns :                      The kept chains, the culled chains and the culling statistics (None unless saveProfile
+                                    is set).
+    :type :                         list, list and dictionary
+
+    """
 
     if verboseOutput:
-        print('Number of similarity relationships: {0}.'.format(int(sum([len(adjList[i]) for i in adjList]) / 2)))
+        if csrGraph is not None:
+            print('Number of similarity relationships: {0}.'.format(len(csrGraph[1]) // 2))
+        else:
+            print('Number of similarity relationships: {0}.'.format(int(sum([len(adjList[i]) for i in adjList]) / 2)))
 
     #===========================================================================
     # Run the culling.
     #===========================================================================
     if verboseOutput:
         print('Now performing the culling.')
-    proteinsToCull = Leafcull.main(adjList)
-    proteinsToKeep = [i for i in representativeGroupings.values() if not i in proteinsToCull]
+    cullStats = {} if saveProfile else None
+    if csrGraph is not None:
+        proteinsToCull = Leafcull.cull_csr(*csrGraph, stats=cullStats)
+    elif cullProcesses > 1:
+        proteinsToCull = Leafcull.parallel_main(adjList, cullProcesses, stats=cullStats)
+    else:
+        proteinsToCull = Leafcull.main(adjList, stats=cullStats)
+    culled = set(proteinsToCull)
+    proteinsToKeep = [i for i in representativeChains if not i in culled]
 
     if verboseOutput:
         print('{0} protins kept and {1} removed.'.format(len(proteinsToKeep), len(proteinsToCull)))
@@ -242,6 +524,8 @@ def main(args):
     #===========================================================================
     # Save the results.
     #===========================================================================
+    if outputLocation is None:
+        return proteinsToKeep, proteinsToCull, cullStats
     if verboseOutput:
         print('Now saving the results.')
 
@@ -255,8 +539,17 @@ def main(args):
     writeOutKeepList.write('\n'.join(proteinsToCull))
     writeOutKeepList.close()
 
+    # Write out the culling statistics.
+    if saveProfile:
+        writeOutProfile = open(outputLocation + '/Profile.json', 'w')
+        json.dump(cullStats, writeOutProfile, indent=4, sort_keys=True)
+        writeOutProfile.close()
+
     if verboseOutput:
         print('Results saved.')
 
+    return proteinsToKeep, proteinsToCull, cullStats
+
+
 if __name__ == '__main__':
     main(sys.argv[1:])
\ No newline at end of file
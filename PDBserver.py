@@ -0,0 +1,287 @@
+'''
+A local HTTP service that performs PDB culls, keeping the PDB data loaded between requests.
+'''
+
+import argparse
+import collections
+import http.server
+import json
+import os
+import shlex
+import sys
+import threading
+import time
+import urllib.parse
+
+import PDBbatch
+import PDBcontroller
+
+# The path at which culls are requested.
+CULL_PATH = '/cull'
+# The settings that do not change the results of a cull.
+_UNCACHED_SETTINGS = ['cullProcesses', 'outputLocation', 'verboseOutput']
+# The settings that do not change the chains selected for a cull (see PDBcontroller.prepare_cull).
+_UNSELECTED_SETTINGS = _UNCACHED_SETTINGS + ['sequenceIdentities', 'saveProfile']
+
+def main(args):
+    """Runs a local HTTP service that culls the PDB chains, keeping the PDB data loaded between requests.
+
+    :param args:    The command line arguments.
+    :type args:     list
+
+    """
+
+    #===========================================================================
+    # Parse the user's input.
+    #===========================================================================
+    parser = argparse.ArgumentParser(description=('Run a local HTTP service that performs PDB culls without reloading the PDB data for each cull. ' +
+                                                  'Please see the README for more information on how to use this program.'),
+                                     epilog=('A cull is requested with GET ' + CULL_PATH + '?args=ARGUMENTS or by POSTing the arguments to ' + CULL_PATH + ', where ' +
+                                             'the arguments are those that would be passed to PDBcontroller.py, without the data directory (e.g. -p 20 25 -r 2.5). ' +
+                                             'The kept and culled chains are returned as JSON.')
+                                     )
+    parser.add_argument('datalocation', help='The location of the directory that contains the processed PDB data.')
+    parser.add_argument('--host', help='The address to listen on. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="host", type=str, default='127.0.0.1', required=False)
+    parser.add_argument('--port', help='The port to listen on. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="port", type=int, default=8080, required=False)
+    parser.add_argument('-c', '--cache', help='The number of cull results to keep in the cache. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="cacheSize", type=int, default=128, required=False)
+    parser.add_argument('-s', '--selectionCache', help='The number of selections of chains (and the similarities between them) to keep in the cache, so that culls using the same chain criteria ' +
+                                                       'at different thresholds do not select the chains again. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="selectionCacheSize", type=int, default=8, required=False)
+    parser.add_argument('-v', '--verbose', help='Whether each request should be logged. (Default value: No logging).',
+                        action='store_true', default=False, required=False)
+    args = parser.parse_args(args)
+
+    dataDirectory = args.datalocation
+    host = args.host
+    port = args.port
+    cacheSize = args.cache
+    selectionCacheSize = args.selectionCache
+    verboseOutput = args.verbose
+
+    #===========================================================================
+    # Validate the user's input.
+    #===========================================================================
+    toExit = False
+    if not os.path.isdir(dataDirectory):
+        print('The data directory supplied is not a valid directory.')
+        toExit = True
+
+    if cacheSize < 0:
+        print('The size of the cache must not be negative.')
+        toExit = True
+
+    if selectionCacheSize < 0:
+        print('The size of the selection cache must not be negative.')
+        toExit = True
+
+    if toExit:
+        sys.exit()
+
+    #===========================================================================
+    # Load the data and start the service.
+    #===========================================================================
+    print('Now loading the PDB data.')
+    store = PDBbatch.load_data(dataDirectory)
+    try:
+        server = create_server(store, dataDirectory, host, port, cacheSize, selectionCacheSize, verboseOutput)
+    except OSError as e:
+        print('The service could not be started on {0}:{1} ({2}).'.format(host, port, e))
+        sys.exit()
+    print('Serving culls at http://{0}:{1}{2}.'.format(host, server.server_address[1], CULL_PATH))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+def create_server(store, dataDirectory, host='127.0.0.1', port=8080, cacheSize=128, selectionCacheSize=8, verboseOutput=False):
+    """Create the HTTP server that performs the culls.
+
+    Each request is handled in its own thread. The culls share the loaded PDB data, which they only read. As the
+    requests already run at once, each cull is run in a single process.
+
+    :param store:               The store of the PDB data (see PDBbatch.load_data).
+    :type store:                dictionary
+    :param dataDirectory:       The location of the directory containing the processed PDB data.
+    :type dataDirectory:        string
+    :param host:                The address to listen on.
+    :type host:                 string
+    :param port:                The port to listen on (0 to use any free port).
+    :type port:                 integer
+    :param cacheSize:           The number of cull results to keep in the cache.
+    :type cacheSize:            integer
+    :param selectionCacheSize:  The number of selections of chains to keep in the cache.
+    :type selectionCacheSize:   integer
+    :param verboseOutput:       Whether each request should be logged.
+    :type verboseOutput:        boolean
+    :returns :                  The server (which has not yet been started).
+    :type :                     http.server.ThreadingHTTPServer
+
+    """
+
+    server = http.server.ThreadingHTTPServer((host, port), _CullRequestHandler)
+    server.daemon_threads = True
+    server.service = {'store' : store, 'dataDirectory' : dataDirectory, 'parser' : PDBcontroller.create_parser(),
+                      'cache' : collections.OrderedDict(), 'cacheSize' : cacheSize, 'cacheLock' : threading.Lock(),
+                      'selectionCache' : collections.OrderedDict(), 'selectionCacheSize' : selectionCacheSize,
+                      'verboseOutput' : verboseOutput}
+    return server
+
+
+def perform_cull(service, argumentLine):
+    """Perform the cull requested by a line of PDBcontroller.py arguments, using the cache when possible.
+
+    The cache holds the results of the most recently used culls, and is keyed by the normalised settings of the cull
+    (see cache_key), so requests that differ only in the way the arguments are written share a cache entry. A second
+    cache holds the most recently used selections of chains and the similarities between them (see
+    PDBcontroller.prepare_cull), keyed by the settings that determine the chains selected. A selection is reused by
+    culls at thresholds at or above the lowest threshold it was made for.
+
+    :param service:         The state of the service (see create_server).
+    :type service:          dictionary
+    :param argumentLine:    The PDBcontroller.py arguments for the cull, without the data directory.
+    :type argumentLine:     string
+    :returns :              The HTTP status code and the response (the results of the cull, or the errors found in
+                            the arguments or raised by the cull).
+    :type :                 integer and dictionary
+
+    """
+
+    try:
+        args = service['parser'].parse_args([service['dataDirectory']] + shlex.split(argumentLine))
+    except (SystemExit, ValueError):
+        # The parser has reported the problem with the arguments (or the quoting of the arguments is invalid).
+        return 400, {'errors' : ['The arguments could not be parsed: ' + argumentLine]}
+    settings, errors = PDBcontroller.check_arguments(args)
+    if errors:
+        return 400, {'errors' : errors}
+
+    # The results are returned rather than saved, and are in order of increasing threshold. The requests are already
+    # handled at once, so each cull is run in this thread.
+    settings['outputLocation'] = None
+    settings['verboseOutput'] = False
+    settings['cullProcesses'] = 1
+    settings['sequenceIdentities'] = sorted(settings['sequenceIdentities'])
+    try:
+        key = cache_key(settings)
+        selectionKey = cache_key(settings, _UNSELECTED_SETTINGS)
+    except OSError as e:
+        return 400, {'errors' : ['The file of chains to cull could not be read ({0}).'.format(e)]}
+    with service['cacheLock']:
+        response = service['cache'].get(key)
+        if response is not None:
+            service['cache'].move_to_end(key)
+            return 200, dict(response, cached=True)
+        selection = service['selectionCache'].get(selectionKey)
+        if selection is not None and selection['minSequenceIdentity'] <= settings['sequenceIdentities'][0]:
+            service['selectionCache'].move_to_end(selectionKey)
+        else:
+            selection = None
+
+    startTime = time.perf_counter()
+    try:
+        if selection is None:
+            selection = PDBcontroller.prepare_cull(service['store'], settings)
+            with service['cacheLock']:
+                _cache_result(service['selectionCache'], service['selectionCacheSize'], selectionKey, selection)
+        results = PDBcontroller.cull(service['store'], settings, selection)
+    except Exception as e:
+        return 500, {'errors' : ['The cull failed ({0}: {1}).'.format(type(e).__name__, e)]}
+    response = {'results' : [], 'cullTime' : time.perf_counter() - startTime}
+    for sequenceIdentity, proteinsToKeep, proteinsToCull, cullStats in results:
+        result = {'percent' : sequenceIdentity, 'kept' : proteinsToKeep, 'culled' : proteinsToCull}
+        if cullStats is not None:
+            result['profile'] = cullStats
+        response['results'].append(result)
+
+    with service['cacheLock']:
+        _cache_result(service['cache'], service['cacheSize'], key, response)
+    return 200, dict(response, cached=False)
+
+
+def cache_key(settings, excludedSettings=_UNCACHED_SETTINGS):
+    """Create the cache key for the settings of a cull.
+
+    By default the settings that do not change the results (the number of processes, the output location and whether
+    status updates are displayed) are left out. As the file of chains to cull may change, it is identified by its
+    location along with its size and modification time.
+
+    :param settings:            The settings for the cull (see PDBcontroller.check_arguments).
+    :type settings:             dictionary
+    :param excludedSettings:    The settings to leave out of the key.
+    :type excludedSettings:     list
+    :returns :                  The cache key.
+    :type :                     string
+
+    """
+
+    key = dict((i, settings[i]) for i in settings if i not in excludedSettings)
+    if 'sequenceIdentities' in key:
+        key['sequenceIdentities'] = sorted(set(key['sequenceIdentities']))
+    if key['inputFile'] is not None:
+        fileStats = os.stat(key['inputFile'])
+        key['inputFile'] = [os.path.abspath(key['inputFile']), fileStats.st_size, fileStats.st_mtime_ns]
+    return json.dumps(key, sort_keys=True)
+
+
+def _cache_result(cache, cacheSize, key, value):
+    """Add a value to a least recently used cache, evicting the least recently used values if the cache is too big.
+
+    :param cache:       The cache.
+    :type cache:        collections.OrderedDict
+    :param cacheSize:   The number of values to keep in the cache.
+    :type cacheSize:    integer
+    :param key:         The key of the value.
+    :type key:          string
+    :param value:       The value to cache.
+    :type value:        object
+
+    """
+
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > cacheSize:
+        cache.popitem(last=False)
+
+
+class _CullRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handle the requests for culls (see main)."""
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != CULL_PATH:
+            self._send(404, {'errors' : ['Culls are requested at ' + CULL_PATH + '.']})
+            return
+        query = urllib.parse.parse_qs(url.query, keep_blank_values=True)
+        self._send(*perform_cull(self.server.service, ' '.join(query.get('args', []))))
+
+    def do_POST(self):
+        if urllib.parse.urlsplit(self.path).path != CULL_PATH:
+            self._send(404, {'errors' : ['Culls are requested at ' + CULL_PATH + '.']})
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        except (ValueError, UnicodeDecodeError):
+            self._send(400, {'errors' : ['The arguments must be sent as UTF-8 text with a valid Content-Length.']})
+            return
+        self._send(*perform_cull(self.server.service, body))
+
+    def log_message(self, format, *args):
+        if self.server.service['verboseOutput']:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _send(self, status, response):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
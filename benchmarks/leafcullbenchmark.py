@@ -0,0 +1,165 @@
+'''
+Benchmark the Leafcull implementations on synthetic similarity graphs.
+'''
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+# Make the culling modules importable when the benchmarks are run from any directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import Leafcull
+import syntheticgraphs
+
+
+# The culling entry points that can be benchmarked.
+ENGINES = {'serial' : Leafcull.main,
+           'parallel' : Leafcull.parallel_main
+           }
+
+
+def main():
+    """Runs the Leaf culling benchmarks.
+
+    Each benchmark culls a seeded synthetic graph, and records the fastest time over a number of repeats, the peak memory
+    allocated by the culling, the number of nodes removed and a hash of the removed nodes. The results can be saved as a
+    baseline, and are otherwise compared against the saved baseline. The program exits with a non-zero status if the
+    output of any benchmark differs from the baseline, or if any benchmark is slower than the baseline by more than the
+    tolerance.
+
+    """
+
+    #===========================================================================
+    # Parse the user's input.
+    #===========================================================================
+    benchmarkDir = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description='Benchmark the Leaf culling algorithm on synthetic similarity graphs.')
+    parser.add_argument('-s', '--sizes', help='The numbers of nodes in the graphs to cull. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="numNodes", type=int, nargs='+', default=[1000, 10000, 100000], required=False)
+    parser.add_argument('-g', '--graphs', help='The types of graph to cull. (Default value: all types).',
+                        choices=sorted(syntheticgraphs.GENERATORS), nargs='+', default=sorted(syntheticgraphs.GENERATORS), required=False)
+    parser.add_argument('-e', '--engines', help='The culling entry points to benchmark. (Default value: %(default)s).',
+                        choices=sorted(ENGINES), nargs='+', default=['serial'], required=False)
+    parser.add_argument('-r', '--repeat', help='The number of times to time each culling. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="repeats", type=int, default=3, required=False)
+    parser.add_argument('--seed', help='The seed used to generate the graphs. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="seed", type=int, default=1, required=False)
+    parser.add_argument('-b', '--baseline', help='The location of the baseline results. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="baselineFile", type=str, default=os.path.join(benchmarkDir, 'baseline.json'), required=False)
+    parser.add_argument('-t', '--tolerance', help='The fraction by which a benchmark may be slower than the baseline before it is reported as a regression. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="tolerance", type=float, default=0.25, required=False)
+    parser.add_argument('--save', help='Whether to save the results as the new baseline, rather than comparing them with the baseline. Results for benchmarks that were not run are kept. (Default value: Not used).',
+                        action='store_true', default=False, required=False)
+    args = parser.parse_args()
+
+    if args.repeat < 1:
+        print('The number of repeats must be at least 1.')
+        sys.exit()
+    if any(i < 1 for i in args.sizes):
+        print('The graph sizes must be at least 1.')
+        sys.exit()
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        readIn = open(args.baseline, 'r')
+        baseline = json.load(readIn)
+        readIn.close()
+
+    #===========================================================================
+    # Run the benchmarks.
+    #===========================================================================
+    results = {}
+    failed = False
+    print('{0:<10} {1:>8} {2:<8} {3:>9} {4:>10} {5:>8}  {6}'.format('graph', 'nodes', 'engine', 'time (s)', 'peak (MB)', 'removed', 'comparison'))
+    for graph in args.graphs:
+        for numNodes in args.sizes:
+            adjList = syntheticgraphs.GENERATORS[graph](numNodes, args.seed)
+            for engine in args.engines:
+                key = '{0}/{1}/{2}'.format(graph, numNodes, engine)
+                result = run_benchmark(ENGINES[engine], adjList, args.repeat)
+                result['seed'] = args.seed
+                results[key] = result
+
+                comparison = ''
+                if not args.save:
+                    comparison, regressed = compare(result, baseline.get(key), args.tolerance)
+                    failed = failed or regressed
+                print('{0:<10} {1:>8} {2:<8} {3:>9.3f} {4:>10.1f} {5:>8}  {6}'.format(graph, numNodes, engine, result['time'],
+                                                                                      result['peakMemory'] / 2.0 ** 20,
+                                                                                      result['removed'], comparison))
+
+    if args.save:
+        baseline.update(results)
+        writeOut = open(args.baseline, 'w')
+        json.dump(baseline, writeOut, indent=4, sort_keys=True)
+        writeOut.write('\n')
+        writeOut.close()
+        print('Baseline saved to {0}.'.format(args.baseline))
+    elif failed:
+        sys.exit(1)
+
+
+def run_benchmark(engine, adjList, repeats):
+    """Time and memory-profile the culling of one graph.
+
+    The time recorded is the fastest of the repeats. The peak memory is measured in a separate run, as tracing memory
+    allocations slows the culling down. For the parallel engine only the memory allocated in the main process is traced.
+
+    :param engine:      The culling function to benchmark.
+    :type engine:       function
+    :param adjList:     An adjacency list representation of the graph to cull.
+    :type adjList:      dictionary
+    :param repeats:     The number of times to time the culling.
+    :type repeats:      integer
+    :returns :          The fastest time, the peak memory in bytes, the number of nodes removed and the hash of the removed nodes.
+    :type :             dictionary
+
+    """
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        removeList = engine(adjList)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    engine(adjList)
+    _, peakMemory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # The hash is of the sorted removed nodes, so that changes to the order of removal alone do not change the output.
+    removedHash = hashlib.sha1('\n'.join(sorted(removeList)).encode('utf-8')).hexdigest()
+    return {'time' : min(times), 'peakMemory' : peakMemory, 'removed' : len(removeList), 'removedHash' : removedHash}
+
+
+def compare(result, previous, tolerance):
+    """Compare the result of a benchmark with the baseline result.
+
+    :param result:      The result of the benchmark.
+    :type result:       dictionary
+    :param previous:    The baseline result for the benchmark (None if there is no baseline result).
+    :type previous:     dictionary
+    :param tolerance:   The fraction by which the benchmark may be slower than the baseline.
+    :type tolerance:    float
+    :returns :          A description of the comparison, and whether the output changed or the speed regressed.
+    :type :             string and boolean
+
+    """
+
+    if previous is None:
+        return 'no baseline', False
+    if previous['removedHash'] != result['removedHash']:
+        return 'OUTPUT CHANGED (baseline removed {0})'.format(previous['removed']), True
+    ratio = result['time'] / previous['time'] if previous['time'] else 1.0
+    if ratio > 1 + tolerance:
+        return 'REGRESSION ({0:.2f}x baseline time)'.format(ratio), True
+    return '{0:.2f}x baseline time'.format(ratio), False
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+'''
+Benchmark the stages of the sequence culling pipeline end to end.
+'''
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Make the culling modules importable when the benchmarks are run from any directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import checkfastaformat
+import fastaindex
+import Leafcull
+import performBLAST
+import syntheticsequences
+import userseqcontroller
+
+
+# The stages of the pipeline, in the order that they are run.
+STAGES = ['validate', 'database', 'blast', 'parse', 'adjacency', 'cull', 'write']
+
+
+def main():
+    """Runs the end-to-end benchmarks of the sequence culling pipeline.
+
+    The benchmarks cull synthetic FASTA files of protein families at a range of sizes, using the stand in makeblastdb and
+    psiblast in the stubs directory in place of the BLAST executables. The stand in executables produce output in the
+    format of the real ones (with a controllable number of hits), but take little time, and so the benchmarks show the
+    time taken by the parts of the pipeline other than the BLASTing. The time taken by each stage of the pipeline is
+    reported, and the results can be saved to a JSON file for comparison between versions.
+
+    """
+
+    #===========================================================================
+    # Parse the user's input.
+    #===========================================================================
+    benchmarkDir = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the sequence culling pipeline using stand in BLAST executables.')
+    parser.add_argument('-s', '--sizes', help='The numbers of proteins in the FASTA files to cull. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="numProteins", type=int, nargs='+', default=[1000, 5000, 20000], required=False)
+    parser.add_argument('-f', '--familySize', help='The average number of proteins in a family of homologous proteins. Larger families give more hits per query. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="familySize", type=float, default=4.0, required=False)
+    parser.add_argument('--background', help='The number of unrelated (low identity) hits the stand in psiblast reports for each query. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="hits", type=int, default=20, required=False)
+    parser.add_argument('-p', '--percent', help='The maximum percent sequence identity to cull at. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="maxPercent", type=float, default=30.0, required=False)
+    parser.add_argument('-n', '--processes', help='The number of processes to use for parsing the BLAST output. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="processes", type=int, default=1, required=False)
+    parser.add_argument('--seed', help='The seed used to generate the sequences. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="seed", type=int, default=1, required=False)
+    parser.add_argument('--save', help='The location of a JSON file to save the results to. (Required type: %(type)s, default value: Not used).',
+                        metavar="resultsFile", type=str, default=None, required=False)
+    args = parser.parse_args()
+
+    if any(i < 1 for i in args.sizes):
+        print('The numbers of proteins must be at least 1.')
+        sys.exit()
+    if args.familySize < 1:
+        print('The average family size must be at least 1.')
+        sys.exit()
+    if args.background < 0:
+        print('The number of unrelated hits must not be negative.')
+        sys.exit()
+    if args.processes < 1:
+        print('The number of processes must be at least 1.')
+        sys.exit()
+
+    #===========================================================================
+    # Run the benchmarks.
+    #===========================================================================
+    os.environ['LEAF_STUB_BACKGROUND_HITS'] = str(args.background)
+    stubsDir = os.path.join(benchmarkDir, 'stubs')
+    results = {}
+    print('{0:>8} '.format('proteins') + ' '.join('{0:>9}'.format(i) for i in STAGES + ['total']) + ' {0:>8} {1:>8}'.format('pairs', 'removed'))
+    for numProteins in args.sizes:
+        workDir = tempfile.mkdtemp(prefix='LeafPipeline')
+        try:
+            inputFile = os.path.join(workDir, 'Input.fasta')
+            syntheticsequences.write_fasta(syntheticsequences.protein_families(numProteins, args.seed, args.familySize), inputFile)
+            result = run_pipeline(inputFile, workDir, stubsDir, args.percent, args.processes)
+        finally:
+            shutil.rmtree(workDir)
+        result['seed'] = args.seed
+        result['familySize'] = args.familySize
+        result['background'] = args.background
+        results['{0}/{1:g}'.format(numProteins, args.percent)] = result
+        print('{0:>8} '.format(numProteins) + ' '.join('{0:>9.3f}'.format(result['times'][i]) for i in STAGES) +
+              ' {0:>9.3f} {1:>8} {2:>8}'.format(sum(result['times'].values()), result['pairs'], result['removed']))
+
+    if args.save is not None:
+        writeOut = open(args.save, 'w')
+        json.dump(results, writeOut, indent=4, sort_keys=True)
+        writeOut.write('\n')
+        writeOut.close()
+        print('Results saved to {0}.'.format(args.save))
+
+
+def run_pipeline(inputFile, workDir, stubsDir, sequenceIdentity, parseProcesses):
+    """Cull a FASTA file in the same way as userseqcontroller, timing each stage.
+
+    :param inputFile:           The location of the FASTA file to cull.
+    :type inputFile:            string
+    :param workDir:             The directory to put the intermediate and output files in.
+    :type workDir:              string
+    :param stubsDir:            The directory containing the stand in BLAST executables.
+    :type stubsDir:             string
+    :param sequenceIdentity:    The maximum percent sequence identity to cull at.
+    :type sequenceIdentity:     float
+    :param parseProcesses:      The number of processes to use for parsing the BLAST output.
+    :type parseProcesses:       integer
+    :returns :                  The time taken by each stage, the number of pairs of proteins that are too similar and
+                                the number of proteins removed.
+    :type :                     dictionary
+
+    """
+
+    times = {}
+
+    start = time.perf_counter()
+    fileToBLAST = os.path.join(workDir, 'InputCopy.fasta')
+    readIn = open(inputFile, 'r')
+    writeOut = open(fileToBLAST, 'w')
+    writeOutIndex = open(fileToBLAST + fastaindex.INDEX_EXTENSION, 'w')
+    errorCode, message = checkfastaformat.main(readIn, writeOut, indexFile=writeOutIndex)
+    writeOut.close()
+    writeOutIndex.close()
+    readIn.close()
+    if errorCode != 0:
+        raise ValueError(message)
+    times['validate'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    database = performBLAST.make_database(fileToBLAST, os.path.join(workDir, 'TempDatabase'), stubsDir)
+    times['database'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    resultsBLAST = os.path.join(workDir, 'BLASTOutput.txt')
+    performBLAST.sequence_BLAST(resultsBLAST, fileToBLAST, database, os.path.join(stubsDir, 'psiblast'), 1)
+    times['blast'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    similarities = performBLAST.parse_output(resultsBLAST, 20, 1.0, sequenceIdentity, parseProcesses)
+    times['parse'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    similarities = [(similarities[i], i[0], i[1]) for i in similarities]
+    similarities.sort(key=lambda x: x[0], reverse=True)
+    adjList = Leafcull.create_adjacency(similarities)
+    times['adjacency'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    proteinsToCull = Leafcull.main(adjList)
+    times['cull'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    outputLocation = os.path.join(workDir, 'Results')
+    os.mkdir(outputLocation)
+    userseqcontroller.save_results(proteinsToCull, fileToBLAST, outputLocation)
+    times['write'] = time.perf_counter() - start
+
+    return {'times' : times, 'pairs' : len(similarities), 'removed' : len(proteinsToCull)}
+
+
+if __name__ == '__main__':
+    main()
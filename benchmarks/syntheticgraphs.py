@@ -0,0 +1,157 @@
+'''
+Generate synthetic similarity graphs for the benchmarks of Leafcull.
+'''
+
+import random
+
+
+def erdos_renyi(numNodes, seed, meanDegree=4.0):
+    """Generate a random graph where every pair of nodes is equally likely to be connected.
+
+    :param numNodes:    The number of nodes in the graph.
+    :type numNodes:     integer
+    :param seed:        The seed for the random number generator.
+    :type seed:         integer
+    :param meanDegree:  The average number of neighbours of a node.
+    :type meanDegree:   float
+    :returns :          An adjacency list representation of the graph.
+    :type :             dictionary
+
+    """
+
+    rng = random.Random(seed)
+    edges = []
+    for _ in range(int(numNodes * meanDegree / 2)):
+        edges.append((rng.randrange(numNodes), rng.randrange(numNodes)))
+    return _to_adjacency(edges)
+
+
+def dense_clusters(numNodes, seed, minClusterSize=3, maxClusterSize=40, withinProbability=0.8, betweenPerNode=0.02):
+    """Generate a graph made of many small dense clusters, with a few edges between the clusters.
+
+    :param numNodes:            The number of nodes in the graph.
+    :type numNodes:             integer
+    :param seed:                The seed for the random number generator.
+    :type seed:                 integer
+    :param minClusterSize:      The minimum number of nodes in a cluster.
+    :type minClusterSize:       integer
+    :param maxClusterSize:      The maximum number of nodes in a cluster.
+    :type maxClusterSize:       integer
+    :param withinProbability:   The probability that two nodes in the same cluster are connected.
+    :type withinProbability:    float
+    :param betweenPerNode:      The number of edges between clusters per node.
+    :type betweenPerNode:       float
+    :returns :                  An adjacency list representation of the graph.
+    :type :                     dictionary
+
+    """
+
+    rng = random.Random(seed)
+    edges = []
+    start = 0
+    while start < numNodes:
+        end = min(numNodes, start + rng.randint(minClusterSize, maxClusterSize))
+        for i in range(start, end):
+            for j in range(i + 1, end):
+                if rng.random() < withinProbability:
+                    edges.append((i, j))
+        start = end
+    for _ in range(int(numNodes * betweenPerNode)):
+        edges.append((rng.randrange(numNodes), rng.randrange(numNodes)))
+    return _to_adjacency(edges)
+
+
+def power_law(numNodes, seed, meanDegree=4.0, exponent=2.3):
+    """Generate a graph with a power law degree distribution, like that of the PDB similarity graph.
+
+    The graph is generated using the Chung-Lu model, where the probability that two nodes are connected is proportional
+    to the product of their weights, and the weights follow a power law.
+
+    :param numNodes:    The number of nodes in the graph.
+    :type numNodes:     integer
+    :param seed:        The seed for the random number generator.
+    :type seed:         integer
+    :param meanDegree:  The average number of neighbours of a node.
+    :type meanDegree:   float
+    :param exponent:    The exponent of the power law.
+    :type exponent:     float
+    :returns :          An adjacency list representation of the graph.
+    :type :             dictionary
+
+    """
+
+    rng = random.Random(seed)
+    cumulativeWeights = []
+    total = 0.0
+    for i in range(numNodes):
+        total += (i + 1) ** (-1.0 / (exponent - 1))
+        cumulativeWeights.append(total)
+    numEdges = int(numNodes * meanDegree / 2)
+    nodes = range(numNodes)
+    endsA = rng.choices(nodes, cum_weights=cumulativeWeights, k=numEdges)
+    endsB = rng.choices(nodes, cum_weights=cumulativeWeights, k=numEdges)
+    # Shuffle the node labels so that the high degree nodes are not also the nodes with the smallest identifiers.
+    labels = list(nodes)
+    rng.shuffle(labels)
+    return _to_adjacency((labels[i], labels[j]) for i, j in zip(endsA, endsB))
+
+
+def giant_component(numNodes, seed, meanDegree=6.0):
+    """Generate a connected graph (a single giant component).
+
+    Each node is connected to a random earlier node (making a random spanning tree), and random edges are then added
+    until the required average number of neighbours is reached.
+
+    :param numNodes:    The number of nodes in the graph.
+    :type numNodes:     integer
+    :param seed:        The seed for the random number generator.
+    :type seed:         integer
+    :param meanDegree:  The average number of neighbours of a node.
+    :type meanDegree:   float
+    :returns :          An adjacency list representation of the graph.
+    :type :             dictionary
+
+    """
+
+    rng = random.Random(seed)
+    edges = [(i, rng.randrange(i)) for i in range(1, numNodes)]
+    for _ in range(max(0, int(numNodes * meanDegree / 2) - len(edges))):
+        edges.append((rng.randrange(numNodes), rng.randrange(numNodes)))
+    return _to_adjacency(edges)
+
+
+# The graph generators available to the benchmarks.
+GENERATORS = {'erdosrenyi' : erdos_renyi,
+              'clusters' : dense_clusters,
+              'powerlaw' : power_law,
+              'giant' : giant_component
+              }
+
+
+def _to_adjacency(edges):
+    """Convert pairs of integer nodes into an adjacency list keyed by protein-like identifiers.
+
+    Self-loops and repeated edges are ignored.
+
+    :param edges:   The pairs of nodes that are connected.
+    :type edges:    iterable
+    :returns :      An adjacency list representation of the graph.
+    :type :         dictionary
+
+    """
+
+    adjList = {}
+    for a, b in edges:
+        if a == b:
+            continue
+        nodeA = 'S{0:07d}'.format(a)
+        nodeB = 'S{0:07d}'.format(b)
+        if nodeA in adjList:
+            adjList[nodeA].add(nodeB)
+        else:
+            adjList[nodeA] = set([nodeB])
+        if nodeB in adjList:
+            adjList[nodeB].add(nodeA)
+        else:
+            adjList[nodeB] = set([nodeA])
+    return adjList
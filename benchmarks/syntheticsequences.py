@@ -0,0 +1,74 @@
+'''
+Generate synthetic FASTA files of protein families for the benchmarks.
+'''
+
+import random
+
+# The amino acids used in the sequences.
+_AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+# The number of residues on each sequence line of the FASTA files.
+_LINE_LENGTH = 60
+
+
+def protein_families(numProteins, seed, meanFamilySize=4.0, minLength=80, maxLength=400, minIdentity=20.0,
+                     maxIdentity=100.0):
+    """Generate the sequences of proteins in families of homologous proteins.
+
+    Each family has a random ancestral sequence, and each member of the family is a copy of the ancestor in which the
+    residues at a random subset of the positions have been substituted, so that the member has a chosen percentage
+    identity to the ancestor. The identifier of each protein is F<family>_<member>, which is how the stand in psiblast
+    tells which proteins are homologous. The number of similarities found (the hit density) grows with the family size.
+
+    :param numProteins:     The number of proteins to generate.
+    :type numProteins:      integer
+    :param seed:            The seed for the random number generator.
+    :type seed:             integer
+    :param meanFamilySize:  The average number of proteins in a family (family sizes are geometrically distributed).
+    :type meanFamilySize:   float
+    :param minLength:       The minimum length of a sequence.
+    :type minLength:        integer
+    :param maxLength:       The maximum length of a sequence.
+    :type maxLength:        integer
+    :param minIdentity:     The minimum percentage identity of a member of a family to the ancestor of the family.
+    :type minIdentity:      float
+    :param maxIdentity:     The maximum percentage identity of a member of a family to the ancestor of the family.
+    :type maxIdentity:      float
+    :returns :              The identifier and sequence of each protein.
+    :type :                 list
+
+    """
+
+    rng = random.Random(seed)
+    proteins = []
+    family = 0
+    while len(proteins) < numProteins:
+        ancestor = rng.choices(_AMINO_ACIDS, k=rng.randint(minLength, maxLength))
+        familySize = 1
+        while rng.random() > 1.0 / meanFamilySize:
+            familySize += 1
+        for member in range(min(familySize, numProteins - len(proteins))):
+            sequence = list(ancestor)
+            identity = rng.uniform(minIdentity, maxIdentity)
+            for i in rng.sample(range(len(sequence)), int(len(sequence) * (100.0 - identity) / 100.0)):
+                sequence[i] = rng.choice(_AMINO_ACIDS)
+            proteins.append(('F{0:07d}_{1}'.format(family, member), ''.join(sequence)))
+        family += 1
+    return proteins
+
+
+def write_fasta(proteins, fastaFile):
+    """Write proteins to a FASTA file, with the sequences split over multiple lines.
+
+    :param proteins:    The identifier and sequence of each protein.
+    :type proteins:     list
+    :param fastaFile:   The location at which to write the FASTA file.
+    :type fastaFile:    string
+
+    """
+
+    writeOut = open(fastaFile, 'w')
+    for proteinID, sequence in proteins:
+        writeOut.write('>' + proteinID + ' synthetic protein\n')
+        for i in range(0, len(sequence), _LINE_LENGTH):
+            writeOut.write(sequence[i:i + _LINE_LENGTH] + '\n')
+    writeOut.close()
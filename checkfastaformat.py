@@ -4,10 +4,12 @@ Created on 2 Feb 2011
 @author: Simon Bull
 '''
 
-def main(fileToCheck, minLength=-1, maxLength=-1):
+import fastaindex
+
+def main(fileToCheck, outputFile, minLength=-1, maxLength=-1, indexFile=None):
     """Determines whether fileToCheck is an appropriately formatted FASTA file.
 
-    An appropriately formatted FASTA file is returned in correctFormatting.
+    An appropriately formatted FASTA file is written to outputFile.
 
     FASTA files are accepted if they have the format:
     >PID1
@@ -17,125 +19,207 @@ def main(fileToCheck, minLength=-1, maxLength=-1):
 
     Where PID1 and PID2 can be anything, and letters are a (possibly multiline) sequence of alphabetic letters.
     The letters can be upper or lower case, and each letter is interpreted as one amino acid.
-    The correctly formatted FASTA file is returned with the sequence only going over one line, and all letters
+    The correctly formatted FASTA file is written with the sequence only going over one line, and all letters
     in upper case.
 
     If a protein (i.e. a FASTA information line) appears in the file more than one time, then the final appearance is
     taken to be the correct one. Prior appearances are discarded.
 
-    :param fileToCheck: A string containing the contents of a potential FASTA format file.
-    :type fileToCheck:  string
+    The file is read twice, one record at a time. The first pass checks the formatting and determines which appearance
+    of each protein is kept, and the second pass writes out the kept proteins. Only the record being written is held in
+    memory. Nothing is written to outputFile (or indexFile) if the file is not appropriately formatted.
+
+    :param fileToCheck: A potential FASTA format file, open for reading (it must be possible to seek back to its start).
+    :type fileToCheck:  file
+    :param outputFile:  The file to write the valid FASTA format contents to, open for writing.
+    :type outputFile:   file
     :param minLength:   The minimum length that a protein sequence in the FASTA file is permitted to be.
     :type minLength:    integer
     :param maxLength:   The maximum length that a protein sequence in the FASTA file is permitted to be.
     :type maxLength:    integer
-    :returns :          The numerical code for the error and the error message or the valid FASTA format contents.
+    :param indexFile:   If not None, a file open for writing, to which the fastaindex index of the records written to
+                        outputFile is written.
+    :type indexFile:    file
+    :returns :          The numerical code for the error and the error message (an empty string if the file is valid).
     :type :             integer and a unicode string
 
     """
 
     # Initialise variables.
     lineCount = 1  # The number of the line being examined. Used for displaying error messages.
+    blankLine = None  # The number of the first of the blank lines since the last line with any content.
     protDescription = True  # Whether or not we are currently expecting a line starting with >.
     firstLine = True  # Whether or not we are currently examining the first line of the file.
-    proteinsInFile = {}  # A dictionary indexed by the protein description line of the FASTA file.
-                         # The value of each entry is the correctly formatted protein sequence corresponding to the index.
-
-    # Strip off all excess whitespace, and split the string into the individual lines of the file.
-    checking = fileToCheck.rstrip()
-    checking = checking.lstrip()
-    checking = checking.split('\n')
-    for line in checking:
-        line = line.rstrip()
+    currentProt = None  # The description line of the protein whose sequence is being inspected.
+    currentLength = 0  # The length of the sequence of the protein being inspected.
+    recordCount = 0  # The number of protein records that have been examined.
+    keptRecords = {}  # A dictionary indexed by the protein description line of the FASTA file.
+                      # The value of each entry is the number of the final record of the protein with a valid length.
+
+    for line in _lines(fileToCheck):
+        if not line:
+            # Blank lines at the end of the file are ignored, but any other blank line is an error (which is reported
+            # once the next line with any content is found).
+            if blankLine is None:
+                blankLine = lineCount
+            lineCount += 1
+            continue
+        if blankLine is not None:
+            if protDescription:
+                errorMessage = "Expected line " + str(blankLine) + " to start with a >, but instead got: "
+                return 1, errorMessage
+            errorMessage = "Expected line " + str(blankLine) + " to contain only letters, but instead got: "
+            return 2, errorMessage
+
         if firstLine:
-            # True if we have just started parsing the file string, and haven;t yet examined any lines.
-            if line[0] == '>':
+            # True if we have just started parsing the file, and haven't yet examined any lines.
+            if line.startswith('>'):
                 currentProt = line  # Record the description line of the protein which is about to have its sequence inspected.
-                currentSeq = ''  # Initialise the sequence of the protein.
+                currentLength = 0  # Initialise the length of the sequence of the protein.
                 protDescription = False  # We are now expecting a protein sequence, not a protein description.
                 firstLine = False
             else:
                 # The first line of the file MUST be a protein description line (i.e. start with '>'). If the line was not
-                # the beginning of a protein record, terminate the program.
+                # the beginning of a protein record, terminate the checking.
                 errorMessage = "Expected line " + str(lineCount) + " to start with a >, but instead got: " + line
                 return 1, errorMessage
         elif protDescription:
             # This is true only if a line beginning with a '>' is expected.
-            if line[0] == '>':
+            if line.startswith('>'):
                 # Expected a protein description line, and found a protein description line. This means that the entire sequence
                 # of the currentProt protein has been found (i.e. we have finished inspecting the sequence of a protein, and
-                # have found the protein to be valid). Now determine if the length of the sequence is within the user
+                # have found the protein to be valid). Now record the protein if the length of the sequence is within the user
                 # specified bounds.
-                if minLength == -1:
-                    if maxLength == -1:
-                        # If there are no restrictions on the protein sequence length, then record the protein and its sequence.
-                        proteinsInFile[currentProt] = currentSeq
-                    elif len(currentSeq) <= maxLength:
-                        # If there is no minimum length restriction, and the protein sequence is not longer than the maximum
-                        # sequence length permitted, then record the protein and its sequence.
-                        proteinsInFile[currentProt] = currentSeq
-                elif len(currentSeq) >= minLength:
-                    if maxLength == -1:
-                        # If there is no maximum length restriction, and the protein sequence is not shorter than the minimum
-                        # sequence length permitted, then record the protein and its sequence.
-                        proteinsInFile[currentProt] = currentSeq
-                    elif len(currentSeq) <= maxLength:
-                        # If the protein sequence is not shorter than the minimum sequence length permitted and not longer
-                        # than the maximum length permitted, then record the protein and its sequence.
-                        proteinsInFile[currentProt] = currentSeq
+                if _valid_length(currentLength, minLength, maxLength):
+                    keptRecords[currentProt] = recordCount
+                recordCount += 1
                 currentProt = line  # Record the description line of the protein which is about to have its sequence inspected.
-                currentSeq = ''  # Initialise the sequence of the protein.
+                currentLength = 0  # Initialise the length of the sequence of the protein.
                 protDescription = False  # We are now expecting a protein sequence, not a protein description.
             else:
                 # If the line does not begin with a '>', and it is expected to, it is possible that the amino acid sequence
                 # is split over multiple lines.
                 if line.isalpha():
                     # If every character on the line is a letter, then the line contains a valid portion of the sequence.
-                    # Add the uppercase version of the sequence portion to the sequence currently being recorded.
-                    currentSeq += line.upper()
+                    currentLength += len(line)
                 else:
-                    # If the line did not contain only letters, terminate the program.
+                    # If the line did not contain only letters, terminate the checking.
                     errorMessage = "Expected line " + str(lineCount) + " to start with a >, but instead got: " + line
                     return 1, errorMessage
         else:
             # If an amino acid sequence is expected.
             if line.isalpha():
-                # If the line is all alphabetic characters, write the line out and indicate that we are expecting a
+                # If the line is all alphabetic characters, record its length and indicate that we are expecting a
                 # protein description line next (i.e. one beginning with a '>').
-                currentSeq += line.upper()
+                currentLength += len(line)
                 protDescription = True
             else:
-                # If the line did not contain only letters, terminate the program.
+                # If the line did not contain only letters, terminate the checking.
                 errorMessage = "Expected line " + str(lineCount) + " to contain only letters, but instead got: " + line
                 return 2, errorMessage
 
         lineCount += 1
 
     # Catch the final protein from the file, and determine whether it should be recorded.
-    if minLength == -1:
-        if maxLength == -1:
-            proteinsInFile[currentProt] = currentSeq
-        elif len(currentSeq) <= maxLength:
-            proteinsInFile[currentProt] = currentSeq
-    elif len(currentSeq) >= minLength:
-        if maxLength == -1:
-            proteinsInFile[currentProt] = currentSeq
-        elif len(currentSeq) <= maxLength:
-            proteinsInFile[currentProt] = currentSeq
-
-    if len(proteinsInFile.keys()) < 2:
+    if currentProt is not None and _valid_length(currentLength, minLength, maxLength):
+        keptRecords[currentProt] = recordCount
+
+    if len(keptRecords) < 2:
         # There are too few protein sequences entered
         errorMessage = ("Not enough unique protein sequences have been entered." +
                         " This is possibly caused by not enough sequences of the required minimum and maximum length being provided."
                         )
         return 3, errorMessage
-    elif protDescription:
-        # Return an indication that the FASTA file is correctly formatted.
-        outputString = ''
-        for i in proteinsInFile.keys():
-            outputString += i + '\n' + proteinsInFile[i] + '\n'
-        return 0, outputString[:-1]
-    else:
+    elif not protDescription:
         # The file did not end with a protein sequence.
         errorMessage = "Reached the end of the file, but no protein sequence found for the final protein."
         return 3, errorMessage
+
+    # Write out the kept record of each protein, with the sequence on one line and in upper case.
+    fileToCheck.seek(0)
+    recordCount = -1
+    recording = False  # Whether the record being examined is being kept.
+    sequence = []  # The upper case lines of the sequence of the record being kept.
+    offset = 0  # The byte offset in outputFile of the record being kept.
+    for line in _lines(fileToCheck):
+        if line.startswith('>'):
+            if recording:
+                offset = _write_sequence(outputFile, indexFile, description, offset, ''.join(sequence))
+            recordCount += 1
+            recording = keptRecords.get(line) == recordCount
+            sequence = []
+            if recording:
+                description = line
+                outputFile.write(line + '\n')
+        elif recording and line:
+            sequence.append(line.upper())
+    if recording:
+        _write_sequence(outputFile, indexFile, description, offset, ''.join(sequence))
+
+    # Return an indication that the FASTA file is correctly formatted.
+    return 0, ''
+
+
+def _lines(fileToCheck):
+    """Generate the lines of a file without their trailing whitespace, starting at the first line with any content.
+
+    The leading whitespace of the first line with any content is also removed.
+
+    :param fileToCheck: The file to generate the lines of.
+    :type fileToCheck:  file
+    :returns :          The lines of the file.
+    :type :             generator of strings
+
+    """
+
+    lines = iter(fileToCheck)
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield line
+            break
+    for line in lines:
+        yield line.rstrip()
+
+
+def _write_sequence(outputFile, indexFile, description, offset, sequence):
+    """Write the sequence of a kept record, and the index entry of the record.
+
+    :param outputFile:  The file that the record is being written to.
+    :type outputFile:   file
+    :param indexFile:   The file to write the index entry to (not used if None).
+    :type indexFile:    file
+    :param description: The description line of the record (including the leading '>').
+    :type description:  string
+    :param offset:      The byte offset of the start of the record in outputFile.
+    :type offset:       integer
+    :param sequence:    The sequence of the record.
+    :type sequence:     string
+    :returns :          The byte offset of the start of the next record.
+    :type :             integer
+
+    """
+
+    outputFile.write(sequence + '\n')
+    # The index records lengths in bytes, which only differ from the number of letters for non-ASCII letters.
+    sequenceLength = len(sequence.encode('utf-8'))
+    if indexFile is not None:
+        indexFile.write(fastaindex.index_line(description[1:], offset, sequenceLength))
+    return offset + len(description.encode('utf-8')) + sequenceLength + 2
+
+
+def _valid_length(length, minLength, maxLength):
+    """Determine whether a sequence length is within the user specified bounds.
+
+    :param length:      The length of the sequence.
+    :type length:       integer
+    :param minLength:   The minimum length permitted (-1 if there is no minimum).
+    :type minLength:    integer
+    :param maxLength:   The maximum length permitted (-1 if there is no maximum).
+    :type maxLength:    integer
+    :returns :          Whether the length is permitted.
+    :type :             boolean
+
+    """
+
+    return (minLength == -1 or length >= minLength) and (maxLength == -1 or length <= maxLength)
@@ -0,0 +1,183 @@
+'''
+Group the redundant sequences of a FASTA file, so that only one representative of each group needs to be BLASTed.
+'''
+
+import hashlib
+
+# The length of the sequence fragments used to find the sequences that contain a given sequence.
+_FRAGMENT_LENGTH = 8
+# Only every _FRAGMENT_STEP-th fragment of a representative sequence is indexed. A sequence must be at least
+# _FRAGMENT_LENGTH + _FRAGMENT_STEP - 1 long to be found inside another sequence, as otherwise none of its fragments may
+# line up with an indexed fragment.
+_FRAGMENT_STEP = 16
+MIN_CONTAINED_LENGTH = _FRAGMENT_LENGTH + _FRAGMENT_STEP - 1
+
+def main(fastaFile, representativeFile, containment=False, minAlignLength=20):
+    """Group the proteins with identical sequences (and optionally sequences contained in other sequences).
+
+    The proteins in each group are redundant with each other, and so only one representative protein from each group
+    needs to be BLASTed. For groups of identical sequences the representative is the first protein in the file. When
+    containment is used, a sequence that is a substring of a longer representative sequence is placed in the group of the
+    first such representative (sequences shorter than MIN_CONTAINED_LENGTH are only grouped when identical).
+
+    Sequences shorter than minAlignLength are never grouped, as BLAST alignments that short are ignored and so identical
+    short sequences are not found to be similar when every sequence is BLASTed.
+
+    The protein identifiers are the characters of the description line up to the first whitespace, as used by BLAST.
+
+    :param fastaFile:           The location of the FASTA file of the proteins to group.
+    :type fastaFile:            string
+    :param representativeFile:  The location at which to write a FASTA file of the representative proteins.
+    :type representativeFile:   string
+    :param containment:         Whether to group sequences with the longer sequences that contain them.
+    :type containment:          boolean
+    :param minAlignLength:      The minimum permissible length for the BLAST sequence alignments.
+    :type minAlignLength:       integer
+    :returns :                  A record of the other members of each group, indexed by the representative protein.
+                                Representatives without any other members are not included.
+    :type :                     dictionary
+
+    """
+
+    # Read the proteins, and group the ones with identical sequences.
+    representatives = []  # The description line and sequence of each representative, in file order.
+    representativeOfHash = {}  # The identifier of the representative protein with each sequence hash.
+    groups = {}
+    readFasta = open(fastaFile, 'r', encoding='utf-8')
+    description = None
+    sequence = []
+    for line in readFasta:
+        if line[0] == '>':
+            if description is not None:
+                add_protein(description, ''.join(sequence), representatives, representativeOfHash, groups, minAlignLength)
+            description = line.rstrip('\n')
+            sequence = []
+        else:
+            sequence.append(line.strip().upper())
+    if description is not None:
+        add_protein(description, ''.join(sequence), representatives, representativeOfHash, groups, minAlignLength)
+    readFasta.close()
+
+    if containment:
+        # Work through the representatives from the longest to the shortest, so that any sequence that contains another
+        # has already been indexed when the contained sequence is reached.
+        fragmentIndex = {}  # The indices of the representatives with each indexed fragment.
+        contained = set()
+        order = sorted(range(len(representatives)), key=lambda x: len(representatives[x][1]), reverse=True)
+        for i in order:
+            description, sequence = representatives[i]
+            containingRepresentative = None
+            if len(sequence) >= max(MIN_CONTAINED_LENGTH, minAlignLength):
+                # One of the first _FRAGMENT_STEP fragments of the sequence lines up with an indexed fragment of any
+                # representative that contains it.
+                candidates = set()
+                for j in range(_FRAGMENT_STEP):
+                    candidates.update(fragmentIndex.get(sequence[j:j + _FRAGMENT_LENGTH], ()))
+                for j in sorted(candidates):
+                    if sequence in representatives[j][1]:
+                        containingRepresentative = j
+                        break
+            if containingRepresentative is None:
+                for j in range(0, len(sequence) - _FRAGMENT_LENGTH + 1, _FRAGMENT_STEP):
+                    fragmentIndex.setdefault(sequence[j:j + _FRAGMENT_LENGTH], []).append(i)
+            else:
+                # Move the sequence (and the members of its group) into the group of the representative containing it.
+                contained.add(i)
+                proteinID = protein_ID(description)
+                containingID = protein_ID(representatives[containingRepresentative][0])
+                groups.setdefault(containingID, []).append(proteinID)
+                groups[containingID].extend(groups.pop(proteinID, []))
+        representatives = [representatives[i] for i in range(len(representatives)) if i not in contained]
+
+    # Write out the representatives.
+    writeOut = open(representativeFile, 'w', encoding='utf-8', newline='\n')
+    for description, sequence in representatives:
+        writeOut.write(description + '\n' + sequence + '\n')
+    writeOut.close()
+
+    return groups
+
+
+def add_protein(description, sequence, representatives, representativeOfHash, groups, minAlignLength=20):
+    """Add a protein to the group of proteins with the same sequence, making it the representative if it is the first.
+
+    A protein shorter than minAlignLength is always made a representative of its own.
+
+    :param description:             The description line of the protein.
+    :type description:              string
+    :param sequence:                The sequence of the protein.
+    :type sequence:                 string
+    :param representatives:         The description line and sequence of each representative.
+    :type representatives:          list
+    :param representativeOfHash:    The identifier of the representative protein with each sequence hash.
+    :type representativeOfHash:     dictionary
+    :param groups:                  The other members of each group, indexed by the representative protein.
+    :type groups:                   dictionary
+    :param minAlignLength:          The minimum permissible length for the BLAST sequence alignments.
+    :type minAlignLength:           integer
+
+    """
+
+    if len(sequence) < minAlignLength:
+        representatives.append((description, sequence))
+        return
+    sequenceHash = hashlib.sha1(sequence.encode('utf-8')).hexdigest()
+    if sequenceHash in representativeOfHash:
+        groups.setdefault(representativeOfHash[sequenceHash], []).append(protein_ID(description))
+    else:
+        representativeOfHash[sequenceHash] = protein_ID(description)
+        representatives.append((description, sequence))
+
+
+def expand(similarities, groups):
+    """Expand the similarities between representative proteins to the members of their groups.
+
+    The members of a group are given the similarities of their representative, and every pair of proteins in the same
+    group is made 100% similar. As main never groups sequences shorter than the minimum alignment length, no pair of
+    such sequences is made 100% similar.
+
+    :param similarities:    The similarities between pairs of representative proteins, indexed by an alphanumerically
+                            ordered tuple of the proteins.
+    :type similarities:     dictionary
+    :param groups:          The other members of each group, indexed by the representative protein.
+    :type groups:           dictionary
+    :returns :              The similarities between pairs of proteins, indexed by an alphanumerically ordered tuple of
+                            the proteins.
+    :type :                 dictionary
+
+    """
+
+    expandedSimilarities = {}
+
+    def record(proteinA, proteinB, similarity):
+        pair = (proteinA, proteinB) if proteinA < proteinB else (proteinB, proteinA)
+        if not (pair in expandedSimilarities and expandedSimilarities[pair] >= similarity):
+            expandedSimilarities[pair] = similarity
+
+    for representative in groups:
+        members = [representative] + groups[representative]
+        for i in range(len(members)):
+            for j in range(i + 1, len(members)):
+                if members[i] != members[j]:
+                    record(members[i], members[j], 100.0)
+    for (proteinA, proteinB), similarity in similarities.items():
+        for memberA in [proteinA] + groups.get(proteinA, []):
+            for memberB in [proteinB] + groups.get(proteinB, []):
+                if memberA != memberB:
+                    record(memberA, memberB, similarity)
+
+    return expandedSimilarities
+
+
+def protein_ID(description):
+    """Get the identifier of a protein from its description line (the characters up to the first whitespace).
+
+    :param description: The description line of the protein (starting with a '>').
+    :type description:  string
+    :returns :          The identifier of the protein.
+    :type :             string
+
+    """
+
+    chunks = description[1:].split()
+    return chunks[0] if chunks else ''
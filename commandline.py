@@ -0,0 +1,30 @@
+'''
+The argument types shared by the command line interfaces of the controllers.
+'''
+
+import argparse
+
+def percent_values(value):
+    """Convert a command line percentage, or an inclusive range of percentages of the form start:stop:step, to a list of floats.
+
+    :param value:   The percentage or range of percentages.
+    :type value:    string
+    :returns :      The percentages.
+    :type :         list
+
+    """
+
+    try:
+        chunks = [float(i) for i in value.split(':')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid percentage or range of percentages: {0}'.format(value))
+    if len(chunks) == 1:
+        return chunks
+    elif len(chunks) != 3 or chunks[2] <= 0 or chunks[1] < chunks[0]:
+        raise argparse.ArgumentTypeError('ranges of percentages must be of the form start:stop:step with start <= stop and a positive step: {0}'.format(value))
+    start, stop, step = chunks
+    percentages = []
+    numSteps = int((stop - start) / step + 1e-9)
+    for i in range(numSteps + 1):
+        percentages.append(round(start + i * step, 10))
+    return percentages
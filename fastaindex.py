@@ -0,0 +1,158 @@
+'''
+Index the records of a validated FASTA file, so that the records of chosen proteins can be read without scanning
+the whole file.
+'''
+
+import mmap
+import os
+
+# The extension added to the location of a FASTA file to get the location of its index.
+INDEX_EXTENSION = '.fai'
+
+def main(fastaFile):
+    """Index the records of a validated FASTA file (as written by checkfastaformat).
+
+    In a validated FASTA file each record is a description line followed by the whole sequence on one line, and so a
+    record can be located from the offset of its first byte, the length of its description line and the length of its
+    sequence.
+
+    :param fastaFile:   The location of the validated FASTA file.
+    :type fastaFile:    string
+    :returns :          The description line (without the leading '>'), the byte offset of the start of the record and
+                        the length of the sequence of each record, in file order.
+    :type :             list
+
+    """
+
+    index = []
+    readFasta = open(fastaFile, 'rb')
+    offset = 0
+    description = None
+    for line in readFasta:
+        if line[:1] == b'>':
+            description = line[1:].rstrip(b'\n').decode('utf-8')
+            recordOffset = offset
+        elif description is not None:
+            index.append((description, recordOffset, len(line.rstrip(b'\n'))))
+            description = None
+        offset += len(line)
+    readFasta.close()
+    return index
+
+
+def load(fastaFile):
+    """Load the index of a validated FASTA file, indexing the file if it has no up to date saved index.
+
+    The saved index is at the location of the FASTA file with INDEX_EXTENSION added. It is out of date if it is older
+    than the FASTA file, or if its final record does not end at the end of the FASTA file.
+
+    :param fastaFile:   The location of the validated FASTA file.
+    :type fastaFile:    string
+    :returns :          The index of the FASTA file (see main).
+    :type :             list
+
+    """
+
+    indexFile = fastaFile + INDEX_EXTENSION
+    if os.path.isfile(indexFile) and os.path.getmtime(indexFile) >= os.path.getmtime(fastaFile):
+        index = []
+        readIndex = open(indexFile, 'r', encoding='utf-8')
+        for line in readIndex:
+            # The description may contain tabs, and so the line is split from the right.
+            description, length, offset = line.rstrip('\n').rsplit('\t', 2)
+            index.append((description, int(offset), int(length)))
+        readIndex.close()
+        if (record_end(index[-1]) if index else 0) == os.path.getsize(fastaFile):
+            return index
+    return main(fastaFile)
+
+
+def index_line(description, offset, length):
+    """Format the entry for a record in a saved index.
+
+    Like a samtools .fai index, each line of the saved index gives the name of a record, the length of its sequence and
+    its offset, separated by tabs. Here the name is the whole description line and the offset is that of the start of
+    the record (rather than the start of the sequence).
+
+    :param description: The description line of the record (without the leading '>').
+    :type description:  string
+    :param offset:      The byte offset of the start of the record.
+    :type offset:       integer
+    :param length:      The length of the sequence of the record.
+    :type length:       integer
+    :returns :          The line of the saved index.
+    :type :             string
+
+    """
+
+    return description + '\t' + str(length) + '\t' + str(offset) + '\n'
+
+
+def record_end(entry):
+    """Determine the byte offset just past the end of a record of a validated FASTA file.
+
+    :param entry:   The index entry of the record (as returned by main).
+    :type entry:    tuple
+    :returns :      The offset of the byte after the newline ending the sequence of the record.
+    :type :         integer
+
+    """
+
+    description, offset, length = entry
+    return offset + len(description.encode('utf-8')) + length + 3
+
+
+def map_identifiers(index):
+    """Map the identifier of each protein in an index to its index entry.
+
+    The identifier of a protein is the characters of its description line up to the first whitespace. The map only needs
+    to be made once for any number of calls to fetch.
+
+    :param index:   The index of a validated FASTA file (see load).
+    :type index:    list
+    :returns :      The index entry of each protein, indexed by the protein identifier.
+    :type :         dictionary
+
+    """
+
+    entryOfID = {}
+    for entry in index:
+        chunks = entry[0].split()
+        entryOfID[chunks[0] if chunks else ''] = entry
+    return entryOfID
+
+
+def fetch(fastaFile, proteinIDs, entryOfID=None):
+    """Get the sequences of proteins from a validated FASTA file, without reading the rest of the file.
+
+    The file is memory mapped, and each sequence is read directly from its offset.
+
+    :param fastaFile:   The location of the validated FASTA file.
+    :type fastaFile:    string
+    :param proteinIDs:  The identifiers of the proteins to get the sequences of.
+    :type proteinIDs:   iterable
+    :param entryOfID:   The index entry of each protein in the FASTA file (see map_identifiers). If None, the index is
+                        loaded with load and mapped, which is slow when fetching from the same file repeatedly.
+    :type entryOfID:    dictionary
+    :returns :          The sequence of each of the proteins found in the file, indexed by the protein identifier.
+    :type :             dictionary
+
+    """
+
+    if entryOfID is None:
+        entryOfID = map_identifiers(load(fastaFile))
+
+    sequences = {}
+    entries = [(i, entryOfID[i]) for i in proteinIDs if i in entryOfID]
+    if not entries:
+        return sequences
+    readFasta = open(fastaFile, 'rb')
+    fastaMap = mmap.mmap(readFasta.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        for proteinID, (description, offset, length) in entries:
+            sequenceStart = offset + len(description.encode('utf-8')) + 2
+            sequences[proteinID] = fastaMap[sequenceStart:sequenceStart + length].decode('utf-8')
+    finally:
+        fastaMap.close()
+        readFasta.close()
+    return sequences
@@ -0,0 +1,309 @@
+'''
+Estimate the similarity of protein sequences from the k-mers they share, as a fast alternative to BLAST.
+'''
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    # The k-mer engine is optional, and is only unavailable when NumPy is not installed.
+    numpy = None
+
+# The length of the k-mers that are compared.
+_KMER_LENGTH = 4
+# K-mers found in more than this many sequences (e.g. from low complexity regions) are ignored.
+_MAX_KMER_FREQUENCY = 10000
+# The (approximate) number of pairs of sequences sharing a k-mer that are generated at once.
+_PAIRS_PER_BLOCK = 1 << 22
+# The longest k-mers used by the prefilter (the longest that can be encoded in a 64 bit integer).
+_MAX_PREFILTER_KMER_LENGTH = 13
+# PSI-BLAST reports the percentage identity to three decimal places, and so an alignment may be reported as reaching the
+# threshold when its identity is up to this much below it.
+_IDENTITY_ROUNDING = 0.0005
+
+def main(fastaFile, minSimilarity=None, minAlignLength=20, kmerLength=_KMER_LENGTH):
+    """Estimate the percentage sequence identity between the proteins in a FASTA file from the k-mers they share.
+
+    This is a fast approximate alternative to performBLAST.main, and returns the similarities in the same form. If two
+    sequences are p% identical, roughly a (p / 100) ** kmerLength fraction of the k-mers of the shorter one will also be
+    found in the longer one, and so the identity of a pair of sequences is estimated as 100 times the kmerLength-th root
+    of the fraction of the distinct k-mers of the shorter sequence that are shared. Only pairs sharing at least one k-mer
+    are considered, and k-mers found in very many sequences are ignored.
+
+    :param fastaFile:       The location of a FASTA format file of the proteins to compare.
+    :type fastaFile:        string
+    :param minSimilarity:   If not None, only the similarities of at least minSimilarity are returned.
+    :type minSimilarity:    float
+    :param minAlignLength:  Sequences shorter than this are not compared (as BLAST alignments shorter than this are ignored).
+    :type minAlignLength:   integer
+    :param kmerLength:      The length of the k-mers to compare.
+    :type kmerLength:       integer
+    :returns :              A record of the similarities between the proteins, indexed by an alphanumerically ordered
+                            tuple of the proteins.
+    :type :                 dictionary
+
+    """
+
+    proteinIDs, sequences = read_fasta(fastaFile)
+    proteinA, proteinB, similarity = estimate_similarities(sequences, minSimilarity, minAlignLength, kmerLength)
+    similarities = {}
+    for i, j, k in zip(proteinA.tolist(), proteinB.tolist(), similarity.tolist()):
+        if proteinIDs[i] != proteinIDs[j]:
+            pair = (proteinIDs[i], proteinIDs[j]) if proteinIDs[i] < proteinIDs[j] else (proteinIDs[j], proteinIDs[i])
+            similarities[pair] = max(round(k, 2), similarities.get(pair, 0.0))
+    return similarities
+
+
+def prefilter(fastaFile, filteredFile, minSimilarity, minAlignLength=20):
+    """Write out the proteins that may be similar to another protein, so that only they need to be used as BLAST queries.
+
+    An alignment of at least minAlignLength columns that is at least minSimilarity percent identical must contain a run
+    of identical columns at least as long as the length given by shared_run_length, and the residues of that run are
+    found in both of the aligned proteins. A protein is therefore kept if it shares a k-mer of that length with some other
+    protein. The other proteins can not be aligned with another protein at the threshold, so they need not be queries.
+    They must still be in the database searched, as PSI-BLAST E-values and profiles depend on the whole database.
+
+    :param fastaFile:       The location of a FASTA format file of the proteins to filter.
+    :type fastaFile:        string
+    :param filteredFile:    The location at which to write a FASTA file of the proteins kept.
+    :type filteredFile:     string
+    :param minSimilarity:   The similarity threshold (if None then all proteins are kept).
+    :type minSimilarity:    float
+    :param minAlignLength:  The minimum permissible length for the BLAST sequence alignments.
+    :type minAlignLength:   integer
+    :returns :              The number of proteins kept and the total number of proteins.
+    :type :                 integer and integer
+
+    """
+
+    proteinIDs, sequences = read_fasta(fastaFile)
+    kmerLength = 0 if minSimilarity is None else min(shared_run_length(minSimilarity, minAlignLength), _MAX_PREFILTER_KMER_LENGTH)
+    if kmerLength < 1:
+        # Any pair of proteins may be similar enough.
+        keep = numpy.ones(len(sequences), dtype=bool)
+    else:
+        keep = sharing_kmers(sequences, kmerLength)
+
+    # Copy the description lines and sequences of the kept proteins.
+    writeOut = open(filteredFile, 'w', encoding='utf-8', newline='\n')
+    readFasta = open(fastaFile, 'r', encoding='utf-8')
+    proteinIndex = -1
+    for line in readFasta:
+        if line[0] == '>':
+            proteinIndex += 1
+        if keep[proteinIndex]:
+            writeOut.write(line if line[-1] == '\n' else line + '\n')
+    readFasta.close()
+    writeOut.close()
+    return int(keep.sum()), len(sequences)
+
+
+def shared_run_length(minSimilarity, minAlignLength=20):
+    """Determine the length of the longest run of identical columns that every sufficiently similar alignment contains.
+
+    An alignment of L columns that is at least minSimilarity percent identical has at least I = minSimilarity * L / 100
+    identical columns, and at most L - I other columns (mismatches and gaps) to split them into runs. Its longest run of
+    identical columns is therefore at least I / (L - I + 1) long. This bound grows with L (once it is at least as long as
+    the run it guarantees for shorter alignments), so the alignments checked stop there.
+
+    :param minSimilarity:   The minimum percentage identity of the alignments.
+    :type minSimilarity:    float
+    :param minAlignLength:  The minimum number of columns in the alignments.
+    :type minAlignLength:   integer
+    :returns :              The length of run that every such alignment contains (0 if an alignment need not contain
+                            any identical columns).
+    :type :                 integer
+
+    """
+
+    identity = max(minSimilarity / 100.0 - _IDENTITY_ROUNDING / 100.0, 0.0)
+    alignLength = max(minAlignLength, 1)
+    if identity >= 1.0:
+        # Every column of the alignment is identical.
+        return alignLength
+    shortestRun = None
+    while True:
+        identical = math.ceil(identity * alignLength - 1e-9)
+        longestRun = math.ceil(identical / (alignLength - identical + 1))
+        if shortestRun is None or longestRun < shortestRun:
+            shortestRun = longestRun
+        # No longer alignment can have a shorter longest run once the lower bound on its longest run reaches the shortest.
+        alignLength += 1
+        if math.ceil(identity * alignLength / ((1.0 - identity) * alignLength + 1) - 1e-9) >= shortestRun:
+            return shortestRun
+
+
+def sharing_kmers(sequences, kmerLength):
+    """Determine which sequences share at least one k-mer with another sequence.
+
+    :param sequences:   The upper case protein sequences.
+    :type sequences:    list
+    :param kmerLength:  The length of the k-mers to compare (at most _MAX_PREFILTER_KMER_LENGTH).
+    :type kmerLength:   integer
+    :returns :          Whether each sequence shares a k-mer with another sequence.
+    :type :             numpy.ndarray
+
+    """
+
+    if numpy is None:
+        raise ImportError('The k-mer prefilter requires NumPy.')
+
+    numSequences = len(sequences)
+    lengths = numpy.array([len(i) for i in sequences], dtype=numpy.int64)
+    sharing = numpy.zeros(numSequences, dtype=bool)
+    kmers, sequenceOf = _encode_kmers(sequences, lengths, kmerLength, kmerLength)
+    if len(kmers) == 0:
+        return sharing
+
+    # Sort the k-mers, and mark the sequences containing a k-mer whose occurrences are not all in the same sequence.
+    order = numpy.argsort(kmers, kind='stable')
+    kmers = kmers[order]
+    sequenceOf = sequenceOf[order]
+    groupStarts = numpy.flatnonzero(numpy.concatenate(([True], kmers[1:] != kmers[:-1])))
+    shared = numpy.minimum.reduceat(sequenceOf, groupStarts) != numpy.maximum.reduceat(sequenceOf, groupStarts)
+    groupSizes = numpy.diff(numpy.concatenate((groupStarts, [len(kmers)])))
+    sharing[sequenceOf[numpy.repeat(shared, groupSizes)]] = True
+    return sharing
+
+
+def read_fasta(fastaFile):
+    """Read the identifiers and sequences of the proteins in a FASTA file.
+
+    :param fastaFile:   The location of a FASTA format file.
+    :type fastaFile:    string
+    :returns :          The identifiers (the characters of the description line up to the first whitespace) and the
+                        upper case sequences of the proteins, in file order.
+    :type :             list and list
+
+    """
+
+    proteinIDs = []
+    sequences = []
+    readFasta = open(fastaFile, 'r', encoding='utf-8')
+    for line in readFasta:
+        if line[0] == '>':
+            chunks = line[1:].split()
+            proteinIDs.append(chunks[0] if chunks else '')
+            sequences.append([])
+        elif sequences:
+            sequences[-1].append(line.strip().upper())
+    readFasta.close()
+    return proteinIDs, [''.join(i) for i in sequences]
+
+
+def estimate_similarities(sequences, minSimilarity=None, minAlignLength=20, kmerLength=_KMER_LENGTH):
+    """Estimate the percentage identity of every pair of sequences that share a k-mer (see main).
+
+    The pairs of sequences sharing each k-mer are generated with NumPy in blocks, and the number of k-mers shared by each
+    pair is then totalled.
+
+    :param sequences:       The upper case protein sequences.
+    :type sequences:        list
+    :param minSimilarity:   If not None, only the pairs with an estimated similarity of at least minSimilarity are returned.
+    :type minSimilarity:    float
+    :param minAlignLength:  Sequences shorter than this are not compared.
+    :type minAlignLength:   integer
+    :param kmerLength:      The length of the k-mers to compare.
+    :type kmerLength:       integer
+    :returns :              The indices of the first and second sequence of each pair (with first < second), and the
+                            estimated similarity of the pair.
+    :type :                 numpy.ndarray, numpy.ndarray and numpy.ndarray
+
+    """
+
+    if numpy is None:
+        raise ImportError('The k-mer similarity engine requires NumPy.')
+
+    numSequences = len(sequences)
+    empty = (numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0))
+    lengths = numpy.array([len(i) for i in sequences], dtype=numpy.int64)
+    if numSequences < 2 or lengths.sum() == 0:
+        return empty
+
+    kmers, sequenceOf = _encode_kmers(sequences, lengths, kmerLength, minAlignLength)
+    if len(kmers) == 0:
+        return empty
+
+    # Determine the distinct k-mers in each sequence, sorted by k-mer and then by sequence.
+    postings = numpy.unique(kmers * numSequences + sequenceOf)
+    postingKmers = postings // numSequences
+    postingSequences = postings % numSequences
+    distinctKmers = numpy.bincount(postingSequences, minlength=numSequences)
+
+    # Find the postings for each k-mer, ignoring the k-mers found in only one sequence or in too many.
+    groupStarts = numpy.flatnonzero(numpy.concatenate(([True], postingKmers[1:] != postingKmers[:-1])))
+    groupSizes = numpy.diff(numpy.concatenate((groupStarts, [len(postings)])))
+    usedGroups = (groupSizes > 1) & (groupSizes <= _MAX_KMER_FREQUENCY)
+    groupStarts = groupStarts[usedGroups]
+    groupSizes = groupSizes[usedGroups]
+
+    # Generate the pairs of sequences sharing each k-mer in blocks of groups, counting the k-mers each pair shares.
+    pairKeys = []
+    pairCounts = []
+    groupPairs = numpy.cumsum(groupSizes * (groupSizes - 1) // 2)
+    blockStart = 0
+    while blockStart < len(groupStarts):
+        pairsBefore = groupPairs[blockStart - 1] if blockStart else 0
+        blockEnd = max(blockStart + 1, int(numpy.searchsorted(groupPairs, pairsBefore + _PAIRS_PER_BLOCK, side='right')))
+        # Pair each posting with every later posting in the same group.
+        sizes = groupSizes[blockStart:blockEnd]
+        postingIndices = numpy.repeat(groupStarts[blockStart:blockEnd], sizes) + \
+                         (numpy.arange(sizes.sum()) - numpy.repeat(numpy.cumsum(sizes) - sizes, sizes))
+        laterPostings = numpy.repeat(groupStarts[blockStart:blockEnd] + sizes, sizes) - postingIndices - 1
+        firsts = numpy.repeat(postingIndices, laterPostings)
+        seconds = firsts + 1 + (numpy.arange(laterPostings.sum()) - numpy.repeat(numpy.cumsum(laterPostings) - laterPostings, laterPostings))
+        keys, counts = numpy.unique(postingSequences[firsts] * numSequences + postingSequences[seconds], return_counts=True)
+        pairKeys.append(keys)
+        pairCounts.append(counts)
+        blockStart = blockEnd
+    if not pairKeys:
+        return empty
+    keys, inverse = numpy.unique(numpy.concatenate(pairKeys), return_inverse=True)
+    sharedKmers = numpy.bincount(inverse, weights=numpy.concatenate(pairCounts))
+
+    # Estimate the identity of each pair from the fraction of the k-mers of the shorter sequence that are shared.
+    proteinA = keys // numSequences
+    proteinB = keys % numSequences
+    fraction = sharedKmers / numpy.minimum(distinctKmers[proteinA], distinctKmers[proteinB])
+    similarity = 100.0 * numpy.minimum(fraction, 1.0) ** (1.0 / kmerLength)
+    if minSimilarity is not None:
+        passing = similarity >= minSimilarity
+        proteinA = proteinA[passing]
+        proteinB = proteinB[passing]
+        similarity = similarity[passing]
+    return proteinA, proteinB, similarity
+
+
+def _encode_kmers(sequences, lengths, kmerLength, minLength):
+    """Encode the k-mers of the sequences as integers.
+
+    :param sequences:   The upper case protein sequences.
+    :type sequences:    list
+    :param lengths:     The length of each sequence.
+    :type lengths:      numpy.ndarray
+    :param kmerLength:  The length of the k-mers.
+    :type kmerLength:   integer
+    :param minLength:   The k-mers of the sequences shorter than this are left out.
+    :type minLength:    integer
+    :returns :          The code of each k-mer, and the index of the sequence it is in.
+    :type :             numpy.ndarray and numpy.ndarray
+
+    """
+
+    # Encode the letters as 0 to 25, and determine the k-mer starting at each position of the concatenated sequences.
+    residues = numpy.frombuffer(''.join(sequences).encode('ascii', 'replace'), dtype=numpy.uint8).astype(numpy.int64) - ord('A')
+    residues = numpy.clip(residues, 0, 25)
+    numKmers = len(residues) - kmerLength + 1
+    if numKmers < 1:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+    kmers = numpy.zeros(numKmers, dtype=numpy.int64)
+    for i in range(kmerLength):
+        kmers = kmers * 26 + residues[i:i + numKmers]
+
+    # Only keep the k-mers that lie entirely within a long enough sequence.
+    sequenceOf = numpy.repeat(numpy.arange(len(sequences), dtype=numpy.int64), lengths)[:numKmers]
+    starts = numpy.cumsum(lengths) - lengths
+    positionInSequence = numpy.arange(numKmers, dtype=numpy.int64) - starts[sequenceOf]
+    valid = (positionInSequence <= lengths[sequenceOf] - kmerLength) & (lengths[sequenceOf] >= max(minLength, kmerLength))
+    return kmers[valid], sequenceOf[valid]
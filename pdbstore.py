@@ -0,0 +1,699 @@
+'''
+A binary store of the processed PDB data, which can be memory mapped rather than parsing the TSV files for each cull.
+'''
+
+import argparse
+import array
+import bisect
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+
+try:
+    import numpy
+except ImportError:
+    # The vectorised selection of the chains and similarities is optional, and is only unavailable when NumPy is not
+    # installed.
+    numpy = None
+
+# The name of the store file in the PDB data directory.
+STORE_NAME = 'PDBStore.bin'
+# The first bytes of a store file, identifying the version of the format.
+_MAGIC = b'LEAFPDB2'
+# The columns are aligned to this many bytes.
+_ALIGNMENT = 8
+# A number written as a plain decimal, which is stored as a float32 (see _float_column).
+_DECIMAL = re.compile(r'^-?[0-9]+(\.([0-9]+))?$')
+# The similarity index records where the similarities of at least each integer percentage from 0 to _MAX_PERCENT end.
+_MAX_PERCENT = 101
+# The bits of the flags column.
+_NON_XRAY = 1
+_ALPHA_CARBON_ONLY = 2
+
+def main(args):
+    """Convert the Chains.tsv and Similarity.tsv files in a PDB data directory into a binary store.
+
+    The store is written to STORE_NAME in the data directory, and PDBcontroller then loads the data from it by memory
+    mapping the file rather than parsing the TSV files. The conversion needs to be rerun whenever the TSV files change
+    (until it is, PDBcontroller uses the TSV files).
+
+    :param args:    The command line arguments.
+    :type args:     list
+
+    """
+
+    parser = argparse.ArgumentParser(description='Convert the processed PDB data into a binary store that PDBcontroller can load without parsing.')
+    parser.add_argument('datalocation', help='The location of the directory that contains the processed PDB data.')
+    args = parser.parse_args(args)
+
+    dataDirectory = args.datalocation
+    if not os.path.isfile(dataDirectory + '/Chains.tsv') or not os.path.isfile(dataDirectory + '/Similarity.tsv'):
+        print('The data directory supplied does not contain the Chains.tsv and Similarity.tsv files.')
+        sys.exit()
+    convert(dataDirectory)
+
+
+def convert(dataDirectory):
+    """Write the binary store of the PDB data in a data directory.
+
+    The store is a header followed by the columns of the two tables. The chains (in the order of Chains.tsv) and the
+    representative groups are interned as integers, with the names kept in newline separated string tables. The chain
+    columns are the representative group (int32), resolution and R value (float32), sequence length (int32) and the
+    non-X-ray and alpha carbon only flags (packed into one byte). The similarity columns are the two representative
+    groups (int32) and the similarity (float32).
+
+    The similarities are stored from most to least similar (with equal similarities kept in the order of
+    Similarity.tsv), and so the similarities at or above any threshold are a prefix of the columns. The percentOffsets
+    column (int64) records the number of similarities of at least each integer percentage, so that the end of the prefix
+    for a threshold can be found with a binary search between the offsets of the integer percentages either side of it.
+
+    :param dataDirectory:   The location of the directory containing the processed PDB data.
+    :type dataDirectory:    string
+
+    """
+
+    header, columns = _read_tables(dataDirectory)
+
+    # Lay out the columns after the header.
+    offset = 0
+    for name, typecode, values, _ in columns:
+        offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+        header['columns'][name]['offset'] = offset
+        offset += len(values) * array.array(typecode).itemsize
+    headerBytes = json.dumps(header, sort_keys=True).encode('utf-8')
+    dataStart = -(-(len(_MAGIC) + 8 + len(headerBytes)) // _ALIGNMENT) * _ALIGNMENT
+
+    # Write the store to a temporary file, and then rename it, so that a partially written store is never loaded.
+    storeFile = dataDirectory + '/' + STORE_NAME
+    writeOut = open(storeFile + '.tmp', 'wb')
+    writeOut.write(_MAGIC + struct.pack('<Q', len(headerBytes)) + headerBytes)
+    for name, typecode, values, _ in columns:
+        writeOut.write(b'\0' * (dataStart + header['columns'][name]['offset'] - writeOut.tell()))
+        if not isinstance(values, array.array):
+            values = array.array(typecode, values)
+        values.tofile(writeOut)
+    writeOut.close()
+    os.replace(storeFile + '.tmp', storeFile)
+
+
+def build(dataDirectory):
+    """Build the store of the PDB data in a data directory in memory, without writing it to a file.
+
+    This is used when many culls are run on data that has not been converted (see PDBbatch), so that the TSV files are
+    only parsed once.
+
+    :param dataDirectory:   The location of the directory containing the processed PDB data.
+    :type dataDirectory:    string
+    :returns :              The store (see load).
+    :type :                 dictionary
+
+    """
+
+    header, columns = _read_tables(dataDirectory)
+    storeColumns = {}
+    for name, typecode, values, _ in columns:
+        if not isinstance(values, (array.array, bytes)):
+            values = array.array(typecode, values)
+        storeColumns[name] = memoryview(values)
+    return _make_store(header, storeColumns)
+
+
+def load(dataDirectory):
+    """Load the binary store of the PDB data in a data directory.
+
+    The store file is memory mapped, and each column is viewed in place without any parsing. The store is not used if it
+    is missing, was written on a machine with a different byte order, or is stale (i.e. Chains.tsv or Similarity.tsv
+    has changed since the store was written).
+
+    :param dataDirectory:   The location of the directory containing the processed PDB data.
+    :type dataDirectory:    string
+    :returns :              The store (None if it can not be used), with the chain names, the representative group
+                            names, the columns (as memoryviews) and the header describing the columns.
+    :type :                 dictionary
+
+    """
+
+    storeFile = dataDirectory + '/' + STORE_NAME
+    if not os.path.isfile(storeFile):
+        return None
+    readStore = open(storeFile, 'rb')
+    try:
+        storeMap = mmap.mmap(readStore.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        readStore.close()
+    if storeMap[:len(_MAGIC)] != _MAGIC:
+        return None
+    headerLength = struct.unpack('<Q', storeMap[len(_MAGIC):len(_MAGIC) + 8])[0]
+    header = json.loads(storeMap[len(_MAGIC) + 8:len(_MAGIC) + 8 + headerLength].decode('utf-8'))
+    if header['byteorder'] != sys.byteorder:
+        return None
+    for source, signature in header['sources'].items():
+        if os.path.exists(dataDirectory + '/' + source) and _source_signature(dataDirectory + '/' + source) != signature:
+            return None
+
+    dataStart = -(-(len(_MAGIC) + 8 + headerLength) // _ALIGNMENT) * _ALIGNMENT
+    storeView = memoryview(storeMap)
+    columns = {}
+    for name, column in header['columns'].items():
+        start = dataStart + column['offset']
+        columns[name] = storeView[start:start + column['length'] * array.array(column['typecode']).itemsize].cast(column['typecode'])
+    return _make_store(header, columns)
+
+
+def chains_of_interest(store, minResolution, maxResolution, maxRValue, minLength, maxLength, skipNonXray, skipAlphaCarbon):
+    """Determine the chains in the store that meet the quality criteria (see PDBcontroller).
+
+    :param store:           The store of the PDB data (see load).
+    :type store:            dictionary
+    :param minResolution:   The minimum resolution a chain can have.
+    :type minResolution:    float
+    :param maxResolution:   The maximum resolution a chain can have.
+    :type maxResolution:    float
+    :param maxRValue:       The maximum R value a chain can have.
+    :type maxRValue:        float
+    :param minLength:       The minimum sequence length a chain can have (-1 if there is no minimum).
+    :type minLength:        integer
+    :param maxLength:       The maximum sequence length a chain can have (-1 if there is no maximum).
+    :type maxLength:        integer
+    :param skipNonXray:     Whether to exclude the non-X-ray chains.
+    :type skipNonXray:      boolean
+    :param skipAlphaCarbon: Whether to exclude the alpha carbon only chains.
+    :type skipAlphaCarbon:  boolean
+    :returns :              The representative group of each chain meeting the criteria, indexed by the chain.
+    :type :                 dictionary
+
+    """
+
+    columns = store['columns']
+    groupNames = store['groupNames']
+    minResolution = threshold(store, 'resolution', minResolution, True)
+    maxResolution = threshold(store, 'resolution', maxResolution, False)
+    maxRValue = threshold(store, 'rValue', maxRValue, False)
+    excludedFlags = (_NON_XRAY if skipNonXray else 0) | (_ALPHA_CARBON_ONLY if skipAlphaCarbon else 0)
+    chainsOfInterest = {}
+    for chain, group, resolution, rValue, sequenceLength, flags in zip(store['chainNames'], columns['chainGroup'],
+                                                                       columns['resolution'], columns['rValue'],
+                                                                       columns['length'], columns['flags']):
+        invalid = ((flags & excludedFlags) or
+                   (resolution < minResolution) or
+                   (resolution > maxResolution) or
+                   (rValue > maxRValue) or
+                   (minLength != -1 and sequenceLength < minLength) or
+                   (maxLength != -1 and sequenceLength > maxLength)
+                   )
+        if not invalid:
+            chainsOfInterest[chain] = groupNames[group]
+    return chainsOfInterest
+
+
+def similarities(store, representativeGroupings, minSimilarity):
+    """Determine the similarities in the store between representative chains that are at or above a threshold.
+
+    :param store:                   The store of the PDB data (see load).
+    :type store:                    dictionary
+    :param representativeGroupings: The representative chain of each representative group being culled.
+    :type representativeGroupings:  dictionary
+    :param minSimilarity:           The lowest similarity to record.
+    :type minSimilarity:            float
+    :returns :                      The (similarity, chainA, chainB) tuples, from most to least similar (with equal
+                                    similarities in the order of Similarity.tsv).
+    :type :                         list
+
+    """
+
+    columns = store['columns']
+    values = columns['similarity']
+    decimals = store['header']['columns']['similarity']['decimals']
+    low = _similarity_prefix(store, minSimilarity)
+
+    # Keep the similarities between the representative chains. The representative chain of every group is only looked up
+    # in advance when there are more similarities to check than groups, so that the time taken scales with the number of
+    # similarities at or above the threshold.
+    groupNames = store['groupNames']
+    if low > len(groupNames):
+        representative = [representativeGroupings.get(i) for i in groupNames].__getitem__
+    else:
+        representative = lambda x: representativeGroupings.get(groupNames[x])
+    similarities = []
+    for groupA, groupB, similarity in zip(columns['groupA'][:low], columns['groupB'][:low], values[:low]):
+        chainA = representative(groupA)
+        chainB = representative(groupB)
+        if chainA is not None and chainB is not None:
+            # Recover the exact value of the similarity from Similarity.tsv.
+            similarities.append((similarity if decimals is None else round(similarity, decimals), chainA, chainB))
+    return similarities
+
+
+def vectorised(store):
+    """Determine whether the chains and similarities in a store can be selected with NumPy.
+
+    The vectorised selection (see select_representatives) needs NumPy, and relies on every chain in the store having a
+    different name (as in the processed PDB data). Otherwise chains_of_interest and similarities are used.
+
+    :param store:   The store of the PDB data (see load).
+    :type store:    dictionary
+    :returns :      Whether the vectorised selection can be used.
+    :type :         boolean
+
+    """
+
+    return numpy is not None and store['header'].get('uniqueChainNames', False)
+
+
+def select_representatives(store, minResolution, maxResolution, maxRValue, minLength, maxLength, skipNonXray, skipAlphaCarbon,
+                           userChains=None):
+    """Determine the representative chains to cull, using boolean masks over the chain columns of the store.
+
+    This gives the same result as using chains_of_interest and then choosing the representative of each group in
+    PDBcontroller. The chains meeting the criteria are taken in the order of Chains.tsv (or of userChains when a subset
+    is culled), the groups are ordered by their first chain and the representative of a group is its last chain.
+
+    :param store:           The store of the PDB data (see load), for which vectorised(store) is True.
+    :type store:            dictionary
+    :param minResolution:   The minimum resolution a chain can have.
+    :type minResolution:    float
+    :param maxResolution:   The maximum resolution a chain can have.
+    :type maxResolution:    float
+    :param maxRValue:       The maximum R value a chain can have.
+    :type maxRValue:        float
+    :param minLength:       The minimum sequence length a chain can have (-1 if there is no minimum).
+    :type minLength:        integer
+    :param maxLength:       The maximum sequence length a chain can have (-1 if there is no maximum).
+    :type maxLength:        integer
+    :param skipNonXray:     Whether to exclude the non-X-ray chains.
+    :type skipNonXray:      boolean
+    :param skipAlphaCarbon: Whether to exclude the alpha carbon only chains.
+    :type skipAlphaCarbon:  boolean
+    :param userChains:      If not None, the chains that the user wants culled (only these chains are considered).
+    :type userChains:       list
+    :returns :              The number of chains meeting the criteria, the representative chain of each representative
+                            group, and the index of the representative chain of each group in the store (-1 for the
+                            groups without one).
+    :type :                 integer, dictionary and numpy.ndarray
+
+    """
+
+    columns = store['columns']
+    resolution = numpy.asarray(columns['resolution'])
+    rValue = numpy.asarray(columns['rValue'])
+    sequenceLength = numpy.asarray(columns['length'])
+    excludedFlags = (_NON_XRAY if skipNonXray else 0) | (_ALPHA_CARBON_ONLY if skipAlphaCarbon else 0)
+
+    # The comparisons are written in the same way as in chains_of_interest, so that values that are not numbers are
+    # treated in the same way.
+    invalid = (numpy.asarray(columns['flags']) & excludedFlags) != 0
+    invalid |= resolution < threshold(store, 'resolution', minResolution, True)
+    invalid |= resolution > threshold(store, 'resolution', maxResolution, False)
+    invalid |= rValue > threshold(store, 'rValue', maxRValue, False)
+    if minLength != -1:
+        invalid |= sequenceLength < minLength
+    if maxLength != -1:
+        invalid |= sequenceLength > maxLength
+
+    if userChains is None:
+        validChains = numpy.flatnonzero(~invalid)
+    else:
+        # Take the valid chains in the order that the user gave them, ignoring any repeats. The index of each chain name
+        # is kept in the store, so that it is only built once when the store is used for many culls.
+        if 'chainIndices' not in store:
+            store['chainIndices'] = dict((j, i) for i, j in enumerate(store['chainNames']))
+        chainIndices = store['chainIndices']
+        userIndices = numpy.array([chainIndices.get(i, -1) for i in userChains], dtype=numpy.int64)
+        userIndices = userIndices[userIndices != -1]
+        userIndices = userIndices[~invalid[userIndices]]
+        _, firstPositions = numpy.unique(userIndices, return_index=True)
+        validChains = userIndices[numpy.sort(firstPositions)]
+
+    # Order the groups by their first chain, and make the last chain in each group its representative.
+    validGroups = numpy.asarray(columns['chainGroup'])[validChains]
+    groups, firstPositions = numpy.unique(validGroups, return_index=True)
+    groupOrder = groups[numpy.argsort(firstPositions)]
+    groups, lastPositions = numpy.unique(validGroups[::-1], return_index=True)
+    representativeOfGroup = numpy.full(store['header']['numGroups'], -1, dtype=numpy.int64)
+    representativeOfGroup[groups] = validChains[len(validChains) - 1 - lastPositions]
+
+    chainNames = store['chainNames']
+    groupNames = store['groupNames']
+    representativeGroupings = dict((groupNames[i], chainNames[j]) for i, j in zip(groupOrder.tolist(), representativeOfGroup[groupOrder].tolist()))
+    return len(validChains), representativeGroupings, representativeOfGroup
+
+
+def representative_similarities(store, representativeOfGroup, minSimilarity):
+    """Determine the similarities in the store between representative chains that are at or above a threshold, using
+    array operations over the similarity columns of the store.
+
+    :param store:                   The store of the PDB data (see load), for which vectorised(store) is True.
+    :type store:                    dictionary
+    :param representativeOfGroup:   The index of the representative chain of each group (see select_representatives).
+    :type representativeOfGroup:    numpy.ndarray
+    :param minSimilarity:           The lowest similarity to record.
+    :type minSimilarity:            float
+    :returns :                      The negated (stored) similarity values, from most to least similar, and the indices
+                                    of the two chains with each similarity.
+    :type :                         numpy.ndarray, numpy.ndarray and numpy.ndarray
+
+    """
+
+    columns = store['columns']
+    low = _similarity_prefix(store, minSimilarity)
+    chainsA = representativeOfGroup[numpy.asarray(columns['groupA'][:low])]
+    chainsB = representativeOfGroup[numpy.asarray(columns['groupB'][:low])]
+    representative = (chainsA != -1) & (chainsB != -1)
+    return -numpy.asarray(columns['similarity'][:low])[representative], chainsA[representative], chainsB[representative]
+
+
+def count_similarities(store, similarities, minSimilarity):
+    """Count the similarities from representative_similarities that are at or above a threshold.
+
+    :param store:           The store of the PDB data (see load).
+    :type store:            dictionary
+    :param similarities:    The similarities returned by representative_similarities.
+    :type similarities:     tuple
+    :param minSimilarity:   The threshold.
+    :type minSimilarity:    float
+    :returns :              The number of similarities at or above the threshold (which are a prefix of the similarities).
+    :type :                 integer
+
+    """
+
+    return int(numpy.searchsorted(similarities[0], -threshold(store, 'similarity', minSimilarity, True), side='right'))
+
+
+def similarity_csr(store, similarities, numSimilarities):
+    """Build the compressed sparse row form of the graph of the first numSimilarities similarities.
+
+    The graph is the same as the one that Leafcull.build_csr creates from the adjacency list of the similarities, with
+    the chains numbered in sorted order and the neighbours of each chain sorted, and so can be culled directly with
+    Leafcull.cull_csr.
+
+    :param store:           The store of the PDB data (see load).
+    :type store:            dictionary
+    :param similarities:    The similarities returned by representative_similarities.
+    :type similarities:     tuple
+    :param numSimilarities: The number of similarities to include (see count_similarities).
+    :type numSimilarities:  integer
+    :returns :              The offsets (numpy.ndarray), neighbours (numpy.ndarray) and chain names (list) of the graph.
+    :type :                 tuple
+
+    """
+
+    chainsA = similarities[1][:numSimilarities]
+    chainsB = similarities[2][:numSimilarities]
+
+    # Number the chains in the graph in the order of their names.
+    chains = numpy.unique(numpy.concatenate((chainsA, chainsB)))
+    chainNames = store['chainNames']
+    names = [chainNames[i] for i in chains.tolist()]
+    order = sorted(range(len(names)), key=names.__getitem__)
+    nodeIDs = [names[i] for i in order]
+    nodeOf = numpy.empty(len(chains), dtype=numpy.int64)
+    nodeOf[order] = numpy.arange(len(chains), dtype=numpy.int64)
+    nodesA = nodeOf[numpy.searchsorted(chains, chainsA)]
+    nodesB = nodeOf[numpy.searchsorted(chains, chainsB)]
+
+    # Record each edge in both directions, without self loops or repeats, sorted by node and then neighbour.
+    sources = numpy.concatenate((nodesA, nodesB))
+    targets = numpy.concatenate((nodesB, nodesA))
+    edges = numpy.unique(sources[sources != targets] * len(chains) + targets[sources != targets])
+    offsets = numpy.searchsorted(edges // max(len(chains), 1), numpy.arange(len(chains) + 1, dtype=numpy.int64))
+    return offsets.astype(numpy.int64), edges % max(len(chains), 1), nodeIDs
+
+
+def similarity_tuples(store, similarities, numSimilarities):
+    """Convert the first numSimilarities similarities into the (similarity, chainA, chainB) tuples of similarities.
+
+    The similarity values are the stored values, which are only used to order the tuples.
+
+    :param store:           The store of the PDB data (see load).
+    :type store:            dictionary
+    :param similarities:    The similarities returned by representative_similarities.
+    :type similarities:     tuple
+    :param numSimilarities: The number of similarities to convert.
+    :type numSimilarities:  integer
+    :returns :              The (similarity, chainA, chainB) tuples, from most to least similar.
+    :type :                 list
+
+    """
+
+    chainNames = store['chainNames']
+    negatedValues, chainsA, chainsB = (i[:numSimilarities].tolist() for i in similarities)
+    return [(-i, chainNames[j], chainNames[k]) for i, j, k in zip(negatedValues, chainsA, chainsB)]
+
+
+def threshold(store, column, value, atLeast):
+    """Convert a threshold on the values of a float column into one for the values as stored.
+
+    A column written in Similarity.tsv or Chains.tsv as decimals with at most d decimal places is stored as float32
+    values (see _float_column). As the rounding to float32 preserves the order of the values and does not make any two of
+    them equal, comparing the stored values with the float32 value of the nearest number with d decimal places that is
+    on the correct side of the threshold gives the same result as comparing the original values with the threshold.
+
+    :param store:   The store of the PDB data (see load).
+    :type store:    dictionary
+    :param column:  The name of the column.
+    :type column:   string
+    :param value:   The threshold on the original values.
+    :type value:    float
+    :param atLeast: Whether the values must be at least the threshold (True) or at most the threshold (False).
+    :type atLeast:  boolean
+    :returns :      The threshold on the stored values.
+    :type :         float
+
+    """
+
+    header = store['header']['columns'][column]
+    decimals = header['decimals']
+    if decimals is None:
+        # The column is stored as float64, and so holds the original values.
+        return value
+    lowest, highest = header['range']
+    if atLeast and value <= lowest:
+        return -math.inf
+    elif atLeast and value > highest:
+        return math.inf
+    elif not atLeast and value < lowest:
+        return -math.inf
+    elif not atLeast and value >= highest:
+        return math.inf
+
+    # Find the nearest number with the given number of decimal places on the correct side of the threshold.
+    scaled = math.floor(value * 10 ** decimals)
+    candidates = [float('{0}e-{1}'.format(i, decimals)) for i in range(scaled - 1, scaled + 3)]
+    if atLeast:
+        return _to_float32(min(i for i in candidates if i >= value))
+    return _to_float32(max(i for i in candidates if i <= value))
+
+
+def _make_store(header, columns):
+    """Assemble a store from its header and columns, decoding the string tables of names.
+
+    :param header:  The header of the store.
+    :type header:   dictionary
+    :param columns: The columns of the store (as memoryviews), indexed by their names.
+    :type columns:  dictionary
+    :returns :      The store (see load).
+    :type :         dictionary
+
+    """
+
+    chainNames = bytes(columns['chainNames']).decode('utf-8').split('\n') if header['numChains'] else []
+    groupNames = bytes(columns['groupNames']).decode('utf-8').split('\n') if header['numGroups'] else []
+    return {'chainNames' : chainNames, 'groupNames' : groupNames, 'columns' : columns, 'header' : header}
+
+
+def _read_tables(dataDirectory):
+    """Read Chains.tsv and Similarity.tsv into the columns of a store (see convert).
+
+    :param dataDirectory:   The location of the directory containing the processed PDB data.
+    :type dataDirectory:    string
+    :returns :              The header of the store (without the offsets of the columns), and the name, typecode, values
+                            and number of decimal places of each column.
+    :type :                 dictionary and list
+
+    """
+
+    chainData = dataDirectory + '/Chains.tsv'
+    similarityData = dataDirectory + '/Similarity.tsv'
+    groupIndices = {}  # The interned integer for each representative group.
+
+    def intern(group):
+        if group not in groupIndices:
+            groupIndices[group] = len(groupIndices)
+        return groupIndices[group]
+
+    # Read the chains, in the same way as PDBcontroller.
+    chains = []
+    groups = array.array('i')
+    resolutions = []
+    rValues = []
+    lengths = array.array('i')
+    flags = array.array('B')
+    readChainData = open(chainData, 'r')
+    readChainData.readline()  # Strip the header.
+    for line in readChainData:
+        chunks = (line.strip()).split('\t')
+        chains.append(chunks[0])
+        resolutions.append(chunks[1])
+        rValues.append(chunks[2])
+        lengths.append(int(chunks[3]))
+        flags.append((_NON_XRAY if chunks[4] == 'yes' else 0) | (_ALPHA_CARBON_ONLY if chunks[5] == 'yes' else 0))
+        groups.append(intern(chunks[6]))
+    readChainData.close()
+
+    # Read the similarities.
+    groupsA = array.array('i')
+    groupsB = array.array('i')
+    similarityValues = []
+    readSimilarities = open(similarityData, 'r')
+    readSimilarities.readline()  # Strip the header.
+    for line in readSimilarities:
+        chunks = (line.strip()).split('\t')
+        groupsA.append(intern(chunks[0]))
+        groupsB.append(intern(chunks[1]))
+        similarityValues.append(chunks[2])
+    readSimilarities.close()
+
+    # Sort the similarities from most to least similar, keeping equal similarities in file order (any similarity that is
+    # not a number is placed at the end, as it is never at or above a threshold).
+    similarityColumn = _float_column(similarityValues)
+    similarityValues = similarityColumn[1]
+    order = sorted(range(len(similarityValues)), key=lambda x: -similarityValues[x] if similarityValues[x] == similarityValues[x] else math.inf)
+    groupsA = array.array('i', [groupsA[i] for i in order])
+    groupsB = array.array('i', [groupsB[i] for i in order])
+    similarityValues = [similarityValues[i] for i in order]
+    numOrdered = len([i for i in similarityValues if i == i])
+    negatedValues = [-i for i in similarityValues[:numOrdered]]
+    percentOffsets = array.array('q', [bisect.bisect_right(negatedValues, -i) for i in range(_MAX_PERCENT + 1)])
+
+    groupNames = sorted(groupIndices, key=lambda x: groupIndices[x])
+    columns = [('chainNames', 'B', _string_table(chains), None),
+               ('groupNames', 'B', _string_table(groupNames), None),
+               ('chainGroup', 'i', groups, None),
+               ('resolution',) + _float_column(resolutions),
+               ('rValue',) + _float_column(rValues),
+               ('length', 'i', lengths, None),
+               ('flags', 'B', flags, None),
+               ('groupA', 'i', groupsA, None),
+               ('groupB', 'i', groupsB, None),
+               ('similarity', similarityColumn[0], similarityValues, similarityColumn[2]),
+               ('percentOffsets', 'q', percentOffsets, None)
+               ]
+
+    header = {'byteorder' : sys.byteorder, 'numChains' : len(chains), 'numGroups' : len(groupNames), 'numSimilarities' : len(groupsA),
+              'numOrderedSimilarities' : numOrdered, 'uniqueChainNames' : len(set(chains)) == len(chains),
+              'sources' : dict((i, _source_signature(dataDirectory + '/' + i)) for i in ['Chains.tsv', 'Similarity.tsv']),
+              'columns' : {}}
+    for name, typecode, values, decimals in columns:
+        header['columns'][name] = {'typecode' : typecode, 'length' : len(values), 'decimals' : decimals}
+        if decimals is not None:
+            header['columns'][name]['range'] = [min(values), max(values)] if values else [0.0, 0.0]
+    return header, columns
+
+
+def _float_column(values):
+    """Choose how to store a column of floats written as text.
+
+    If every value is a plain decimal, and float32 has enough precision to tell apart any two numbers in the range of the
+    column with the largest number of decimal places used, then the column is stored as float32. Otherwise the column
+    is stored as float64.
+
+    :param values:  The values of the column, as written in the TSV file.
+    :type values:   list
+    :returns :      The typecode of the column, the values and the number of decimal places (None for float64).
+    :type :         string, list and integer
+
+    """
+
+    decimals = 0
+    for i in values:
+        match = _DECIMAL.match(i)
+        if match is None:
+            return 'd', [float(i) for i in values], None
+        if match.group(2) is not None:
+            decimals = max(decimals, len(match.group(2)))
+    floats = [float(i) for i in values]
+    largest = max([abs(i) for i in floats] + [1.0])
+    if math.ldexp(1.0, math.frexp(largest)[1] - 24) >= 10 ** -decimals:
+        # The gap between consecutive float32 values is too large.
+        return 'd', floats, None
+    return 'f', floats, decimals
+
+
+def _to_float32(value):
+    """Round a float to the nearest float32.
+
+    :param value:   The float to round.
+    :type value:    float
+    :returns :      The nearest float32.
+    :type :         float
+
+    """
+
+    return struct.unpack('f', struct.pack('f', value))[0]
+
+
+def _similarity_prefix(store, minSimilarity):
+    """Find the number of similarities in the store that are at or above a threshold.
+
+    The similarities at or above the threshold are a prefix of the similarity columns, and the end of the prefix is found
+    with a binary search between the offsets of the integer percentages either side of the threshold.
+
+    :param store:           The store of the PDB data (see load).
+    :type store:            dictionary
+    :param minSimilarity:   The threshold.
+    :type minSimilarity:    float
+    :returns :              The length of the prefix.
+    :type :                 integer
+
+    """
+
+    columns = store['columns']
+    values = columns['similarity']
+    storedThreshold = threshold(store, 'similarity', minSimilarity, True)
+    low = 0
+    high = store['header']['numOrderedSimilarities']
+    if 0 <= minSimilarity <= _MAX_PERCENT:
+        low = columns['percentOffsets'][min(_MAX_PERCENT, math.ceil(minSimilarity))]
+        high = columns['percentOffsets'][math.floor(minSimilarity)]
+    while low < high:
+        middle = (low + high) // 2
+        if values[middle] >= storedThreshold:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _source_signature(fileLocation):
+    """Get the size and modification time of a file, which change when the file is changed.
+
+    :param fileLocation:    The location of the file.
+    :type fileLocation:     string
+    :returns :              The size and modification time (in nanoseconds) of the file.
+    :type :                 list
+
+    """
+
+    fileStats = os.stat(fileLocation)
+    return [fileStats.st_size, fileStats.st_mtime_ns]
+
+
+def _string_table(strings):
+    """Encode strings as a newline separated string table.
+
+    :param strings: The strings to encode.
+    :type strings:  list
+    :returns :      The encoded strings.
+    :type :         bytes
+
+    """
+
+    return '\n'.join(strings).encode('utf-8')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
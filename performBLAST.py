@@ -4,14 +4,43 @@ Created on 7 Feb 2011
 @author: Simon Bull
 '''
 
+import concurrent.futures
+import functools
+import glob
+import hashlib
+import heapq
+import itertools
+import json
 import os
+import shelve
 import subprocess
 import shutil
 import time
 
+try:
+    import fcntl
+except ImportError:
+    # File locking is only available on Unix-like systems. Elsewhere a BLAST cache directory must not be shared by runs
+    # that happen at the same time.
+    fcntl = None
+
+import kmersimilarity
 import processPSIoutput
 
-def main(inputFile, blastOperationID, cores=2, minAlignLength=20, maxEValue=1.0, verboseOutput=False):
+# The number of shards to split the proteins into for each PSI-BLAST process when BLASTing shards concurrently.
+_SHARDS_PER_PROCESS = 4
+# The version of the format of the BLAST cache. Changing it (or the PSI-BLAST options in sequence_BLAST) invalidates all
+# cached results.
+_CACHE_VERSION = 1
+# The default maximum total size in bytes of the BLAST databases kept in a database cache.
+_MAX_DATABASE_CACHE_BYTES = 10 * (1 << 30)
+# A cached BLAST database is not evicted if it was used within this many seconds, as another run may still be BLASTing
+# against it.
+_DATABASE_EVICTION_GRACE_SECONDS = 24 * 60 * 60
+
+def main(inputFile, blastOperationID, cores=2, minAlignLength=20, maxEValue=1.0, minSimilarity=None, parseProcesses=1,
+         blastProcesses=1, cacheDir=None, pipeOutput=False, keepOutput=False, databaseCacheDir=None,
+         databaseCacheSize=_MAX_DATABASE_CACHE_BYTES, prefilter=False, executableDir=None, verboseOutput=False):
     """Perform the BLASTing of the proteins in an input file (inputFile) against those in another file (databaseFile).
 
     Returns a dictionary of the similarities between proteins, as determined by BLAST. The dictionary is indexed by a
@@ -30,6 +59,39 @@ def main(inputFile, blastOperationID, cores=2, minAlignLength=20, maxEValue=1.0,
     :type minAlignLength:       integer
     :param maxEValue:           The maximum permissible value which the BLAST EValue can take.
     :type maxEValue:            float
+    :param minSimilarity:       If not None, only the similarities of at least minSimilarity are returned. The similarities
+                                below minSimilarity are discarded as the BLAST output is parsed, rather than being stored.
+    :type minSimilarity:        float
+    :param parseProcesses:      The number of processes to use to parse the BLAST output. When greater than 1 large
+                                outputs are split into chunks that are parsed in parallel.
+    :type parseProcesses:       integer
+    :param blastProcesses:      The number of PSI-BLAST processes to run at once. When greater than 1 the input proteins
+                                are split into shards that are BLASTed concurrently, and the cores are divided between
+                                the processes.
+    :type blastProcesses:       integer
+    :param cacheDir:            If not None, the directory of a cache of BLAST results. Only the proteins not covered by
+                                the cache are BLASTed, and the cache is updated with the new results (see cached_BLAST).
+    :type cacheDir:             string
+    :param pipeOutput:          Whether PSI-BLAST should write its output to a pipe that is parsed while PSI-BLAST runs,
+                                rather than to a file that is parsed once PSI-BLAST has finished.
+    :type pipeOutput:           boolean
+    :param keepOutput:          Whether to keep the directory of BLAST files (including the PSI-BLAST output, even when
+                                it is piped) for debugging, rather than deleting it.
+    :type keepOutput:           boolean
+    :param databaseCacheDir:    If not None, the directory of a cache of BLAST databases, which is used to reuse the
+                                database built from the same FASTA file contents in an earlier run (see make_database).
+    :type databaseCacheDir:     string
+    :param databaseCacheSize:   The maximum total size in bytes of the databases kept in the database cache.
+    :type databaseCacheSize:    integer
+    :param prefilter:           Whether to only use as queries the proteins that share a long enough run of residues with
+                                another protein to possibly be at least minSimilarity similar to it (see
+                                kmersimilarity.prefilter). The database is still made from every protein, so the
+                                E-values and profiles of the queries are those of a search of the whole input. Not used
+                                with cacheDir, as the cache must record the hits of every protein. Requires NumPy.
+    :type prefilter:            boolean
+    :param executableDir:       The directory containing the makeblastdb and psiblast executables to use. If None, the
+                                BLASTExecutables directory alongside this file is used.
+    :type executableDir:        string
     :param verboseOutput:       Whether status updates of the BLASTing should be printed out to the user.
     :type verboseOutput:        boolean
     :returns :                  A record of the similarities between the proteins
@@ -38,44 +100,523 @@ def main(inputFile, blastOperationID, cores=2, minAlignLength=20, maxEValue=1.0,
     """
 
     # Get the location of the BLAST executables.
-    srcLocation = os.path.dirname(os.path.realpath(__file__))
-    BLASTExecutables = os.path.join(srcLocation, 'BLASTExecutables')
+    if executableDir is None:
+        srcLocation = os.path.dirname(os.path.realpath(__file__))
+        BLASTExecutables = os.path.join(srcLocation, 'BLASTExecutables')
+    else:
+        BLASTExecutables = executableDir
     cwd = os.getcwd()
     outputLocation = blastOperationID
     if os.path.exists(outputLocation):
         shutil.rmtree(outputLocation)
     os.mkdir(outputLocation)
 
-    # Generate BLAST database.
-    databaseDir = outputLocation + '/TempDatabase'
-    os.mkdir(databaseDir)
-    makeDBArgs = [BLASTExecutables + '/makeblastdb', '-in', inputFile, '-out', databaseDir + '/TempDB', '-dbtype', 'prot']
-    subprocess.call(makeDBArgs, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    # Only use the proteins that may be similar enough to another protein as queries. The database is still made from all
+    # the proteins, as PSI-BLAST E-values and profiles depend on the whole database.
+    queryFile = inputFile
+    prefilter = prefilter and cacheDir is None
+    if prefilter:
+        queryFile = outputLocation + '/Prefiltered.fasta'
+        numKept, numProteins = kmersimilarity.prefilter(inputFile, queryFile, minSimilarity, minAlignLength)
+        if verboseOutput:
+            print('The k-mer prefilter kept {0} of {1} proteins as queries.'.format(numKept, numProteins))
 
-    # Perform BLAST.
-    if verboseOutput:
-        print('Now BLASTing.')
-    resultsBLAST = outputLocation + '/ResultsBLAST.txt'
-    sequence_BLAST(resultsBLAST, inputFile, databaseDir + '/TempDB', BLASTExecutables + '/psiblast', cores)
+    if prefilter and numKept < 2:
+        # There are no pairs of proteins left to BLAST.
+        similarities = {}
+    elif cacheDir is not None:
+        # Only BLAST the proteins that the cached results do not cover.
+        similarities = cached_BLAST(outputLocation, inputFile, cacheDir, BLASTExecutables, cores, minAlignLength, maxEValue,
+                                    minSimilarity, blastProcesses, pipeOutput, keepOutput, databaseCacheDir, databaseCacheSize,
+                                    verboseOutput)
+    else:
+        # Generate BLAST database.
+        database = make_database(inputFile, outputLocation + '/TempDatabase', BLASTExecutables, databaseCacheDir, databaseCacheSize)
 
-    # Determine the similarities between proteins.
-    if verboseOutput:
-        print('Now determining similarities.')
-    similarities = processPSIoutput.main(resultsBLAST, minAlignLength, maxEValue)
+        # Perform BLAST, and determine the similarities found in each PSI-BLAST output as it completes.
+        if verboseOutput:
+            print('Now BLASTing and determining similarities.')
+        similarities = {}
+        parse = None
+        if pipeOutput:
+            parse = functools.partial(processPSIoutput.parse_lines, minAlignLength=minAlignLength, maxEValue=maxEValue,
+                                      minSimilarity=minSimilarity)
+        for output in BLAST_queries(outputLocation, queryFile, database, BLASTExecutables + '/psiblast', cores,
+                                    blastProcesses, parse, keepOutput, verboseOutput):
+            if pipeOutput:
+                outputSimilarities = output
+            else:
+                outputSimilarities = parse_output(output, minAlignLength, maxEValue, minSimilarity, parseProcesses)
+            if not similarities:
+                similarities = outputSimilarities
+                continue
+            for pair in outputSimilarities:
+                if not (pair in similarities and similarities[pair] >= outputSimilarities[pair]):
+                    similarities[pair] = outputSimilarities[pair]
 
     # Remove the temporary directory used for manipulating and processing the BLAST output.
+    if not keepOutput:
+        try:
+            shutil.rmtree(outputLocation)
+        except:
+            time.sleep(60)
+            shutil.rmtree(outputLocation)
+
+    return similarities
+
+
+def parse_output(resultsBLAST, minAlignLength, maxEValue, minSimilarity, parseProcesses):
+    """Determine the similarities between proteins from a file of PSI-BLAST output.
+
+    :param resultsBLAST:    The location of the PSI-BLAST output.
+    :type resultsBLAST:     string
+    :param minAlignLength:  The minimum permissible length for the BLAST sequence alignments.
+    :type minAlignLength:   integer
+    :param maxEValue:       The maximum permissible value which the BLAST EValue can take.
+    :type maxEValue:        float
+    :param minSimilarity:   If not None, only the similarities of at least minSimilarity are returned.
+    :type minSimilarity:    float
+    :param parseProcesses:  The number of processes to use to parse the output.
+    :type parseProcesses:   integer
+    :returns :              A record of the similarities between the proteins
+    :type :                 dictionary
+
+    """
+
+    if parseProcesses > 1:
+        return processPSIoutput.parallel_main(resultsBLAST, minAlignLength, maxEValue, minSimilarity, parseProcesses)
+    else:
+        return processPSIoutput.main(resultsBLAST, minAlignLength, maxEValue, minSimilarity)
+
+
+def make_database(fastaFile, databaseDir, BLASTExecutables, databaseCacheDir=None, maxCacheSize=_MAX_DATABASE_CACHE_BYTES):
+    """Make a BLAST protein database from a FASTA file, or reuse a cached database made from identical FASTA contents.
+
+    Without a cache the database is made in databaseDir. With a cache, each database is kept in a subdirectory of
+    databaseCacheDir named after the SHA-1 hash of the contents of the FASTA file it was made from. A database is made in
+    a temporary directory and only renamed into the cache once makeblastdb has succeeded, so that a partially made or
+    failed database is never used or cached. When the databases in the
+    cache take up more than maxCacheSize bytes, the least recently used ones are deleted. A database used in the last
+    _DATABASE_EVICTION_GRACE_SECONDS seconds (including the one being used now) is never deleted, as another run may
+    still be BLASTing against it, and so the cache can exceed maxCacheSize while many databases are in use.
+
+    :param fastaFile:           The FASTA file of the proteins to put in the database.
+    :type fastaFile:            string
+    :param databaseDir:         The directory to make the database in when there is no cache.
+    :type databaseDir:          string
+    :param BLASTExecutables:    The directory containing the BLAST executables.
+    :type BLASTExecutables:     string
+    :param databaseCacheDir:    The directory containing the cached databases (not used if None).
+    :type databaseCacheDir:     string
+    :param maxCacheSize:        The maximum total size in bytes of the cached databases.
+    :type maxCacheSize:         integer
+    :returns :                  The location of the database (to be passed to the -db option of PSI-BLAST).
+    :type :                     string
+
+    """
+
+    if databaseCacheDir is None:
+        os.mkdir(databaseDir)
+        _run_makeblastdb(fastaFile, databaseDir + '/TempDB', BLASTExecutables)
+        return databaseDir + '/TempDB'
+
+    # Determine the hash of the FASTA file contents.
+    contentHash = hashlib.sha1()
+    readIn = open(fastaFile, 'rb')
+    for block in iter(functools.partial(readIn.read, 1 << 20), b''):
+        contentHash.update(block)
+    readIn.close()
+    contentHash = contentHash.hexdigest()
+
+    if not os.path.isdir(databaseCacheDir):
+        os.makedirs(databaseCacheDir)
+    cachedDir = os.path.join(databaseCacheDir, contentHash)
+    if os.path.isdir(cachedDir):
+        # Record that the database has been used, so that it is not the next to be evicted.
+        os.utime(cachedDir, None)
+    else:
+        buildDir = os.path.join(databaseCacheDir, 'Building-{0}-{1}'.format(contentHash, os.getpid()))
+        if os.path.exists(buildDir):
+            shutil.rmtree(buildDir)
+        os.mkdir(buildDir)
+        try:
+            _run_makeblastdb(fastaFile, buildDir + '/DB', BLASTExecutables)
+        except:
+            # Never cache a failed (or interrupted) build.
+            shutil.rmtree(buildDir, ignore_errors=True)
+            raise
+        try:
+            os.rename(buildDir, cachedDir)
+        except OSError:
+            # Another run has cached the same database in the meantime.
+            shutil.rmtree(buildDir)
+
+    # Evict the least recently used databases until the cache is small enough, skipping the recently used ones.
+    evictBefore = time.time() - _DATABASE_EVICTION_GRACE_SECONDS
+    cachedDatabases = []
+    totalSize = 0
+    for i in os.listdir(databaseCacheDir):
+        location = os.path.join(databaseCacheDir, i)
+        if i.startswith('Building-') or not os.path.isdir(location):
+            continue
+        size = sum(os.path.getsize(os.path.join(location, j)) for j in os.listdir(location))
+        cachedDatabases.append((os.path.getmtime(location), location, size))
+        totalSize += size
+    cachedDatabases.sort()
+    for lastUsed, location, size in cachedDatabases:
+        if totalSize <= maxCacheSize or lastUsed >= evictBefore:
+            break
+        if location != cachedDir:
+            shutil.rmtree(location, ignore_errors=True)
+            totalSize -= size
+
+    return cachedDir + '/DB'
+
+
+def _run_makeblastdb(fastaFile, database, BLASTExecutables):
+    """Make a BLAST protein database with makeblastdb, checking that it was made.
+
+    :param fastaFile:           The FASTA file of the proteins to put in the database.
+    :type fastaFile:            string
+    :param database:            The location of the database to make.
+    :type database:             string
+    :param BLASTExecutables:    The directory containing the BLAST executables.
+    :type BLASTExecutables:     string
+
+    """
+
+    makeDBArgs = [BLASTExecutables + '/makeblastdb', '-in', fastaFile, '-out', database, '-dbtype', 'prot']
+    processDB = subprocess.run(makeDBArgs, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if processDB.returncode != 0 or not glob.glob(database + '.p*'):
+        message = 'The BLAST database could not be made from {0} (makeblastdb exited with status {1}).'.format(fastaFile, processDB.returncode)
+        output = processDB.stdout.decode('utf-8', 'replace').strip()
+        raise RuntimeError(message + (' The output of makeblastdb was: ' + output if output else ''))
+
+
+def BLAST_queries(outputLocation, queryFile, database, BLASTLoc, cores, blastProcesses=1, parse=None, keepOutput=False,
+                  verboseOutput=False):
+    """BLAST the proteins in queryFile against a database, either in one PSI-BLAST process or in concurrent shards.
+
+    :param outputLocation:  The directory to write the PSI-BLAST output in.
+    :type outputLocation:   string
+    :param queryFile:       The FASTA file of the proteins to BLAST.
+    :type queryFile:        string
+    :param database:        The database to BLAST the proteins against.
+    :type database:         string
+    :param BLASTLoc:        The location of the PSI-BLAST executable.
+    :type BLASTLoc:         string
+    :param cores:           The number of threads to run BLAST with.
+    :type cores:            integer
+    :param blastProcesses:  The number of PSI-BLAST processes to run at once (see shard_BLAST).
+    :type blastProcesses:   integer
+    :param parse:           If not None, the PSI-BLAST output is piped to this function as it is produced (see
+                            sequence_BLAST), rather than being written to a file.
+    :type parse:            function
+    :param keepOutput:      Whether to also write piped PSI-BLAST output to a file.
+    :type keepOutput:       boolean
+    :param verboseOutput:   Whether the time taken to BLAST each shard should be printed out to the user.
+    :type verboseOutput:    boolean
+    :returns :              The locations of the PSI-BLAST output files (or the results of parse), in the order that
+                            they are completed.
+    :type :                 generator
+
+    """
+
+    if blastProcesses > 1:
+        for output, numProteins, numResidues, timeTaken in shard_BLAST(outputLocation, queryFile, database, BLASTLoc, cores,
+                                                                        blastProcesses, parse, keepOutput):
+            if verboseOutput:
+                print('BLASTed a shard of {0} proteins ({1} residues) in {2:.1f} seconds.'.format(numProteins, numResidues, timeTaken))
+            yield output
+    else:
+        resultsBLAST = outputLocation + '/ResultsBLAST.txt'
+        if parse is None:
+            sequence_BLAST(resultsBLAST, queryFile, database, BLASTLoc, cores)
+            yield resultsBLAST
+        else:
+            yield sequence_BLAST(resultsBLAST if keepOutput else None, queryFile, database, BLASTLoc, cores, parse)
+
+
+def cached_BLAST(outputLocation, inputFile, cacheDir, BLASTExecutables, cores, minAlignLength, maxEValue, minSimilarity=None,
+                 blastProcesses=1, pipeOutput=False, keepOutput=False, databaseCacheDir=None,
+                 databaseCacheSize=_MAX_DATABASE_CACHE_BYTES, verboseOutput=False):
+    """Determine the similarities between the proteins in inputFile, reusing the BLAST results cached by previous runs.
+
+    The cache records the hits found for each query protein, keyed by a hash of the query sequence and the BLAST
+    parameters, with the hits identified by the hashes of their sequences. It also records the sequences used in the last
+    run with the same parameters, all pairs of which have been BLASTed in both directions. Only the sequences that were not
+    in the last run (the new sequences) are BLASTed against all the sequences, and the sequences from the last run are
+    BLASTed against only the new sequences. Proteins with identical sequences are BLASTed once, and are treated as being
+    100% similar (provided they are at least minAlignLength long).
+
+    The cache directory can be shared by runs that happen at the same time. A run holds an exclusive lock on the cache
+    (the file BLASTCache.lock in cacheDir) only while it reads the last run and while it records its hits, and not while
+    it BLASTs, so runs sharing the cache BLAST at the same time. The hits a run records are merged with those already
+    cached. File locking needs the fcntl module, and so on systems without it a cache directory must not be shared by
+    runs that happen at the same time.
+
+    As PSI-BLAST E-values and profiles depend on the database searched, the similarities found using the cache can differ
+    slightly from those found by BLASTing all the proteins at once. Use an empty cache directory to get exactly the
+    results of an uncached run.
+
+    :param outputLocation:      The directory to write the temporary BLAST files in.
+    :type outputLocation:       string
+    :param inputFile:           The location of a FASTA format file of the proteins to BLAST against each other.
+    :type inputFile:            string
+    :param cacheDir:            The directory containing the cache (created if it does not exist).
+    :type cacheDir:             string
+    :param BLASTExecutables:    The directory containing the BLAST executables.
+    :type BLASTExecutables:     string
+    :param cores:               The number of CPU cores on which BLAST will be run.
+    :type cores:                integer
+    :param minAlignLength:      The minimum permissible length for the BLAST sequence alignments.
+    :type minAlignLength:       integer
+    :param maxEValue:           The maximum permissible value which the BLAST EValue can take.
+    :type maxEValue:            float
+    :param minSimilarity:       If not None, only the similarities of at least minSimilarity are returned.
+    :type minSimilarity:        float
+    :param blastProcesses:      The number of PSI-BLAST processes to run at once (see shard_BLAST).
+    :type blastProcesses:       integer
+    :param pipeOutput:          Whether PSI-BLAST output should be parsed from a pipe while PSI-BLAST runs.
+    :type pipeOutput:           boolean
+    :param keepOutput:          Whether to also write piped PSI-BLAST output to files.
+    :type keepOutput:           boolean
+    :param databaseCacheDir:    If not None, the directory of a cache of BLAST databases (see make_database).
+    :type databaseCacheDir:     string
+    :param databaseCacheSize:   The maximum total size in bytes of the databases kept in the database cache.
+    :type databaseCacheSize:    integer
+    :param verboseOutput:       Whether status updates of the BLASTing should be printed out to the user.
+    :type verboseOutput:        boolean
+    :returns :                  A record of the similarities between the proteins
+    :type :                     dictionary
+
+    """
+
+    # Determine the hash of each protein's sequence. Sequences are uppercased and stripped of whitespace first.
+    proteinHashes = {}  # The IDs of the proteins with each sequence hash.
+    sequences = {}  # The sequence with each hash.
+    readFasta = open(inputFile, 'r', encoding='utf-8')
+    proteinID = None
+    sequence = []
+    for line in itertools.chain(readFasta, ['>']):
+        if line[0] == '>':
+            if proteinID is not None:
+                sequence = ''.join(sequence).upper()
+                sequenceHash = hashlib.sha1(sequence.encode('utf-8')).hexdigest()
+                proteinHashes.setdefault(sequenceHash, []).append(proteinID)
+                sequences[sequenceHash] = sequence
+            chunks = line[1:].split()
+            proteinID = chunks[0] if chunks else None
+            sequence = []
+        else:
+            sequence.append(''.join(line.split()))
+    readFasta.close()
+
+    # Determine which sequences have been BLASTed against each other before.
+    if not os.path.isdir(cacheDir):
+        os.makedirs(cacheDir)
+    parameterKey = hashlib.sha1(json.dumps([_CACHE_VERSION, minAlignLength, maxEValue]).encode('utf-8')).hexdigest()[:16]
+    lastRunFile = os.path.join(cacheDir, 'LastRun-' + parameterKey + '.txt')
+    cacheLocation = os.path.join(cacheDir, 'BLASTCache')
+    lockLocation = os.path.join(cacheDir, 'BLASTCache.lock')
+    cacheLock = _lock_file(lockLocation)
     try:
-        shutil.rmtree(outputLocation)
-    except:
-        time.sleep(60)
-        shutil.rmtree(outputLocation)
+        lastRun = set()
+        if os.path.isfile(lastRunFile):
+            readIn = open(lastRunFile, 'r', encoding='utf-8')
+            lastRun = set(readIn.read().split())
+            readIn.close()
+        cache = shelve.open(cacheLocation)
+        cachedSequences = set(i for i in sequences if i in lastRun and (parameterKey + i) in cache)
+        cache.close()
+    finally:
+        cacheLock.close()  # Closing the lock file releases the lock.
+    oldSequences = [i for i in sequences if i in cachedSequences]
+    newSequences = [i for i in sequences if i not in cachedSequences]
+    if verboseOutput:
+        print('{0} of {1} unique sequences were found in the BLAST cache.'.format(len(oldSequences), len(sequences)))
+
+    def write_fasta(fileName, hashes):
+        # Write a FASTA file of the sequences, using their hashes as their IDs.
+        writeOut = open(fileName, 'w', encoding='utf-8', newline='\n')
+        for i in hashes:
+            writeOut.write('>' + i + '\n' + sequences[i] + '\n')
+        writeOut.close()
+
+    def collect_hits(BLASTOutput):
+        # Record the hits found for each query in lines of PSI-BLAST output.
+        outputHits = {}
+        for query, hit, similarity in processPSIoutput.stream_lines(BLASTOutput, minAlignLength, maxEValue):
+            queryHits = outputHits.setdefault(query, {})
+            queryHits[hit] = max(similarity, queryHits.get(hit, similarity))
+        return outputHits
+
+    def BLAST_against(direction, queries, databaseHashes):
+        # BLAST the query sequences against a database of the databaseHashes sequences, and return the hits found for
+        # each query.
+        directionLocation = outputLocation + '/' + direction
+        os.mkdir(directionLocation)
+        write_fasta(directionLocation + '/Queries.fasta', queries)
+        write_fasta(directionLocation + '/Database.fasta', databaseHashes)
+        database = make_database(directionLocation + '/Database.fasta', directionLocation + '/TempDatabase', BLASTExecutables,
+                                 databaseCacheDir, databaseCacheSize)
+        hitsFound = dict((i, {}) for i in queries)
+        for output in BLAST_queries(directionLocation, directionLocation + '/Queries.fasta', database,
+                                    BLASTExecutables + '/psiblast', cores, blastProcesses, collect_hits if pipeOutput else None,
+                                    keepOutput, verboseOutput):
+            if not pipeOutput:
+                readIn = open(output, 'r')
+                output = collect_hits(readIn)
+                readIn.close()
+            for query in output:
+                if query in hitsFound:
+                    for hit, similarity in output[query].items():
+                        hitsFound[query][hit] = max(similarity, hitsFound[query].get(hit, similarity))
+        return hitsFound
+
+    # BLAST the new sequences against all the sequences, and then the old sequences against the new ones. The cache is
+    # not locked while BLASTing, so that runs sharing the cache can BLAST at the same time.
+    newHits = {}
+    if newSequences:
+        if verboseOutput:
+            print('Now BLASTing {0} new sequences.'.format(len(newSequences)))
+        newHits.update(BLAST_against('New', newSequences, list(sequences)))
+        if oldSequences:
+            newHits.update(BLAST_against('Old', oldSequences, newSequences))
+
+    # Record the new hits, and read the hits of every sequence in this run. The new hits are merged with any cached hits,
+    # as another run sharing the cache may have recorded hits for the same sequences while this run was BLASTing.
+    runHits = {}
+    cacheLock = _lock_file(lockLocation)
+    try:
+        cache = shelve.open(cacheLocation)
+        for query in sequences:
+            cachedHits = cache.get(parameterKey + query, {})
+            if query in newHits:
+                for hit, similarity in newHits[query].items():
+                    cachedHits[hit] = max(similarity, cachedHits.get(hit, similarity))
+                cache[parameterKey + query] = cachedHits
+            runHits[query] = cachedHits
+        cache.close()
+
+        # All pairs of the sequences in this run have now been BLASTed in both directions.
+        writeOut = open(lastRunFile, 'w', encoding='utf-8', newline='\n')
+        writeOut.write('\n'.join(sequences))
+        writeOut.close()
+    finally:
+        cacheLock.close()
+
+    # Determine the similarities between the proteins from the cached hits.
+    similarities = {}
+
+    def record(proteinA, proteinB, similarity):
+        if minSimilarity is not None and similarity < minSimilarity:
+            return
+        pair = (proteinA, proteinB) if proteinA < proteinB else (proteinB, proteinA)
+        if not (pair in similarities and similarities[pair] >= similarity):
+            similarities[pair] = similarity
+
+    for query in sequences:
+        proteinIDs = proteinHashes[query]
+        for i in range(len(proteinIDs) if len(sequences[query]) >= minAlignLength else 0):
+            for j in range(i + 1, len(proteinIDs)):
+                if proteinIDs[i] != proteinIDs[j]:
+                    record(proteinIDs[i], proteinIDs[j], 100.0)
+        cachedHits = runHits[query]
+        for hit in cachedHits:
+            if hit != query and hit in sequences:
+                for proteinA in proteinIDs:
+                    for proteinB in proteinHashes[hit]:
+                        record(proteinA, proteinB, cachedHits[hit])
 
     return similarities
 
 
-def sequence_BLAST(resultsBLAST, inputFile, database, BLASTLoc, cores):
+def shard_BLAST(outputLocation, inputFile, database, BLASTLoc, cores, blastProcesses, parse=None, keepOutput=False):
+    """Split the proteins in inputFile into shards, and BLAST the shards concurrently.
+
+    The proteins are split into several shards per process, with the total number of residues in each shard balanced by
+    assigning the longest proteins first, each to the shard with the fewest residues. The shards with the most residues
+    are BLASTed first, and a new shard is started as soon as any PSI-BLAST process finishes, so that a shard containing
+    slow queries does not hold up the others.
+
+    :param outputLocation:  The directory to write the shards and their PSI-BLAST output in.
+    :type outputLocation:   string
+    :param inputFile:       The FASTA file of the proteins to BLAST.
+    :type inputFile:        string
+    :param database:        The database to BLAST the proteins against.
+    :type database:         string
+    :param BLASTLoc:        The location of the PSI-BLAST executable.
+    :type BLASTLoc:         string
+    :param cores:           The total number of threads to run BLAST with, divided between the processes.
+    :type cores:            integer
+    :param blastProcesses:  The number of PSI-BLAST processes to run at once.
+    :type blastProcesses:   integer
+    :param parse:           If not None, the PSI-BLAST output of each shard is piped to this function as it is produced
+                            (see sequence_BLAST). The function is called from a separate thread for each shard.
+    :type parse:            function
+    :param keepOutput:      Whether to also write piped PSI-BLAST output to a file.
+    :type keepOutput:       boolean
+    :returns :              The location of the PSI-BLAST output for each shard (or the result of parse), the number of
+                            proteins and residues in the shard and the time taken to BLAST it, in the order that the
+                            shards finish.
+    :type :                 generator of (string, integer, integer, float) tuples
+
+    """
+
+    # Read the proteins (the description line and the sequence lines of each).
+    proteins = []
+    readFasta = open(inputFile, 'r', encoding='utf-8')
+    for line in readFasta:
+        if line[0] == '>':
+            proteins.append([line, []])
+        elif proteins:
+            proteins[-1][1].append(line if line[-1] == '\n' else line + '\n')
+    readFasta.close()
+
+    # Assign the longest proteins first, each to the shard with the fewest residues.
+    numShards = max(1, min(len(proteins), blastProcesses * _SHARDS_PER_PROCESS))
+    shardHeap = [(0, i) for i in range(numShards)]
+    shards = [[] for _ in range(numShards)]
+    for length, description, sequence in sorted(((sum(len(j.strip()) for j in i[1]), i[0], i[1]) for i in proteins),
+                                                key=lambda x: x[0], reverse=True):
+        numResidues, shard = heapq.heappop(shardHeap)
+        shards[shard].append(description)
+        shards[shard].extend(sequence)
+        heapq.heappush(shardHeap, (numResidues + length, shard))
+    shardSizes = dict((shard, numResidues) for numResidues, shard in shardHeap)
+
+    def BLAST_shard(shard):
+        shardFile = outputLocation + '/Shard' + str(shard) + '.fasta'
+        writeOut = open(shardFile, 'w', encoding='utf-8', newline='\n')
+        writeOut.write(''.join(shards[shard]))
+        writeOut.close()
+        resultsBLAST = outputLocation + '/ResultsBLAST' + str(shard) + '.txt'
+        startTime = time.time()
+        if parse is None:
+            output = resultsBLAST
+            sequence_BLAST(resultsBLAST, shardFile, database, BLASTLoc, max(1, cores // blastProcesses))
+        else:
+            output = sequence_BLAST(resultsBLAST if keepOutput else None, shardFile, database, BLASTLoc, max(1, cores // blastProcesses),
+                                    parse)
+        numProteins = len([i for i in shards[shard] if i[0] == '>'])
+        return output, numProteins, shardSizes[shard], time.time() - startTime
+
+    # BLAST the shards, starting with the ones with the most residues.
+    order = sorted((i for i in range(numShards) if shards[i]), key=lambda x: shardSizes[x], reverse=True)
+    with concurrent.futures.ThreadPoolExecutor(blastProcesses) as executor:
+        futures = [executor.submit(BLAST_shard, i) for i in order]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+
+def sequence_BLAST(resultsBLAST, inputFile, database, BLASTLoc, cores, parse=None):
     """Will perform the process of BLAST -> PROCESS OUTPUT on inputFile.
 
+    If parse is given, PSI-BLAST writes its output to a pipe, and the lines of output are passed to parse as they are
+    produced, so that the parsing overlaps the BLASTing. The output is then only written to resultsBLAST if resultsBLAST
+    is not None.
+
     :param resultsBLAST:    The location at which to write the output of the processing of the BLAST output.
     :type resultsBLAST:     string
     :param inputFile:       The FASTA file which needs to be submitted to PSI-BLAST.
@@ -86,6 +627,10 @@ def sequence_BLAST(resultsBLAST, inputFile, database, BLASTLoc, cores):
     :type BLASTLoc:         string
     :param cores:           The number of threads to create to run BLAST with.
     :type cores:            character
+    :param parse:           A function that takes an iterable of lines of PSI-BLAST output (not used if None).
+    :type parse:            function
+    :returns :              The result of parse (None if parse is None).
+    :type :                 any
 
     """
 
@@ -94,8 +639,9 @@ def sequence_BLAST(resultsBLAST, inputFile, database, BLASTLoc, cores):
     argsPSI.append(BLASTLoc)
     argsPSI.append('-query')
     argsPSI.append(inputFile)
-    argsPSI.append('-out')
-    argsPSI.append(resultsBLAST)
+    if parse is None:
+        argsPSI.append('-out')
+        argsPSI.append(resultsBLAST)
     argsPSI.append('-evalue')
     argsPSI.append('1')
     argsPSI.append('-num_iterations')
@@ -116,4 +662,59 @@ def sequence_BLAST(resultsBLAST, inputFile, database, BLASTLoc, cores):
     argsPSI.append(str(cores))
 
     # Perform the BLASTing.
-    subprocess.call(argsPSI, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if parse is None:
+        subprocess.call(argsPSI, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        return None
+
+    # Parse the output as it is written to the pipe.
+    processPSI = subprocess.Popen(argsPSI, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    writeOut = None
+    try:
+        BLASTOutput = processPSI.stdout
+        if resultsBLAST is not None:
+            # Keep a copy of the output for debugging.
+            writeOut = open(resultsBLAST, 'w')
+            BLASTOutput = _copy_lines(BLASTOutput, writeOut)
+        parsed = parse(BLASTOutput)
+        for _ in BLASTOutput:
+            # Read any output that parse did not consume, so that PSI-BLAST can finish writing.
+            pass
+    finally:
+        if writeOut is not None:
+            writeOut.close()
+        processPSI.stdout.close()
+        processPSI.wait()
+    return parsed
+
+
+def _lock_file(lockLocation):
+    """Open a lock file and take an exclusive lock on it, waiting for any other process holding the lock to release it.
+
+    :param lockLocation:    The location of the lock file (created if it does not exist).
+    :type lockLocation:     string
+    :returns :              The open lock file. The lock is released when the file is closed.
+    :type :                 file
+
+    """
+
+    lockFile = open(lockLocation, 'a')
+    if fcntl is not None:
+        fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+    return lockFile
+
+
+def _copy_lines(lines, writeOut):
+    """Generate lines, writing each one to a file as it is generated.
+
+    :param lines:       The lines to generate.
+    :type lines:        iterable of strings
+    :param writeOut:    The open file to write the lines to.
+    :type writeOut:     file
+    :returns :          The lines.
+    :type :             generator of strings
+
+    """
+
+    for line in lines:
+        writeOut.write(line)
+        yield line
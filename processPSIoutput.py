@@ -4,25 +4,119 @@ Created on 3 Feb 2011
 @author: Simon Bull
 '''
 
-def main(PSIoutput, minAlignLength, maxEValue):
+import concurrent.futures
+import mmap
+import os
+
+# The output is only split into chunks for parsing in parallel if each chunk would contain at least this many bytes.
+_MIN_CHUNK_BYTES = 1 << 24
+# The number of chunks to create per process, so that uneven chunks do not leave processes idle.
+_CHUNKS_PER_PROCESS = 4
+# The number of bytes of a chunk that are copied out of the memory mapped file at a time.
+_BLOCK_BYTES = 1 << 22
+
+def main(PSIoutput, minAlignLength, maxEValue, minSimilarity=None):
     """Extracts the relevant information from the PSI-BLAST output.
 
+    The similarity recorded for a pair of proteins is the greatest of the similarities found when each one was used as
+    the query.
+
     :param PSIoutput:       The location of the file containing the PSI-BLAST results.
     :type PSIoutput:        string
     :param minAlignLength:  The minimum permissible length for the BLAST sequence alignments.
     :type minAlignLength:   integer
     :param maxEValue:       The maximum permissible value which the BLAST EValue can take.
     :type maxEValue:        float
+    :param minSimilarity:   If not None, only the pairs of proteins with a similarity of at least minSimilarity are recorded.
+    :type minSimilarity:    float
+    :returns :              A record of the similarities between pairs of proteins.
+    :type :                 dictionary
+
+    """
+
+    BLASTOutput = open(PSIoutput, 'r')
+    similaritiesFound = parse_lines(BLASTOutput, minAlignLength, maxEValue, minSimilarity)
+    BLASTOutput.close()
+
+    return similaritiesFound
+
+
+def parse_lines(BLASTOutput, minAlignLength, maxEValue, minSimilarity=None):
+    """Extracts the relevant information from lines of PSI-BLAST output, such as an open file or the output of a pipe.
+
+    The lines are consumed as they are produced, so the PSI-BLAST output can be parsed while PSI-BLAST is running.
+
+    :param BLASTOutput:     The lines of PSI-BLAST output.
+    :type BLASTOutput:      iterable of strings
+    :param minAlignLength:  The minimum permissible length for the BLAST sequence alignments.
+    :type minAlignLength:   integer
+    :param maxEValue:       The maximum permissible value which the BLAST EValue can take.
+    :type maxEValue:        float
+    :param minSimilarity:   If not None, only the pairs of proteins with a similarity of at least minSimilarity are recorded.
+    :type minSimilarity:    float
     :returns :              A record of the similarities between pairs of proteins.
     :type :                 dictionary
 
     """
 
-    currentQuery = ''
-    hitsFound = {}
     similaritiesFound = {}
+    for query, hit, similarity in stream_lines(BLASTOutput, minAlignLength, maxEValue, minSimilarity):
+        pair = (query, hit) if query < hit else (hit, query)
+        if not (pair in similaritiesFound and similaritiesFound[pair] >= similarity):
+            # If the pair exists and the recorded similarity is less than the newly found one or the pair does not exist,
+            # then record the new value for the similarity.
+            similaritiesFound[pair] = similarity
+
+    return similaritiesFound
+
+
+def stream(PSIoutput, minAlignLength, maxEValue, minSimilarity=None):
+    """Generate the similarities in the PSI-BLAST output one query at a time.
+
+    The hits for a query are generated once all the output for the query has been read, and only the hits from the final
+    PSI-BLAST round for the query are used. A pair of proteins may be generated twice (once with each protein as the
+    query), possibly with different similarities, and self-similarities are not generated.
+
+    :param PSIoutput:       The location of the file containing the PSI-BLAST results.
+    :type PSIoutput:        string
+    :param minAlignLength:  The minimum permissible length for the BLAST sequence alignments.
+    :type minAlignLength:   integer
+    :param maxEValue:       The maximum permissible value which the BLAST EValue can take.
+    :type maxEValue:        float
+    :param minSimilarity:   If not None, only the hits with a similarity of at least minSimilarity are generated.
+    :type minSimilarity:    float
+    :returns :              The query protein, the hit protein and the percentage similarity between them.
+    :type :                 generator of (string, string, float) tuples
+
+    """
 
     BLASTOutput = open(PSIoutput, 'r')
+    try:
+        for similarity in stream_lines(BLASTOutput, minAlignLength, maxEValue, minSimilarity):
+            yield similarity
+    finally:
+        BLASTOutput.close()
+
+
+def stream_lines(BLASTOutput, minAlignLength, maxEValue, minSimilarity=None):
+    """Generate the similarities in lines of PSI-BLAST output one query at a time (see stream).
+
+    :param BLASTOutput:     The lines of PSI-BLAST output.
+    :type BLASTOutput:      iterable of strings
+    :param minAlignLength:  The minimum permissible length for the BLAST sequence alignments.
+    :type minAlignLength:   integer
+    :param maxEValue:       The maximum permissible value which the BLAST EValue can take.
+    :type maxEValue:        float
+    :param minSimilarity:   If not None, only the hits with a similarity of at least minSimilarity are generated.
+    :type minSimilarity:    float
+    :returns :              The query protein, the hit protein and the percentage similarity between them.
+    :type :                 generator of (string, string, float) tuples
+
+    """
+
+    currentQuery = ''
+    hitsFound = {}
+
     for line in BLASTOutput:
         chunks = line.split()
         if len(chunks) == 0:
@@ -32,15 +126,10 @@ def main(PSIoutput, minAlignLength, maxEValue):
             # The end of a round has been reached.
             nextQuery = chunks[2]
             if currentQuery != nextQuery:
-                # A new query has been found. Write out the hits from the last query.
+                # A new query has been found. Generate the hits from the last query.
                 for hit in hitsFound:
                     if hit != currentQuery:
-                        # Only record the similarity if the query and hit are not the same
-                        pair = tuple(sorted([currentQuery, hit]))
-                        if not (pair in similaritiesFound and similaritiesFound[pair] >= hitsFound[hit]):
-                            # If the pair exists and the recorded similarity is less than the newly found one or the pair does not exist,
-                            # then record the new value for the similarity.
-                            similaritiesFound[pair] = hitsFound[hit]
+                        yield currentQuery, hit, hitsFound[hit]
             currentQuery = nextQuery
             hitsFound = {}
         elif chunks[0] == currentQuery:
@@ -50,7 +139,174 @@ def main(PSIoutput, minAlignLength, maxEValue):
             evalue = float(chunks[4])
             if alignLength >= minAlignLength and evalue <= maxEValue:
                 # Only record the hit if the alignment length is long enough and the evalue is large enough.
-                hitsFound[hit] = float(chunks[2])
+                similarity = float(chunks[2])
+                if minSimilarity is None or similarity >= minSimilarity:
+                    hitsFound[hit] = similarity
+                elif hit in hitsFound:
+                    # A later alignment of the same hit replaces any earlier one.
+                    del hitsFound[hit]
+
+    # Generate the hits from the final query.
+    for hit in hitsFound:
+        if hit != currentQuery:
+            yield currentQuery, hit, hitsFound[hit]
+
+
+def parallel_main(PSIoutput, minAlignLength, maxEValue, minSimilarity=None, processes=None):
+    """Extracts the relevant information from the PSI-BLAST output, parsing parts of the output in parallel.
+
+    The output file is memory mapped and split into chunks at the start of the output for a new query (never between
+    two PSI-BLAST rounds of the same query). Each chunk is parsed as bytes in a pool of processes, and the greatest
+    similarity found for each pair of proteins in each chunk is then merged. The result is the same as that of main.
+
+    :param PSIoutput:       The location of the file containing the PSI-BLAST results.
+    :type PSIoutput:        string
+    :param minAlignLength:  The minimum permissible length for the BLAST sequence alignments.
+    :type minAlignLength:   integer
+    :param maxEValue:       The maximum permissible value which the BLAST EValue can take.
+    :type maxEValue:        float
+    :param minSimilarity:   If not None, only the pairs of proteins with a similarity of at least minSimilarity are recorded.
+    :type minSimilarity:    float
+    :param processes:       The number of processes to use (defaults to the number of CPUs).
+    :type processes:        integer
+    :returns :              A record of the similarities between pairs of proteins.
+    :type :                 dictionary
+
+    """
+
+    processes = processes or os.cpu_count()
+    fileSize = os.path.getsize(PSIoutput)
+    numChunks = min(processes * _CHUNKS_PER_PROCESS, fileSize // _MIN_CHUNK_BYTES)
+    if processes < 2 or numChunks < 2:
+        # The output is too small to be worth splitting.
+        return main(PSIoutput, minAlignLength, maxEValue, minSimilarity)
+
+    readIn = open(PSIoutput, 'rb')
+    BLASTOutput = mmap.mmap(readIn.fileno(), 0, access=mmap.ACCESS_READ)
+    boundaries = [0]
+    for i in range(1, numChunks):
+        boundary = _next_query_start(BLASTOutput, max(boundaries[-1], fileSize * i // numChunks))
+        if boundary > boundaries[-1]:
+            boundaries.append(boundary)
+    boundaries = [i for i in boundaries if i < fileSize] + [fileSize]
+    BLASTOutput.close()
+    readIn.close()
+
+    similaritiesFound = {}
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        futures = [executor.submit(_parse_chunk, PSIoutput, boundaries[i], boundaries[i + 1], minAlignLength, maxEValue, minSimilarity)
+                   for i in range(len(boundaries) - 1)]
+        for future in futures:
+            for pair, similarity in future.result().items():
+                if not (pair in similaritiesFound and similaritiesFound[pair] >= similarity):
+                    similaritiesFound[pair] = similarity
+
+    return similaritiesFound
+
+
+def _next_query_start(BLASTOutput, position):
+    """Find the start of the first line at or after position that begins the output for a new query.
+
+    A line begins the output for a new query if it is a '# Query:' line for a different query to the '# Query:' line
+    before it. Both lines are searched for from position onwards, so that no line before position needs to be examined.
+
+    :param BLASTOutput:     The memory mapped PSI-BLAST results.
+    :type BLASTOutput:      mmap.mmap
+    :param position:        The offset in the results to search from.
+    :type position:         integer
+    :returns :              The offset of the start of the line (or the length of the results if there is no such line).
+    :type :                 integer
+
+    """
+
+    previousQuery = None
+    while True:
+        position = BLASTOutput.find(b'Query:', position)
+        if position == -1:
+            return len(BLASTOutput)
+        lineStart = BLASTOutput.rfind(b'\n', 0, position) + 1
+        lineEnd = BLASTOutput.find(b'\n', position)
+        if lineEnd == -1:
+            lineEnd = len(BLASTOutput)
+        chunks = BLASTOutput[lineStart:lineEnd].split()
+        if len(chunks) > 2 and chunks[0] == b'#' and chunks[1] == b'Query:':
+            if previousQuery is not None and chunks[2] != previousQuery:
+                return lineStart
+            previousQuery = chunks[2]
+        position = lineEnd
+
+
+def _parse_chunk(PSIoutput, start, end, minAlignLength, maxEValue, minSimilarity):
+    """Extract the greatest similarity between each pair of proteins from a chunk of the PSI-BLAST output.
+
+    The chunk is parsed as bytes in the same way that stream parses the whole output.
+
+    :param PSIoutput:       The location of the file containing the PSI-BLAST results.
+    :type PSIoutput:        string
+    :param start:           The offset of the start of the chunk (the start of a line beginning the output for a query).
+    :type start:            integer
+    :param end:             The offset of the end of the chunk.
+    :type end:              integer
+    :param minAlignLength:  The minimum permissible length for the BLAST sequence alignments.
+    :type minAlignLength:   integer
+    :param maxEValue:       The maximum permissible value which the BLAST EValue can take.
+    :type maxEValue:        float
+    :param minSimilarity:   If not None, only the pairs of proteins with a similarity of at least minSimilarity are recorded.
+    :type minSimilarity:    float
+    :returns :              A record of the similarities between pairs of proteins in the chunk.
+    :type :                 dictionary
+
+    """
+
+    similaritiesFound = {}
+
+    def record_hits(query, hitsFound):
+        for hit in hitsFound:
+            if hit != query:
+                pair = (query.decode(), hit.decode()) if query < hit else (hit.decode(), query.decode())
+                if not (pair in similaritiesFound and similaritiesFound[pair] >= hitsFound[hit]):
+                    similaritiesFound[pair] = hitsFound[hit]
+
+    currentQuery = b''
+    hitsFound = {}
+    readIn = open(PSIoutput, 'rb')
+    BLASTOutput = mmap.mmap(readIn.fileno(), 0, access=mmap.ACCESS_READ)
+    blockStart = start
+    while blockStart < end:
+        # Split the chunk into blocks of whole lines, so that the whole chunk is never copied out of the file at once.
+        blockEnd = min(end, blockStart + _BLOCK_BYTES)
+        if blockEnd < end:
+            lineEnd = BLASTOutput.rfind(b'\n', blockStart, blockEnd)
+            if lineEnd == -1:
+                lineEnd = BLASTOutput.find(b'\n', blockEnd, end)
+            blockEnd = end if lineEnd == -1 else lineEnd + 1
+        for line in BLASTOutput[blockStart:blockEnd].split(b'\n'):
+            chunks = line.split()
+            if len(chunks) == 0:
+                # If the line is a blank line, then ignore it.
+                continue
+            elif chunks[0] == b'#' and chunks[1] == b'Query:':
+                # The end of a round has been reached.
+                nextQuery = chunks[2]
+                if currentQuery != nextQuery:
+                    # A new query has been found. Record the hits from the last query.
+                    record_hits(currentQuery, hitsFound)
+                currentQuery = nextQuery
+                hitsFound = {}
+            elif chunks[0] == currentQuery:
+                # An alignment is recorded on the line if the line starts with the query protein.
+                if int(chunks[3]) >= minAlignLength and float(chunks[4]) <= maxEValue:
+                    hit = chunks[1]
+                    similarity = float(chunks[2])
+                    if minSimilarity is None or similarity >= minSimilarity:
+                        hitsFound[hit] = similarity
+                    elif hit in hitsFound:
+                        # A later alignment of the same hit replaces any earlier one.
+                        del hitsFound[hit]
+        blockStart = blockEnd
     BLASTOutput.close()
+    readIn.close()
 
-    return similaritiesFound
\ No newline at end of file
+    # Record the hits from the final query in the chunk.
+    record_hits(currentQuery, hitsFound)
+    return similaritiesFound
@@ -5,11 +5,17 @@ Created on 5 Feb 2011
 '''
 
 import argparse
+import bisect
+import json
 import os
 import shutil
 import sys
 
 import checkfastaformat
+import collapsesequences
+import commandline
+import fastaindex
+import kmersimilarity
 import performBLAST
 import Leafcull
 
@@ -34,26 +40,65 @@ def main():
                                              'A server to perform the culling can be found at http://leaf-protein-culling.appspot.com/.')
                                      )
     parser.add_argument('inputFile', help='The location of the input FASTA file.')
-    parser.add_argument('-p', '--percent', help='The maximum percent sequence identity between sequences 5 <= maxPercent < 100 must be true. (Required type: %(type)s, default value: %(default)s).',
-                        metavar="maxPercent", type=float, default=20, required=False)
+    parser.add_argument('-p', '--percent', help='The maximum percent sequence identity between sequences 5 <= maxPercent < 100 must be true. ' +
+                                                'Multiple values and inclusive ranges of the form start:stop:step (e.g. 20:90:5) can be given, in which case a culling is performed at each value, ' +
+                                                'and the results for each value are saved in a subdirectory of the output directory. (Required type: %(type)s, default value: 20).',
+                        metavar="maxPercent", type=commandline.percent_values, nargs='+', default=[[20.0]], required=False)
     parser.add_argument('-m', '--minLen', help='The maximum sequence length permissible. A negative value means not to use a minimum sequence length. Must not be greater than the maximum sequence length. (Required type: %(type)s, default value: Not Used).',
                         metavar="minLength", type=int, required=False, default=-1)
     parser.add_argument('-a', '--maxLen', help='The minimum sequence length permissible A negative value means not to use a maximum sequence length. Must not be less than the minimum sequence length. (Required type: %(type)s, default value: Not Used).',
                         metavar="maxLength", type=int, required=False, default=-1)
     parser.add_argument('-c', '--cores', help='The number of processor cores to use for BLASTing. (Required type: %(type)s, default value: %(default)s).',
                         metavar="cores", type=int, default=2, required=False)
+    parser.add_argument('-b', '--blastProcesses', help='The number of PSI-BLAST processes to run at once. When greater than 1 the input sequences are split into shards (balanced by the number of residues) that are BLASTed concurrently, and the cores are divided between the processes. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="blastProcesses", type=int, default=1, required=False)
+    parser.add_argument('-n', '--processes', help='The number of processes to use for parsing the BLAST output and for the culling. When greater than 1 large BLAST outputs are parsed in parallel, and the connected components of the similarity graph are culled in parallel. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="processes", type=int, default=1, required=False)
+    parser.add_argument('--engine', help='The method used to determine the similarities between the sequences. The kmer engine estimates the sequence identity from the number of shared k-mers, ' +
+                                             'which is much faster than PSI-BLAST but approximate, and so is best suited to exploratory culls at high thresholds. Requires NumPy. (Default value: %(default)s).',
+                        choices=['blast', 'kmer'], default='blast', required=False)
+    parser.add_argument('--prefilter', help='Whether to only use as BLAST queries the sequences that share a long enough run of residues with another sequence to possibly be similar enough to it to be culled. Every sequence is still in the BLAST database. Not used with --cache. Requires NumPy. (Default value: Not used).',
+                        action='store_true', default=False, required=False)
+    parser.add_argument('--collapse', help='Whether to BLAST only one representative of each group of identical sequences (exact), or of each group of sequences that are identical to or contained in a longer sequence (contained). ' +
+                                               'The members of each group are treated as 100%% similar to each other, and as having the similarities of their representative. (Default value: Not used).',
+                        choices=['exact', 'contained'], default=None, required=False)
+    parser.add_argument('--cache', help='The location of a directory in which to cache BLAST results between runs. Only the sequences that were not in the last run using the cache are BLASTed against all the sequences, and the cached results are reused for the rest. (Required type: %(type)s, default value: Not used).',
+                        metavar="cacheDir", type=str, default=None, required=False)
+    parser.add_argument('--databaseCache', help='The location of a directory in which to keep the BLAST databases made from the input sequences, so that runs on the same sequences (e.g. at different thresholds) reuse them. (Required type: %(type)s, default value: Not used).',
+                        metavar="databaseCacheDir", type=str, default=None, required=False)
+    parser.add_argument('--databaseCacheSize', help='The maximum total size (in MB) of the databases kept in the database cache. The least recently used databases are deleted once the limit is exceeded. (Required type: %(type)s, default value: %(default)s).',
+                        metavar="megabytes", type=int, default=10240, required=False)
+    parser.add_argument('--pipe', help='Whether to parse the PSI-BLAST output as it is produced (through a pipe), rather than writing it to a file and parsing it once PSI-BLAST has finished. (Default value: Not used).',
+                        action='store_true', default=False, required=False)
+    parser.add_argument('--keepBLAST', help='Whether to keep the BLAST files (including the PSI-BLAST output) in a BLASTOutput directory in the output directory, for debugging. (Default value: Not used).',
+                        action='store_true', default=False, required=False)
     parser.add_argument('-o', '--output', help='The name of the output directory to create in the current working directory. (Required type: %(type)s, default value: a directory called %(default)s in the current working directory).',
                         metavar="outputFolder", type=str, default='CullResults', required=False)
+    parser.add_argument('--profile', help='Whether to save statistics about the culling (counts of the operations performed and the time spent in each phase) to Profile.json in the output directory. (Default value: Not used).',
+                        action='store_true', default=False, required=False)
     parser.add_argument('-v', '--verbose', help='Whether status updates should be displayed. (Default value: No status updates).',
                         action='store_true', default=False, required=False)
     args = parser.parse_args()
 
     inputFile = args.inputFile
-    sequenceIdentity = args.percent
+    sequenceIdentities = []
+    for i in args.percent:
+        sequenceIdentities.extend(j for j in i if j not in sequenceIdentities)
     minLength = args.minLen
     maxLength = args.maxLen
     cores = args.cores
     cullOperationID = args.output
+    engine = args.engine
+    prefilter = args.prefilter
+    collapse = args.collapse
+    cacheDir = args.cache
+    databaseCacheDir = args.databaseCache
+    databaseCacheSize = args.databaseCacheSize
+    pipeOutput = args.pipe
+    keepOutput = args.keepBLAST
+    blastProcesses = args.blastProcesses
+    cullProcesses = args.processes
+    saveProfile = args.profile
     verboseOutput = args.verbose
 
     #===========================================================================
@@ -64,7 +109,7 @@ def main():
         print('The location supplied for the file of input sequences is not a valid file location.')
         toExit = True
 
-    if sequenceIdentity < 5 or sequenceIdentity >= 100:
+    if any(i < 5 or i >= 100 for i in sequenceIdentities):
         print('The maximum allowable percentage sequence similarity must be no less than 5, and less than 100.')
         toExit = True
 
@@ -77,6 +122,30 @@ def main():
         print('The minimum sequence length must be less than the maximum sequence length.')
         toExit = True
 
+    if cacheDir is not None and os.path.exists(cacheDir) and not os.path.isdir(cacheDir):
+        print('The location supplied for the BLAST cache is not a directory.')
+        toExit = True
+
+    if databaseCacheDir is not None and os.path.exists(databaseCacheDir) and not os.path.isdir(databaseCacheDir):
+        print('The location supplied for the database cache is not a directory.')
+        toExit = True
+
+    if databaseCacheSize < 0:
+        print('The maximum size of the database cache must not be negative.')
+        toExit = True
+
+    if (engine == 'kmer' or prefilter) and kmersimilarity.numpy is None:
+        print('The kmer engine and the prefilter require NumPy to be installed.')
+        toExit = True
+
+    if blastProcesses < 1:
+        print('The number of PSI-BLAST processes must be at least 1.')
+        toExit = True
+
+    if cullProcesses < 1:
+        print('The number of processes to use for the culling must be at least 1.')
+        toExit = True
+
     if toExit:
         sys.exit()
 
@@ -108,80 +177,168 @@ def main():
         print('Validating the input file.')
     fileToBLAST = outputLocation + '/InputCopy.fasta'
     inputFileToLoad = open(inputFile, 'r')
-    inputFile = inputFileToLoad.read()
+    # The index records UTF-8 byte offsets that assume single newline characters, so the copy and its index are written
+    # as UTF-8 with '\n' line endings whatever the platform and locale.
+    writeOut = open(fileToBLAST, 'w', encoding='utf-8', newline='\n')
+    writeOutIndex = open(fileToBLAST + fastaindex.INDEX_EXTENSION, 'w', encoding='utf-8', newline='\n')
+    errorCode, message = checkfastaformat.main(inputFileToLoad, writeOut, minLength, maxLength, writeOutIndex)
+    writeOut.close()
+    writeOutIndex.close()
     inputFileToLoad.close()
-    errorCode, message = checkfastaformat.main(inputFile, minLength, maxLength)
     if errorCode != 0:
         print(message)
         sys.exit()
-    writeOut = open(fileToBLAST, 'w')
-    writeOut.write(message)
-    writeOut.close()
 
-    # Perform the BLASTing.
-    similarities = performBLAST.main(fileToBLAST, outputLocation + '/BLASTOutput', cores, verboseOutput=verboseOutput)
+    # Group the redundant sequences, so that only one representative of each group is BLASTed.
+    groups = {}
+    representativeFile = fileToBLAST
+    if collapse is not None:
+        if verboseOutput:
+            print('Collapsing redundant sequences.')
+        representativeFile = outputLocation + '/Representatives.fasta'
+        groups = collapsesequences.main(fileToBLAST, representativeFile, collapse == 'contained')
+        if verboseOutput:
+            print('{0} sequences were collapsed into the sequences representing them.'.format(sum(len(i) for i in groups.values())))
+
+    # Determine the similarities (by BLASTing, unless the k-mer engine is used). Only the similarities at or above the lowest
+    # threshold are kept.
+    minSequenceIdentity = min(sequenceIdentities)
+    if engine == 'kmer':
+        if verboseOutput:
+            print('Now estimating similarities from shared k-mers.')
+        similarities = kmersimilarity.main(representativeFile, minSimilarity=minSequenceIdentity)
+    else:
+        try:
+            similarities = performBLAST.main(representativeFile, outputLocation + '/BLASTOutput', cores, minSimilarity=minSequenceIdentity,
+                                             parseProcesses=cullProcesses, blastProcesses=blastProcesses, cacheDir=cacheDir,
+                                             pipeOutput=pipeOutput, keepOutput=keepOutput, databaseCacheDir=databaseCacheDir,
+                                             databaseCacheSize=databaseCacheSize * (1 << 20), prefilter=prefilter,
+                                             verboseOutput=verboseOutput)
+        except RuntimeError as e:
+            # The BLAST database could not be made.
+            print(e)
+            sys.exit()
+    if collapse is not None:
+        # Give the members of each group the similarities of the representative of the group.
+        os.remove(representativeFile)
+        similarities = collapsesequences.expand(similarities, groups)
+
+    # Sort the similarities from most to least similar. The similarities at or above any threshold are then a prefix of
+    # the list.
+    similarities = [(similarities[i], i[0], i[1]) for i in similarities]
+    similarities.sort(key=lambda x: x[0], reverse=True)
+    negatedSimilarities = [-i[0] for i in similarities]
+
+    # Perform the culling at each threshold.
+    for sequenceIdentity in sequenceIdentities:
+        if len(sequenceIdentities) == 1:
+            thresholdOutputLocation = outputLocation
+        else:
+            if verboseOutput:
+                print('Culling at {0:g}% sequence identity.'.format(sequenceIdentity))
+            thresholdOutputLocation = outputLocation + '/Percent{0:g}'.format(sequenceIdentity)
+            os.mkdir(thresholdOutputLocation)
+        numSimilarities = bisect.bisect_right(negatedSimilarities, -sequenceIdentity)
+        cull_and_save(similarities[:numSimilarities], fileToBLAST, thresholdOutputLocation, cullProcesses, saveProfile, verboseOutput)
+
+
+def cull_and_save(similarities, fileToBLAST, outputLocation, cullProcesses=1, saveProfile=False, verboseOutput=False):
+    """Cull the proteins that are too similar and save the removed and kept proteins.
+
+    :param similarities:    The similarities between pairs of proteins that are too similar, as (similarity, proteinA, proteinB) tuples.
+    :type similarities:     list
+    :param fileToBLAST:     The location of the validated FASTA file of the proteins.
+    :type fileToBLAST:      string
+    :param outputLocation:  The directory to save the results in.
+    :type outputLocation:   string
+    :param cullProcesses:   The number of processes to use for the culling.
+    :type cullProcesses:    integer
+    :param saveProfile:     Whether to save the culling statistics to Profile.json in the output directory.
+    :type saveProfile:      boolean
+    :param verboseOutput:   Whether status updates should be displayed.
+    :type verboseOutput:    boolean
+
+    """
 
     # Create the adjacency matrix of the protein similarity graph.
     if verboseOutput:
         print('Creating the adjacency matrix')
-    adjList = {}
-    for i in similarities:
-        chainA = i[0]
-        chainB = i[1]
-        seqIden = similarities[i]
-        if seqIden >= sequenceIdentity:
-            # The sequences are too similar.
-            if chainA in adjList:
-                adjList[chainA].add(chainB)
-            else:
-                adjList[chainA] = set([chainB])
-            if chainB in adjList:
-                adjList[chainB].add(chainA)
-            else:
-                adjList[chainB] = set([chainA])
+    adjList = Leafcull.create_adjacency(similarities)
 
     # Choose which proteins to remove from the similarity graph.
     if verboseOutput:
         print('Performing the culling.')
-    proteinsToCull = Leafcull.main(adjList)
+    cullStats = {} if saveProfile else None
+    if cullProcesses > 1:
+        proteinsToCull = Leafcull.parallel_main(adjList, cullProcesses, stats=cullStats)
+    else:
+        proteinsToCull = Leafcull.main(adjList, stats=cullStats)
 
     if verboseOutput:
         print('Writing out the results.')
 
+    save_results(proteinsToCull, fileToBLAST, outputLocation)
+
+    # Write out the culling statistics.
+    if saveProfile:
+        writeOutProfile = open(outputLocation + '/Profile.json', 'w')
+        json.dump(cullStats, writeOutProfile, indent=4, sort_keys=True)
+        writeOutProfile.close()
+
+
+def save_results(proteinsToCull, fileToBLAST, outputLocation):
+    """Save the removed proteins, and the list and FASTA file of the proteins kept.
+
+    :param proteinsToCull:  The proteins removed by the culling.
+    :type proteinsToCull:   list
+    :param fileToBLAST:     The location of the validated FASTA file of the proteins.
+    :type fileToBLAST:      string
+    :param outputLocation:  The directory to save the results in.
+    :type outputLocation:   string
+
+    """
+
     # Write out the proteins that were removed.
     writeOutRem = open(outputLocation + '/Removed.txt', 'w')
     for i in proteinsToCull:
         writeOutRem.write(i + '\n')
     writeOutRem.close()
 
-    # Write out a FASTA file of the proteins kept.
-    writeOutKeepFasta = open(outputLocation + '/KeptFasta.fasta', 'w')
+    # Determine the proteins kept. A protein is removed if its description line starts with the identifier of a removed
+    # protein, and so the start of each description line is looked up for each distinct length of removed identifier.
+    removedProteins = set(proteinsToCull)
+    removedLengths = sorted(set(len(i) for i in removedProteins))
+    keptRecords = []
+    uniqueProteins = set()  # Used to ensure no duplicates get through.
+    for entry in fastaindex.load(fileToBLAST):
+        description = entry[0]
+        notInToCull = not any(description[:i] in removedProteins for i in removedLengths if i <= len(description))
+        if notInToCull and not description in uniqueProteins:
+            uniqueProteins.add(description)
+            keptRecords.append(entry)
+
+    # Write out a list of the proteins kept.
     writeOutKeepList = open(outputLocation + '/KeptList.txt', 'w')
     writeOutKeepList.write('IDs\tLength\n')
-    readFasta = open(fileToBLAST, 'r')
-    recording = False
-    uniqueProteins = []  # Used to ensure no duplicates get through.
-    for line in readFasta:
-        if line[0] == '>':
-            notInToCull = len([i for i in proteinsToCull if line[1 : len(i) + 1] == i]) == 0
-            if notInToCull and not line in uniqueProteins:
-                # If the line starts a new protein definition, and that protein is one of the ones to keep.
-                recording = True
-                uniqueProteins.append(line)
-                writeOutKeepFasta.write(line)
-                writeOutKeepList.write(line[1:-1])
-            else:
-                # If the line start a new protein definition, but the protein is not one of the ones to keep.
-                recording = False
-        else:
-            # Otherwise the line is a protein sequence.
-            if recording:
-                # If we are currently working on a protein that is being kept.
-                writeOutKeepFasta.write(line)
-                writeOutKeepList.write('\t' + str(len(line[:-1])) + '\n')
-    readFasta.close()
+    for description, _, length in keptRecords:
+        writeOutKeepList.write(description + '\t' + str(length) + '\n')
     writeOutKeepList.close()
+
+    # Write out a FASTA file of the proteins kept, copying each run of consecutive kept records at once.
+    writeOutKeepFasta = open(outputLocation + '/KeptFasta.fasta', 'wb')
+    readFasta = open(fileToBLAST, 'rb')
+    runStart = runEnd = 0
+    for entry in keptRecords:
+        if entry[1] != runEnd:
+            readFasta.seek(runStart)
+            writeOutKeepFasta.write(readFasta.read(runEnd - runStart))
+            runStart = entry[1]
+        runEnd = fastaindex.record_end(entry)
+    readFasta.seek(runStart)
+    writeOutKeepFasta.write(readFasta.read(runEnd - runStart))
+    readFasta.close()
     writeOutKeepFasta.close()
 
+
 if __name__ == '__main__':
     main()